@@ -1,29 +1,61 @@
+from bill_tracker.db.backup_io import (
+    BACKUP_CONTAINER_VERSION,
+    backup_mime_type,
+    export_backup_json,
+    open_backup,
+)
+from bill_tracker.db.catalog import BackupCatalog
 from bill_tracker.db.database import (
     BACKUP_VERSION,
     BillDatabase,
+    PRE_RESTORE_MODE,
+    PRE_RESTORE_SHADOW,
+    PRE_RESTORE_SNAPSHOT,
     RESTORE_MODE_BILLS_ONLY,
     RESTORE_MODE_FULL_REPLACE,
     RESTORE_MODE_MERGE,
     TARGET_DB_NAME,
 )
+from bill_tracker.db.offline import DatabaseUnavailableError
+from bill_tracker.db.partitions import backup_download
+from bill_tracker.db.scheduler import BackupScheduler, load_scheduler_state
+from bill_tracker.db.snapshot_diff import SnapshotDiff, diff_snapshots
 from bill_tracker.paths import (
+    get_catalog_path,
     get_data_root,
     get_manifest_path,
+    get_partitions_dir,
     get_pre_restore_dir,
     get_snapshots_dir,
     get_yearly_dir,
 )
 
 __all__ = [
+    'BACKUP_CONTAINER_VERSION',
     'BACKUP_VERSION',
+    'BackupCatalog',
+    'BackupScheduler',
     'BillDatabase',
+    'DatabaseUnavailableError',
+    'PRE_RESTORE_MODE',
+    'PRE_RESTORE_SHADOW',
+    'PRE_RESTORE_SNAPSHOT',
     'RESTORE_MODE_BILLS_ONLY',
     'RESTORE_MODE_FULL_REPLACE',
     'RESTORE_MODE_MERGE',
+    'SnapshotDiff',
     'TARGET_DB_NAME',
+    'backup_download',
+    'backup_mime_type',
+    'diff_snapshots',
+    'export_backup_json',
+    'get_catalog_path',
     'get_data_root',
     'get_manifest_path',
+    'get_partitions_dir',
     'get_pre_restore_dir',
     'get_snapshots_dir',
     'get_yearly_dir',
+    'load_scheduler_state',
+    'open_backup',
 ]
@@ -0,0 +1,384 @@
+"""冷热分层归档：把超出热数据期限的账单按年移入归档集合，并在 data/yearly/ 写出一次性导出。"""
+import os
+from datetime import datetime
+
+import pymongo
+from bson import ObjectId
+from loguru import logger
+
+from bill_tracker.db.backup_io import (
+    CONTAINER_EXTENSION,
+    ENCODING_BSON,
+    ContainerBackupWriter,
+    open_backup,
+    restored_document,
+)
+from bill_tracker.paths import get_yearly_dir
+
+ARCHIVE_COLLECTION_PREFIX = 'bills_archive_'
+ARCHIVE_META_COLLECTION = 'bill_archive_meta'
+# 归档年份集合的版本记录：年份增减时换新令牌，各进程据此判断缓存是否过期（内部集合，不参与备份）
+ARCHIVE_VERSION_COLLECTION = 'bill_archive_version'
+ARCHIVE_VERSION_ID = 'archived_years'
+DEFAULT_HOT_YEARS = 2
+
+
+def archive_collection_name(year):
+    return f'{ARCHIVE_COLLECTION_PREFIX}{int(year)}'
+
+
+def year_match(year):
+    """与 _build_year_filter 一致的年份条件（bill_date 按整数比较）"""
+    return {
+        '$expr': {
+            '$and': [
+                {'$gte': [{'$toInt': '$bill_date'}, int(f'{year}0101')]},
+                {'$lte': [{'$toInt': '$bill_date'}, int(f'{year}1231')]},
+            ]
+        }
+    }
+
+
+def export_path_for(meta):
+    """归档导出文件的绝对路径（元数据只记文件名，data 目录可随部署变化）"""
+    export_file = (meta or {}).get('export_file')
+    return os.path.join(get_yearly_dir(), export_file) if export_file else None
+
+
+def exported_archive_collections(db):
+    """
+    已有最新导出文件的归档集合（冻结年份），备份时无需重复序列化
+
+    :return: {集合名: 元数据}
+    """
+    frozen = {}
+    for meta in db[ARCHIVE_META_COLLECTION].find({'export_file': {'$ne': None}}):
+        path = export_path_for(meta)
+        if path and os.path.exists(path) and meta.get('export_count') == meta.get('count'):
+            frozen[meta['collection']] = meta
+    return frozen
+
+
+class BillArchive:
+    """
+    账单冷热分层
+
+    热数据留在 bills；早于期限（默认保留最近 2 个自然年）的年份整体移入
+    bills_archive_<年份>。查询按需 $unionWith 冷数据，归档后的年份只导出一次。
+    已归档年份在进程内缓存，每次使用前按 _id 读取一条版本记录校验：其他进程（归档脚本、
+    调度器、恢复）改变年份后版本令牌不同，缓存立即失效。
+    """
+
+    def __init__(self, db, hot_collection_name='bills', on_write=None):
+        """
+        :param db: pymongo Database
+        :param hot_collection_name: 热数据集合名
+        :param on_write: 移动账单后回调 on_write(集合名, partitions=[YYYYMM...], count=条数)，
+            用于标记摘要分区与累加写入计数
+        """
+        self.db = db
+        self.on_write = on_write
+        self.hot = db[hot_collection_name]
+        self.meta = db[ARCHIVE_META_COLLECTION]
+        self.version = db[ARCHIVE_VERSION_COLLECTION]
+        self._years_cache = None
+        self._years_version = None
+
+    def _notify_moved(self, year, collection_names, count):
+        """归档/回迁后通知写入：一年的 12 个月分区在源与目标集合中都有变化"""
+        if not self.on_write or not count:
+            return
+        partitions = [f'{int(year)}{month:02d}' for month in range(1, 13)]
+        for name in collection_names:
+            self.on_write(name, partitions=partitions, count=count)
+
+    @staticmethod
+    def hot_years_from_env():
+        try:
+            return max(1, int(os.getenv('ARCHIVE_HOT_YEARS', DEFAULT_HOT_YEARS)))
+        except ValueError:
+            return DEFAULT_HOT_YEARS
+
+    def archived_years(self, refresh=False):
+        """已归档年份集合（版本令牌未变时使用缓存，不必每次查询都读元数据）"""
+        try:
+            # 先读版本再读年份：两次读取之间的变更会让下次校验再次失效
+            version = (self.version.find_one({'_id': ARCHIVE_VERSION_ID}) or {}).get('token')
+            if refresh or self._years_cache is None or version != self._years_version:
+                self._years_cache = {int(m['_id']) for m in self.meta.find({}, {'_id': 1})}
+                self._years_version = version
+        except Exception as e:
+            logger.warning(f"读取归档元数据失败: {e}")
+            self._years_cache = set()
+            self._years_version = None
+        return self._years_cache
+
+    def mark_changed(self):
+        """归档年份增减后换新版本令牌，并刷新本进程缓存"""
+        self.version.update_one(
+            {'_id': ARCHIVE_VERSION_ID},
+            {'$set': {'token': ObjectId(), 'changed_at': datetime.now()}},
+            upsert=True,
+        )
+        return self.archived_years(refresh=True)
+
+    def collections_for_years(self, years=None):
+        """
+        查询涉及的归档集合
+
+        :param years: 查询覆盖的年份；None 表示不限年份（涉及全部归档）
+        :return: 集合名列表（按年份升序）
+        """
+        archived = self.archived_years()
+        if years is not None:
+            archived = archived & {int(y) for y in years}
+        return [archive_collection_name(y) for y in sorted(archived)]
+
+    def union_pipeline(self, match, years=None):
+        """热表 $match，查询范围触及归档年份时再 $unionWith 对应冷集合"""
+        pipeline = [{'$match': match}]
+        for coll in self.collections_for_years(years):
+            pipeline.append({'$unionWith': {'coll': coll, 'pipeline': [{'$match': match}]}})
+        return pipeline
+
+    def eligible_years(self, hot_years=None):
+        """热表中早于期限、应当归档的年份"""
+        hot_years = hot_years or self.hot_years_from_env()
+        cutoff = datetime.now().year - hot_years
+        years = set()
+        for item in self.hot.aggregate([
+            {'$group': {'_id': {'$substr': ['$bill_date', 0, 4]}}},
+        ]):
+            try:
+                year = int(item['_id'])
+            except (TypeError, ValueError):
+                continue
+            if year <= cutoff:
+                years.add(year)
+        return sorted(years)
+
+    def archive_year(self, year, export=True):
+        """
+        将一个年份从热表移入归档集合（服务端 $merge，不经过 Python）
+
+        以开始时的最大 _id 为界，归档期间新写入的同年份账单留在热表，下次再归档。
+
+        :return: 结果字典
+        """
+        match = year_match(year)
+        last = list(self.hot.find(match, {'_id': 1}).sort('_id', -1).limit(1))
+        if not last:
+            return {'success': True, 'year': year, 'moved': 0}
+
+        bounded = {'$and': [match, {'_id': {'$lte': last[0]['_id']}}]}
+        expected = self.hot.count_documents(bounded)
+        coll_name = archive_collection_name(year)
+        self.hot.aggregate([
+            {'$match': bounded},
+            {'$merge': {
+                'into': coll_name,
+                'on': '_id',
+                'whenMatched': 'replace',
+                'whenNotMatched': 'insert',
+            }},
+        ])
+        archive = self.db[coll_name]
+        archived_ids = archive.count_documents({'_id': {'$lte': last[0]['_id']}})
+        if archived_ids < expected:
+            raise RuntimeError(f'{year} 年归档校验失败: 期望 {expected} 条，归档集合仅 {archived_ids} 条')
+
+        moved = self.hot.delete_many(bounded).deleted_count
+        self._notify_moved(year, [self.hot.name, coll_name], moved)
+        archive.create_index([('bill_date', pymongo.ASCENDING)])
+        archive.create_index([('type', pymongo.ASCENDING)])
+        total = archive.count_documents({})
+        self.meta.update_one(
+            {'_id': int(year)},
+            {'$set': {
+                'collection': coll_name,
+                'count': total,
+                'archived_at': datetime.now(),
+            }},
+            upsert=True,
+        )
+        self.mark_changed()
+        logger.info(f"{year} 年账单已归档: {moved} 条 -> {coll_name}（共 {total} 条）")
+
+        result = {'success': True, 'year': year, 'moved': moved, 'collection': coll_name, 'count': total}
+        if export:
+            result['export_path'] = self.export_year(year)
+        return result
+
+    def export_year(self, year):
+        """
+        将归档年份导出到 data/yearly/bills_<年份>.jzb（冻结后只写一次）
+
+        导出为块内原始 BSON 的容器格式，ObjectId、日期与 int64 金额无损保留，恢复时原样写回；
+        早期的 .json 导出仍可读取，再次导出时改写为容器格式（旧文件留给引用它的快照）。
+
+        :return: 导出文件路径
+        """
+        coll_name = archive_collection_name(year)
+        meta = self.meta.find_one({'_id': int(year)}) or {}
+        export_file = f'bills_{int(year)}{CONTAINER_EXTENSION}'
+        path = os.path.join(get_yearly_dir(), export_file)
+        if (meta.get('export_file') == export_file and os.path.exists(path)
+                and meta.get('export_count') == meta.get('count')):
+            return path
+
+        os.makedirs(get_yearly_dir(), exist_ok=True)
+        with ContainerBackupWriter(path, self.db.name, encoding=ENCODING_BSON) as writer:
+            count = writer.write_collection(coll_name, self.db[coll_name])['count']
+            writer.finish({
+                'backup_time': datetime.now().isoformat(),
+                'database_name': self.db.name,
+                'type': 'yearly_archive',
+                'year': int(year),
+            })
+        self.meta.update_one(
+            {'_id': int(year)},
+            {'$set': {'export_file': export_file, 'export_count': count, 'exported_at': datetime.now()}},
+        )
+        logger.info(f"{year} 年归档已导出: {path}（{count} 条）")
+        return path
+
+    def run(self, hot_years=None, dry_run=False):
+        """
+        归档所有超出热数据期限的年份
+
+        :return: {'years': [...], 'results': [...]}
+        """
+        years = self.eligible_years(hot_years)
+        if dry_run:
+            return {'success': True, 'years': years, 'results': [], 'dry_run': True}
+        results = [self.archive_year(year) for year in years]
+        return {'success': True, 'years': years, 'results': results}
+
+    def unarchive_year(self, year):
+        """将归档年份移回热表（需要修改历史账单时使用）"""
+        coll_name = archive_collection_name(year)
+        if int(year) not in self.archived_years(refresh=True):
+            return {'success': False, 'message': f'{year} 年未归档'}
+        self.db[coll_name].aggregate([
+            {'$merge': {'into': self.hot.name, 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+        ])
+        moved = self.db[coll_name].count_documents({})
+        self.db[coll_name].drop()
+        self.meta.delete_one({'_id': int(year)})
+        self.mark_changed()
+        self._notify_moved(year, [self.hot.name, coll_name], moved)
+        logger.info(f"{year} 年归档已移回热表: {moved} 条")
+        return {'success': True, 'year': year, 'moved': moved}
+
+    def live_years(self):
+        """现网涉及的归档年份：元数据与 bills_archive_<年份> 集合的并集"""
+        years = {int(meta['_id']) for meta in self.meta.find({}, {'_id': 1})}
+        for name in self.db.list_collection_names():
+            suffix = name[len(ARCHIVE_COLLECTION_PREFIX):]
+            if name.startswith(ARCHIVE_COLLECTION_PREFIX) and suffix.isdigit():
+                years.add(int(suffix))
+        return years
+
+    def reconcile(self, archive_state, archived_info, snapshot_collections=(), years=None):
+        """
+        替换式恢复后使归档集合与元数据和快照一致（之后由 ensure_collections_restored 补齐冻结年份）
+
+        - 快照时尚未归档的年份：删除归档集合与元数据，这些账单已随热表恢复，否则 $unionWith 会重复计数；
+        - 快照中冻结的年份：现网归档集合条数与快照记录不符时删除，随后从年度导出重建；
+        - 快照中未冻结的归档年份：归档集合已随快照恢复，元数据按实际条数重写。
+
+        :param archive_state: 快照 backup_info['archive_state']（{年份: 条数}），旧快照没有时为 None
+        :param archived_info: 快照 backup_info['archived_years']
+        :param snapshot_collections: 快照中的集合名（旧快照据此推断归档年份）
+        :param years: 按年恢复时只处理这些年份
+        :return: 删除的归档集合名列表
+        """
+        archived_info = {int(year): info for year, info in (archived_info or {}).items()}
+        if archive_state is None:
+            archive_state = {year: info.get('count') for year, info in archived_info.items()}
+            for name in snapshot_collections:
+                suffix = name[len(ARCHIVE_COLLECTION_PREFIX):]
+                if name.startswith(ARCHIVE_COLLECTION_PREFIX) and suffix.isdigit():
+                    archive_state.setdefault(int(suffix), None)
+        snapshot_years = {int(year) for year in archive_state}
+        scope = {int(year) for year in years} if years else None
+
+        live_collections = set(self.db.list_collection_names())
+        dropped = []
+        for year in sorted(self.live_years() | snapshot_years):
+            if scope is not None and year not in scope:
+                continue
+            coll_name = archive_collection_name(year)
+            if year in snapshot_years and year not in archived_info:
+                self.meta.update_one(
+                    {'_id': year},
+                    {
+                        '$set': {'collection': coll_name, 'count': self.db[coll_name].count_documents({})},
+                        '$setOnInsert': {'archived_at': datetime.now()},
+                        '$unset': {'export_file': '', 'export_count': ''},
+                    },
+                    upsert=True,
+                )
+                continue
+            info = archived_info.get(year)
+            if info and self.db[coll_name].count_documents({}) == info.get('count'):
+                self.meta.update_one(
+                    {'_id': year},
+                    {
+                        '$set': {
+                            'collection': coll_name,
+                            'count': info['count'],
+                            'export_file': info.get('export_file'),
+                            'export_count': info['count'],
+                        },
+                        '$setOnInsert': {'archived_at': datetime.now()},
+                    },
+                    upsert=True,
+                )
+                continue
+            existed = coll_name in live_collections
+            self.db[coll_name].drop()
+            if self.meta.delete_one({'_id': year}).deleted_count or existed:
+                dropped.append(coll_name)
+        self.mark_changed()
+        if dropped:
+            logger.info(f"已按快照移除归档集合: {dropped}")
+        return dropped
+
+    def ensure_collections_restored(self, archived_info):
+        """
+        恢复后补齐缺失的归档集合（快照只引用冻结年份的导出文件）
+
+        导出按块流式读取、逐批写入，内存与年份大小无关；文档经 restored_document 还原
+        （容器导出原样写回，旧 JSON 导出还原 _id、updated_at 与整数分金额）。
+
+        :param archived_info: 备份 backup_info['archived_years']
+        :return: 补齐的集合名列表
+        """
+        restored = []
+        for year, info in (archived_info or {}).items():
+            coll_name = info.get('collection') or archive_collection_name(year)
+            path = export_path_for(info)
+            if self.db[coll_name].estimated_document_count() > 0 or not path or not os.path.exists(path):
+                continue
+            count = 0
+            with open_backup(path) as reader:
+                for batch in reader.iter_document_batches(coll_name, raw=True):
+                    self.db[coll_name].insert_many([restored_document(doc) for doc in batch], ordered=False)
+                    count += len(batch)
+            self.meta.update_one(
+                {'_id': int(year)},
+                {'$set': {
+                    'collection': coll_name,
+                    'count': count,
+                    'archived_at': datetime.now(),
+                    'export_file': info['export_file'],
+                    'export_count': count,
+                }},
+                upsert=True,
+            )
+            restored.append(coll_name)
+        if restored:
+            self.mark_changed()
+            logger.info(f"已从年度导出补齐归档集合: {restored}")
+        return restored
@@ -0,0 +1,853 @@
+"""
+备份文件读写
+
+- 3.x 容器格式（.jzb，默认）：魔数 + 头部长度 + 未压缩 JSON 头部（backup_info、
+  collection_stats、分块索引、文档编码）+ 按集合分块的 gzip 帧；预览只读头部，恢复逐块读取。
+  3.1 起块内默认为连续的原始 BSON 文档（与 mongodump 相同，自带长度前缀，类型无损），
+  恢复时以 RawBSONDocument 原样写回；3.0 的块为 NDJSON。
+- 2.1 JSON 格式（.json）：流式写出，backup_info 作为尾部写在文件末尾；旧文件仍可读取。
+  任意备份都可用 export_backup_json 导出为 MongoDB 扩展 JSON 供人工查看（同样可恢复）。
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime
+
+import bson
+from bson import ObjectId, json_util
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidId
+from bson.int64 import Int64
+from bson.raw_bson import RawBSONDocument
+from loguru import logger
+
+from bill_tracker.money import AMOUNT_FIELD, LEGACY_AMOUNT_FIELD, bill_amount_cents
+from bill_tracker.paths import get_partitions_dir
+
+BACKUP_CONTAINER_VERSION = '3.1'
+CONTAINER_MAGIC = b'JZBACKUP'
+CONTAINER_EXTENSION = '.jzb'
+JSON_EXTENSION = '.json'
+BACKUP_EXTENSIONS = (CONTAINER_EXTENSION, JSON_EXTENSION)
+# 新备份使用的格式：container（默认）或 json
+BACKUP_FORMAT = os.getenv('BACKUP_FORMAT', 'container').strip().lower()
+# 服务端游标每批拉取的文档数，可用 BACKUP_BATCH_SIZE 覆盖
+BACKUP_BATCH_SIZE = int(os.getenv('BACKUP_BATCH_SIZE', '1000'))
+# 容器格式每个压缩块包含的文档数
+BACKUP_CHUNK_DOCUMENTS = int(os.getenv('BACKUP_CHUNK_DOCUMENTS', '5000'))
+# 容器块内的文档编码：bson（默认，类型无损）或 json（3.0 的 NDJSON）
+ENCODING_BSON = 'bson'
+ENCODING_JSON = 'json'
+BACKUP_ENCODING = os.getenv('BACKUP_ENCODING', ENCODING_BSON).strip().lower()
+RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+# 扩展 JSON 导出：relaxed 模式下日期为 ISO 字符串、数字保持原样，便于阅读
+EXPORT_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.RELAXED)
+# 读取尾部 backup_info 时从文件末尾读取的字节数
+TRAILER_READ_BYTES = 256 * 1024
+TRAILER_MARKER = b',"backup_info":'
+_HEADER_LENGTH = struct.Struct('>Q')
+_COPY_BUFFER_BYTES = 1024 * 1024
+# JSON 数字可能包含的字符（增量解析判断数字是否被读缓冲截断）
+_NUMBER_CHARS = '0123456789+-.eE'
+# 备份类型：全量基线 / 增量（只含自父快照以来新增、修改、删除的文档）
+BACKUP_KIND_FULL = 'full'
+BACKUP_KIND_INCREMENTAL = 'incremental'
+# 删除记录（墓碑）集合：增量快照据此回放删除
+TOMBSTONE_COLLECTION = 'backup_tombstones'
+
+
+def default_backup_extension():
+    """新备份文件扩展名（由 BACKUP_FORMAT 决定）"""
+    return JSON_EXTENSION if BACKUP_FORMAT == 'json' else CONTAINER_EXTENSION
+
+
+def glob_backups(directory, prefix):
+    """目录下指定前缀的备份文件（容器格式与 JSON 格式）"""
+    paths = []
+    for extension in BACKUP_EXTENSIONS:
+        paths.extend(glob.glob(os.path.join(directory, f'{prefix}*{extension}')))
+    return paths
+
+
+def backup_mime_type(path):
+    """下载备份文件时使用的 MIME 类型"""
+    return 'application/json' if path.endswith(JSON_EXTENSION) else 'application/octet-stream'
+
+
+def _compact_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def restored_document(doc):
+    """
+    将备份中的文档还原为可写入 MongoDB 的格式
+
+    BSON 编码的容器块以 RawBSONDocument 读出，类型无损，原样返回直接写入；
+    JSON 编码的文档还原字符串 _id 与 updated_at，旧备份中的 amount（元）转为 int64 分。
+    """
+    if isinstance(doc, RawBSONDocument):
+        return doc
+    doc = dict(doc)
+    if '_id' in doc and isinstance(doc['_id'], str):
+        try:
+            doc['_id'] = ObjectId(doc['_id'])
+        except (InvalidId, TypeError):
+            del doc['_id']
+    if AMOUNT_FIELD in doc or LEGACY_AMOUNT_FIELD in doc:
+        doc[AMOUNT_FIELD] = Int64(bill_amount_cents(doc))
+        doc.pop(LEGACY_AMOUNT_FIELD, None)
+    if isinstance(doc.get('updated_at'), str):
+        try:
+            doc['updated_at'] = datetime.fromisoformat(doc['updated_at'])
+        except ValueError:
+            pass
+    return doc
+
+
+def encode_document(doc):
+    """单条文档的紧凑 JSON 编码（_id 转字符串，其余非 JSON 类型按 str 处理）"""
+    doc = dict(doc)
+    if '_id' in doc:
+        doc['_id'] = str(doc['_id'])
+    return _compact_json(doc)
+
+
+class _BackupWriterBase:
+    """备份写入器公共部分：游标读取、统计与内容摘要"""
+
+    def __init__(self, path, database_name, batch_size=None):
+        self.path = path
+        self.database_name = database_name
+        self.batch_size = batch_size or BACKUP_BATCH_SIZE
+        self.tmp_path = f'{path}.tmp'
+        self.collection_stats = {}
+        self.total_documents = 0
+        self._digest = hashlib.sha256()
+
+    def _encoded_documents(self, collection, query=None, on_document=None, encoding=ENCODING_JSON):
+        """按 _id 升序的服务端游标，逐条产出 (文档, 编码结果)：json 为 JSON 行，bson 为 BSON 字节"""
+        cursor = collection.find(query or {}).sort('_id', 1).batch_size(self.batch_size)
+        for doc in cursor:
+            if on_document:
+                on_document(doc)
+            if encoding == ENCODING_BSON:
+                data = bson.encode(doc)
+                self._digest.update(data)
+                yield doc, data
+            else:
+                line = encode_document(doc)
+                self._digest.update(line.encode('utf-8'))
+                yield doc, line
+
+    def _record_stat(self, name, count, date_range=None):
+        stat = {'count': count}
+        if date_range is not None:
+            stat['bill_date_min'], stat['bill_date_max'] = date_range
+        self.collection_stats[name] = stat
+        self.total_documents += count
+        return stat
+
+    def add_stat(self, name, count, date_range=None):
+        """登记不在本文件中写出、由分区文件引用的集合统计"""
+        return self._record_stat(name, count, date_range)
+
+    def _finish_info(self, backup_info):
+        info = dict(backup_info)
+        info['collection_stats'] = self.collection_stats
+        info['content_sha256'] = self._digest.hexdigest()
+        return info
+
+
+class _DateRange:
+    """流式累计 bill_date 最小/最大值"""
+
+    def __init__(self):
+        self.min = None
+        self.max = None
+
+    def add(self, doc):
+        if not doc.get('bill_date'):
+            return
+        bill_date = str(doc['bill_date'])
+        if self.min is None or bill_date < self.min:
+            self.min = bill_date
+        if self.max is None or bill_date > self.max:
+            self.max = bill_date
+
+    def as_tuple(self):
+        return self.min, self.max
+
+
+class StreamingBackupWriter(_BackupWriterBase):
+    """
+    流式 JSON 备份写入器
+
+    文档从服务端游标分批读取后逐条编码写入，内存只保留当前批次；
+    条数、账单日期范围与内容摘要在写入过程中累计，最后作为尾部 backup_info 写出。
+    文件整体仍是合法 JSON（结构与 2.1 版相同，仅键顺序不同），先写临时文件再原子替换。
+    """
+
+    def __init__(self, path, database_name, batch_size=None):
+        """
+        :param path: 目标文件路径
+        :param database_name: 写入 databases 下的库名
+        :param batch_size: 游标批大小，默认 BACKUP_BATCH_SIZE
+        """
+        super().__init__(path, database_name, batch_size)
+        self._file = None
+        self._first_collection = True
+
+    def __enter__(self):
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+        self._file.write('{"databases":{' + json.dumps(self.database_name) + ':{"collections":{')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._file and not self._file.closed:
+            self._file.close()
+        if exc_type is not None and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        return False
+
+    def write_collection(self, name, collection, track_dates=False, query=None, on_document=None):
+        """
+        写出一个集合的文档（按 _id 升序的服务端游标）
+
+        :param name: 集合名
+        :param collection: pymongo Collection
+        :param track_dates: 是否统计 bill_date 范围
+        :param query: 过滤条件（增量快照只写变化的文档），默认全部
+        :param on_document: 每条文档写出前的回调（如累计分区摘要）
+        :return: 该集合的统计 {'count', ['bill_date_min', 'bill_date_max']}
+        """
+        f = self._file
+        if not self._first_collection:
+            f.write(',')
+        self._first_collection = False
+        f.write(json.dumps(name, ensure_ascii=False) + ':{"documents":[')
+
+        count = 0
+        dates = _DateRange() if track_dates else None
+        for doc, line in self._encoded_documents(collection, query, on_document):
+            if count:
+                f.write(',')
+            f.write(line)
+            count += 1
+            if dates:
+                dates.add(doc)
+        f.write(f'],"count":{count}}}')
+        return self._record_stat(name, count, dates.as_tuple() if dates else None)
+
+    def finish(self, backup_info):
+        """
+        写入尾部 backup_info 并原子替换为目标文件
+
+        :param backup_info: 备份元数据（collection_stats / content_sha256 自动补充）
+        :return: 完整的 backup_info
+        """
+        info = self._finish_info(backup_info)
+        self._file.write('}}},"backup_info":')
+        self._file.write(_compact_json(info))
+        self._file.write('}\n')
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        return info
+
+
+def read_backup_info(path):
+    """
+    读取备份的 backup_info，不解析文档
+
+    容器文件只读头部；流式 JSON 只读末尾一小段；旧版（backup_info 在开头、缩进格式）回退为增量解析。
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC:
+            f.seek(0)
+            return _read_container_header(f)[0].get('backup_info', {})
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - TRAILER_READ_BYTES))
+        tail = f.read()
+    pos = tail.rfind(TRAILER_MARKER)
+    if pos >= 0:
+        text = tail[pos + len(TRAILER_MARKER):].decode('utf-8')
+        try:
+            info, _ = json.JSONDecoder().raw_decode(text)
+            return info
+        except ValueError as e:
+            logger.warning(f"解析备份尾部信息失败，改为完整读取 {path}: {e}")
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        for key in stream.keys():
+            if key == 'backup_info':
+                return stream.value()
+            stream.skip()
+    return {}
+
+
+class ContainerBackupWriter(_BackupWriterBase):
+    """
+    3.x 容器格式写入器
+
+    文档按集合切成固定条数的块，每块是一帧独立的 gzip 压缩数据（连续 BSON 文档或 NDJSON）；
+    块先顺序写入临时正文文件，结束时在前面拼上头部（backup_info + 分块索引），
+    再原子替换为目标文件。
+    """
+
+    def __init__(self, path, database_name, batch_size=None, chunk_documents=None, compresslevel=6,
+                 encoding=None, engine=None):
+        """
+        :param path: 目标文件路径
+        :param database_name: 库名（记录在 backup_info.database_name）
+        :param batch_size: 游标批大小，默认 BACKUP_BATCH_SIZE
+        :param chunk_documents: 每块文档数，默认 BACKUP_CHUNK_DOCUMENTS
+        :param compresslevel: gzip 压缩级别
+        :param encoding: 块内文档编码 bson | json，默认 BACKUP_ENCODING
+        :param engine: ParallelBackupEngine，大集合多游标并发读取、进程池压缩；None 为串行
+        """
+        super().__init__(path, database_name, batch_size)
+        self.engine = engine
+        self.chunk_documents = chunk_documents or BACKUP_CHUNK_DOCUMENTS
+        self.compresslevel = compresslevel
+        self.encoding = ENCODING_JSON if (encoding or BACKUP_ENCODING) == ENCODING_JSON else ENCODING_BSON
+        self.body_path = f'{path}.body.tmp'
+        self.chunks = []
+        self._body = None
+
+    def __enter__(self):
+        self._body = open(self.body_path, 'wb')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._body and not self._body.closed:
+            self._body.close()
+        if os.path.exists(self.body_path):
+            os.remove(self.body_path)
+        if exc_type is not None and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        return False
+
+    def _chunk_data(self, items):
+        if self.encoding == ENCODING_BSON:
+            return b''.join(items)
+        return ''.join(f'{line}\n' for line in items).encode('utf-8')
+
+    def _write_chunk(self, name, items, first_id, last_id):
+        frame = gzip.compress(self._chunk_data(items), compresslevel=self.compresslevel)
+        self._write_frame(name, frame, len(items), first_id, last_id)
+
+    def _write_frame(self, name, frame, count, first_id, last_id):
+        self.chunks.append({
+            'collection': name,
+            'offset': self._body.tell(),
+            'length': len(frame),
+            'count': count,
+            'first_id': first_id,
+            'last_id': last_id,
+        })
+        self._body.write(frame)
+
+    def write_collection(self, name, collection, track_dates=False, query=None, on_document=None):
+        """
+        分块写出一个集合的文档（query 为过滤条件，默认全部；on_document 为逐条回调）
+
+        :return: 该集合的统计 {'count', ['bill_date_min', 'bill_date_max']}
+        """
+        # 估算条数读集合元数据（快照读时也不在快照内），只决定是否并行，不影响写出内容
+        if self.engine and self.engine.parallel and (
+            collection.estimated_document_count() > self.chunk_documents * 2
+        ):
+            return self._write_collection_parallel(name, collection, track_dates, query, on_document)
+        count = 0
+        dates = _DateRange() if track_dates else None
+        items = []
+        first_id = last_id = None
+        for doc, item in self._encoded_documents(collection, query, on_document, self.encoding):
+            if not items:
+                first_id = str(doc.get('_id'))
+            last_id = str(doc.get('_id'))
+            items.append(item)
+            count += 1
+            if dates:
+                dates.add(doc)
+            if len(items) >= self.chunk_documents:
+                self._write_chunk(name, items, first_id, last_id)
+                items = []
+        if items:
+            self._write_chunk(name, items, first_id, last_id)
+        return self._record_stat(name, count, dates.as_tuple() if dates else None)
+
+    def _write_collection_parallel(self, name, collection, track_dates, query, on_document):
+        """
+        并行写出：引擎按 _id 顺序交回已编码的块，这里依序累计统计、摘要与回调，
+        压缩在进程池中进行，按提交顺序取回并写出
+        """
+        engine = self.engine
+        encode = bson.encode if self.encoding == ENCODING_BSON else encode_document
+        count = 0
+        dates = _DateRange() if track_dates else None
+        in_flight = deque()
+
+        def write_oldest():
+            future, size, first, last = in_flight.popleft()
+            self._write_frame(name, future.result(), size, first, last)
+
+        for docs, items in engine.iter_chunks(collection, query or {}, self.batch_size, self.chunk_documents, encode):
+            for doc, item in zip(docs, items):
+                if on_document:
+                    on_document(doc)
+                if dates:
+                    dates.add(doc)
+                self._digest.update(item if isinstance(item, bytes) else item.encode('utf-8'))
+            count += len(docs)
+            in_flight.append((
+                engine.compress(self._chunk_data(items), self.compresslevel),
+                len(items), str(docs[0].get('_id')), str(docs[-1].get('_id')),
+            ))
+            while len(in_flight) > engine.workers * 2:
+                write_oldest()
+        while in_flight:
+            write_oldest()
+        return self._record_stat(name, count, dates.as_tuple() if dates else None)
+
+    def finish(self, backup_info):
+        """
+        写入头部并拼接正文，原子替换为目标文件
+
+        :return: 完整的 backup_info
+        """
+        info = self._finish_info(backup_info)
+        header = _compact_json({
+            'backup_info': info,
+            'encoding': self.encoding,
+            'chunks': self.chunks,
+        }).encode('utf-8')
+        self._body.close()
+        with open(self.tmp_path, 'wb') as out:
+            out.write(CONTAINER_MAGIC)
+            out.write(_HEADER_LENGTH.pack(len(header)))
+            out.write(header)
+            with open(self.body_path, 'rb') as body:
+                shutil.copyfileobj(body, out, _COPY_BUFFER_BYTES)
+        os.replace(self.tmp_path, self.path)
+        return info
+
+
+def backup_writer(path, database_name, **kwargs):
+    """按文件扩展名选择写入器（.json 为 2.1 流式 JSON，其余为 3.x 容器）"""
+    if path.endswith(JSON_EXTENSION):
+        return StreamingBackupWriter(path, database_name, batch_size=kwargs.get('batch_size'))
+    return ContainerBackupWriter(path, database_name, **kwargs)
+
+
+def is_container_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC
+
+
+def _read_container_header(f):
+    if f.read(len(CONTAINER_MAGIC)) != CONTAINER_MAGIC:
+        raise ValueError('不是有效的备份容器文件')
+    (length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = json.loads(f.read(length).decode('utf-8'))
+    return header, len(CONTAINER_MAGIC) + _HEADER_LENGTH.size + length
+
+
+def _doc_year(doc):
+    """文档所属年份；缺少 bill_date 时为 '-'（与分区摘要的无日期分区一致）"""
+    bill_date = doc.get('bill_date')
+    return str(bill_date)[:4] if bill_date else '-'
+
+
+class _BackupReaderBase(ABC):
+    """
+    读取器公共部分
+
+    快照头部的 partitions 引用按年分区文件（{集合名: {年份: {'file', 'hash', 'count', ...}}}），
+    这些集合的文档从分区文件读取；years 可只读取指定年份。
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @property
+    def database_name(self):
+        return self.info.get('database_name')
+
+    @property
+    def partitions(self):
+        return self.info.get('partitions') or {}
+
+    def partition_years(self, name='bills'):
+        """按年分区引用的年份（未分区时返回空列表）"""
+        return sorted(self.partitions.get(name, {}))
+
+    @abstractmethod
+    def _collection_batches(self, name, raw=False):
+        """逐批产出快照本体中某集合的文档列表（不含按年分区文件）"""
+
+    def iter_document_batches(self, name, years=None, raw=False):
+        """
+        逐批产出文档列表
+
+        :param years: 只读取这些年份（bill_date 前 4 位），None 表示全部
+        :param raw: BSON 编码的块直接产出 RawBSONDocument（恢复时原样写回，不解码再编码）；
+                    JSON 编码的块始终产出 dict
+        """
+        years = {str(y) for y in years} if years else None
+        if name in self.partitions:
+            for year, part in sorted(self.partitions[name].items()):
+                if years and year not in years:
+                    continue
+                with open_backup(os.path.join(get_partitions_dir(), part['file'])) as reader:
+                    yield from reader.iter_document_batches(name, raw=raw)
+            return
+        for batch in self._collection_batches(name, raw):
+            if years:
+                batch = [doc for doc in batch if _doc_year(doc) in years]
+            if batch:
+                yield batch
+
+    def iter_documents(self, name, years=None, raw=False):
+        for batch in self.iter_document_batches(name, years, raw):
+            yield from batch
+
+
+class ContainerBackupReader(_BackupReaderBase):
+    """3.x 容器读取：打开时只解析头部，文档按块解压（3.0 的块为 NDJSON，3.1 起默认为 BSON）"""
+
+    format = 'container'
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self.header, self._body_offset = _read_container_header(self._file)
+        except Exception:
+            self._file.close()
+            raise
+        self.info = self.header.get('backup_info', {})
+        self.chunks = self.header.get('chunks', [])
+        self.encoding = self.header.get('encoding', ENCODING_JSON)
+
+    def close(self):
+        self._file.close()
+
+    def collection_names(self):
+        names = list((self.info.get('collection_stats') or {}).keys())
+        for chunk in self.chunks:
+            if chunk['collection'] not in names:
+                names.append(chunk['collection'])
+        return names
+
+    def _collection_batches(self, name, raw=False):
+        """逐块产出文档列表（每次只解压一个块）"""
+        for chunk in self.chunks:
+            if chunk['collection'] != name:
+                continue
+            self._file.seek(self._body_offset + chunk['offset'])
+            data = gzip.decompress(self._file.read(chunk['length']))
+            if self.encoding == ENCODING_BSON:
+                yield bson.decode_all(data, RAW_BSON_OPTIONS) if raw else bson.decode_all(data)
+            else:
+                yield [json.loads(line) for line in data.splitlines() if line]
+
+
+class _JsonStream:
+    """
+    JSON 增量解析：按块读入文本，逐个键/元素向下遍历，只有叶子值用 raw_decode 解析
+
+    内存只保留当前读缓冲与正在解析的单个值（如一条文档），与文件大小无关。
+    """
+
+    def __init__(self, f, object_hook=None, block_size=_COPY_BUFFER_BYTES):
+        self._file = f
+        self._decoder = json.JSONDecoder(object_hook=object_hook)
+        self._block_size = block_size
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        block = self._file.read(self._block_size)
+        if not block:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + block
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """下一个非空白字符（不消费）"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('JSON 意外结束')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'JSON 格式错误：期望 {char!r}，实际 {self._buffer[self._pos]!r}')
+        self._pos += 1
+
+    def value(self):
+        """解析一个完整的值；缓冲不足时补读后重试"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 数字可能恰好被缓冲截断（如 "1." | "5"、"2E" | "+10" 会先解析出 1、2），
+            # 其后只剩数字字符时补读后重新解析
+            if self._buffer[end:].strip(_NUMBER_CHARS) == '' and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _members(self, close):
+        if self.peek() == close:
+            self._pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self._pos += 1
+            if char == close:
+                return
+            if char != ',':
+                raise ValueError(f'JSON 格式错误：意外的 {char!r}')
+
+    def keys(self):
+        """逐个产出对象的键；调用方需在下一次迭代前消费（或跳过）对应的值"""
+        self.expect('{')
+        for _ in self._members('}'):
+            key = self.value()
+            self.expect(':')
+            yield key
+
+    def items(self):
+        """逐个定位数组元素；调用方需在下一次迭代前消费（或跳过）该元素"""
+        self.expect('[')
+        yield from self._members(']')
+
+    def skip(self):
+        """跳过一个值（对象与数组逐层遍历，不整体载入）"""
+        char = self.peek()
+        if char == '{':
+            for _ in self.keys():
+                self.skip()
+        elif char == '[':
+            for _ in self.items():
+                self.skip()
+        else:
+            self.value()
+
+
+class JsonBackupReader(_BackupReaderBase):
+    """
+    2.1 JSON 读取（含旧版缩进文件与扩展 JSON 导出）：增量解析，逐条读出文档
+
+    文档按 databases → 库 → collections → 集合 → documents 的路径流式定位，内存只保留当前批次；
+    解析时还原扩展 JSON 的类型标记（$oid、$date 等），普通 2.1 文件不受影响。
+    """
+
+    format = 'json'
+
+    def __init__(self, path):
+        self.path = path
+        self.info = read_backup_info(path)
+        self._database_name = self.info.get('database_name')
+        self._names = None
+
+    def close(self):
+        pass
+
+    def _open_stream(self):
+        f = open(self.path, 'r', encoding='utf-8')
+        return f, _JsonStream(f, object_hook=json_util.object_hook)
+
+    def _iter_collections(self, stream):
+        """定位目标库（未记录库名时取第一个库）的各集合：逐个产出集合名，调用方需消费该集合的值"""
+        for key in stream.keys():
+            if key != 'databases':
+                stream.skip()
+                continue
+            for database in stream.keys():
+                if self._database_name is None:
+                    self._database_name = database
+                if database != self._database_name:
+                    stream.skip()
+                    continue
+                for part in stream.keys():
+                    if part != 'collections':
+                        stream.skip()
+                        continue
+                    yield from stream.keys()
+
+    @property
+    def database_name(self):
+        if self._database_name is None:
+            f, stream = self._open_stream()
+            with f:
+                for _ in self._iter_collections(stream):
+                    break
+        return self._database_name
+
+    def collection_names(self):
+        stats = self.info.get('collection_stats')
+        if stats:
+            return list(stats.keys())
+        if self._names is None:
+            f, stream = self._open_stream()
+            with f:
+                names = []
+                for name in self._iter_collections(stream):
+                    names.append(name)
+                    stream.skip()
+            self._names = names
+        return self._names
+
+    def _collection_batches(self, name, raw=False):
+        f, stream = self._open_stream()
+        with f:
+            for coll_name in self._iter_collections(stream):
+                if coll_name != name:
+                    stream.skip()
+                    continue
+                for field in stream.keys():
+                    if field != 'documents':
+                        stream.skip()
+                        continue
+                    batch = []
+                    for _ in stream.items():
+                        batch.append(stream.value())
+                        if len(batch) >= BACKUP_BATCH_SIZE:
+                            yield batch
+                            batch = []
+                    if batch:
+                        yield batch
+                return
+
+
+def open_backup(path):
+    """打开备份文件（自动识别 3.x 容器或 2.1 JSON），返回读取器"""
+    if is_container_file(path):
+        return ContainerBackupReader(path)
+    return JsonBackupReader(path)
+
+
+def backup_chain(path):
+    """
+    快照链：从全量基线到 path 的文件列表（增量快照的 parent 为同目录下的文件名）
+
+    :raises FileNotFoundError: 链上的父快照缺失
+    :raises ValueError: 链中出现循环引用
+    """
+    chain = [path]
+    seen = {os.path.basename(path)}
+    info = read_backup_info(path)
+    while info.get('backup_kind') == BACKUP_KIND_INCREMENTAL:
+        parent = info.get('parent')
+        if not parent or parent in seen:
+            raise ValueError(f"快照链无效: {os.path.basename(chain[0])}")
+        parent_path = os.path.join(os.path.dirname(path), parent)
+        if not os.path.exists(parent_path):
+            raise FileNotFoundError(f"快照链缺少父快照: {parent}")
+        seen.add(parent)
+        chain.insert(0, parent_path)
+        info = read_backup_info(parent_path)
+    return chain
+
+
+def describe_backup(path):
+    """
+    备份文件的元数据（只读头部/尾部；缺少 collection_stats 的早期文件才完整解析）
+
+    :return: {'backup_path', 'file_name', 'backup_time', 'version', 'backup_type', 'backup_kind',
+              'parent', 'base', 'partition_years', 'data_hash', 'content_sha256', 'collection_stats',
+              'total_documents', 'file_size', 'file_size_mb', 'mtime', 'collections'}
+    """
+    info = read_backup_info(path)
+    collection_stats = info.get('collection_stats')
+    if not collection_stats:
+        with open_backup(path) as reader:
+            collection_stats = {
+                name: {'count': sum(len(batch) for batch in reader.iter_document_batches(name))}
+                for name in reader.collection_names()
+            }
+    stat = os.stat(path)
+    return {
+        'backup_path': path,
+        'file_name': os.path.basename(path),
+        'backup_time': info.get('backup_time'),
+        'version': info.get('version'),
+        'backup_type': info.get('type', 'snapshot'),
+        'backup_kind': info.get('backup_kind', BACKUP_KIND_FULL),
+        'parent': info.get('parent'),
+        'base': info.get('base') or os.path.basename(path),
+        'partition_years': sorted((info.get('partitions') or {}).get('bills', {})),
+        'data_hash': info.get('data_hash'),
+        'content_sha256': info.get('content_sha256'),
+        'collection_stats': collection_stats,
+        'total_documents': sum(c.get('count', 0) for c in collection_stats.values()),
+        'file_size': stat.st_size,
+        'file_size_mb': round(stat.st_size / (1024 * 1024), 2),
+        'mtime': stat.st_mtime,
+        'collections': list(collection_stats.keys()),
+    }
+
+
+def export_backup_json(path, dest):
+    """
+    将一份备份导出为 MongoDB 扩展 JSON（relaxed），供人工查看
+
+    结构与 2.1 JSON 相同（databases → collections → documents，backup_info 在末尾），
+    ObjectId、日期等类型以 $oid / $date 标记保留，导出文件本身也可直接预览与恢复。
+    按年分区引用的集合会读取分区文件内联写出。
+
+    :param path: 源备份文件
+    :param dest: 导出文件路径
+    :return: {集合名: 条数}
+    """
+    counts = {}
+    tmp_path = f'{dest}.tmp'
+    try:
+        with open_backup(path) as reader, open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('{"databases":{' + json.dumps(reader.database_name) + ':{"collections":{')
+            for index, name in enumerate(reader.collection_names()):
+                f.write((',' if index else '') + json.dumps(name, ensure_ascii=False) + ':{"documents":[')
+                count = 0
+                for doc in reader.iter_documents(name):
+                    f.write((',' if count else '') + json_util.dumps(
+                        doc, json_options=EXPORT_JSON_OPTIONS, ensure_ascii=False, separators=(',', ':')
+                    ))
+                    count += 1
+                f.write(f'],"count":{count}}}')
+                counts[name] = count
+            info = {k: v for k, v in reader.info.items() if k != 'partitions'}
+            info['exported_from'] = os.path.basename(path)
+            f.write('}}},"backup_info":')
+            f.write(_compact_json(info))
+            f.write('}\n')
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return counts
@@ -0,0 +1,239 @@
+"""备份目录索引：SQLite 记录每份快照的元数据，目录 mtime 变化时才与磁盘对账。"""
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+from loguru import logger
+
+from bill_tracker.db.backup_io import describe_backup, glob_backups
+from bill_tracker.paths import get_catalog_path, get_manifest_path
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    category TEXT NOT NULL,
+    backup_time TEXT,
+    data_hash TEXT,
+    file_size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    meta TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_backups_directory ON backups (directory, mtime_ns);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    event_type TEXT PRIMARY KEY,
+    time TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+"""
+
+
+class BackupCatalog:
+    """
+    备份目录索引
+
+    备份写完时登记元数据（类型、时间、哈希、各集合条数、大小、校验和）；
+    列表与增量检测直接查表，只有目录 mtime 变化（外部拷入/删除文件）时才扫描对账，
+    且只解析新增或变化的文件。
+    """
+
+    def __init__(self, db_path=None):
+        """
+        :param db_path: SQLite 文件路径，默认 data/catalog.sqlite3
+        """
+        self.db_path = db_path or get_catalog_path()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        # 索引文件可被删除重建，每次连接都确保表存在（IF NOT EXISTS 开销可忽略）
+        conn.executescript(CATALOG_SCHEMA)
+        return conn
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(path)
+
+    def _upsert(self, conn, path, category, meta):
+        stat = os.stat(path)
+        conn.execute(
+            'INSERT OR REPLACE INTO backups '
+            '(path, directory, category, backup_time, data_hash, file_size, mtime_ns, meta) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                self._key(path),
+                self._key(os.path.dirname(path)),
+                category,
+                meta.get('backup_time'),
+                meta.get('data_hash'),
+                stat.st_size,
+                stat.st_mtime_ns,
+                json.dumps(meta, ensure_ascii=False, default=str),
+            ),
+        )
+
+    @staticmethod
+    def _meta_from_row(row):
+        meta = json.loads(row['meta'])
+        meta['success'] = True
+        meta['category'] = row['category']
+        return meta
+
+    def record(self, path, category, meta=None):
+        """
+        登记一份备份（写入完成后调用）
+
+        :param path: 备份文件路径
+        :param category: snapshot | pre_restore
+        :param meta: describe_backup 的结果；为空时读取文件头部
+        :return: 元数据字典
+        """
+        meta = meta or describe_backup(path)
+        with closing(self._connect()) as conn, conn:
+            self._upsert(conn, path, category, meta)
+        return dict(meta, success=True, category=category)
+
+    def remove(self, path):
+        """移除一条登记（删除备份文件后调用）"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM backups WHERE path = ?', (self._key(path),))
+
+    def reconcile(self, directory, prefix, category):
+        """
+        与磁盘对账：目录 mtime 未变化时直接返回
+
+        :return: 是否进行了扫描
+        """
+        directory = self._key(directory)
+        try:
+            dir_mtime_ns = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime_ns = -1
+
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute('SELECT mtime_ns FROM directories WHERE path = ?', (directory,)).fetchone()
+            if row and row['mtime_ns'] == dir_mtime_ns:
+                return False
+
+            known = {
+                r['path']: (r['mtime_ns'], r['file_size'])
+                for r in conn.execute(
+                    'SELECT path, mtime_ns, file_size FROM backups WHERE directory = ?', (directory,)
+                )
+            }
+            on_disk = {}
+            for path in glob_backups(directory, prefix):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                on_disk[self._key(path)] = (stat.st_mtime_ns, stat.st_size)
+
+            stale = [path for path in known if path not in on_disk]
+            conn.executemany('DELETE FROM backups WHERE path = ?', [(p,) for p in stale])
+            parsed = 0
+            for path, signature in on_disk.items():
+                if known.get(path) == signature:
+                    continue
+                try:
+                    self._upsert(conn, path, category, describe_backup(path))
+                    parsed += 1
+                except Exception as e:
+                    logger.warning(f"登记备份文件失败 {path}: {e}")
+            conn.execute(
+                'INSERT OR REPLACE INTO directories (path, mtime_ns) VALUES (?, ?)',
+                (directory, dir_mtime_ns),
+            )
+        if stale or parsed:
+            logger.info(f"备份索引已对账 {directory}: 新增/更新 {parsed} 份，移除 {len(stale)} 份")
+        return True
+
+    def list(self, directory):
+        """目录下已登记的备份（按文件修改时间倒序）"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT category, meta FROM backups WHERE directory = ? ORDER BY mtime_ns DESC',
+                (self._key(directory),),
+            ).fetchall()
+        return [self._meta_from_row(row) for row in rows]
+
+    def latest(self, directory):
+        """目录下最新一份备份的元数据；没有时返回 None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT category, meta FROM backups WHERE directory = ? ORDER BY mtime_ns DESC LIMIT 1',
+                (self._key(directory),),
+            ).fetchone()
+        return self._meta_from_row(row) if row else None
+
+    def get(self, path):
+        """按路径查询；文件大小或 mtime 与登记不一致时视为未登记"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT category, meta, mtime_ns, file_size FROM backups WHERE path = ?',
+                (self._key(path),),
+            ).fetchone()
+        if not row or (row['mtime_ns'], row['file_size']) != (stat.st_mtime_ns, stat.st_size):
+            return None
+        return self._meta_from_row(row)
+
+    def event(self, event_type):
+        """最近一次某类事件 {'time': ..., **payload}；没有时返回 None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT time, payload FROM events WHERE event_type = ?', (event_type,)
+            ).fetchone()
+        return {'time': row['time'], **json.loads(row['payload'])} if row else None
+
+    @staticmethod
+    def _import_manifest(conn, manifest_path):
+        """首次使用索引时导入旧版 manifest.json 中的事件"""
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        for event_type, event in manifest.items():
+            if isinstance(event, dict):
+                event = dict(event)
+                conn.execute(
+                    'INSERT OR REPLACE INTO events (event_type, time, payload) VALUES (?, ?, ?)',
+                    (event_type, event.pop('time', ''), json.dumps(event, ensure_ascii=False, default=str)),
+                )
+
+    def record_event(self, event_type, **payload):
+        """
+        记录最近一次备份/恢复等操作，并原子重写 manifest.json（供人工查看）
+
+        :return: 全部事件 {event_type: {'time': ..., **payload}}
+        """
+        now = datetime.now().isoformat()
+        manifest_path = get_manifest_path()
+        with closing(self._connect()) as conn, conn:
+            if conn.execute('SELECT COUNT(*) FROM events').fetchone()[0] == 0:
+                self._import_manifest(conn, manifest_path)
+            conn.execute(
+                'INSERT OR REPLACE INTO events (event_type, time, payload) VALUES (?, ?, ?)',
+                (event_type, now, json.dumps(payload, ensure_ascii=False, default=str)),
+            )
+            events = {
+                row['event_type']: {'time': row['time'], **json.loads(row['payload'])}
+                for row in conn.execute('SELECT event_type, time, payload FROM events ORDER BY event_type')
+            }
+
+        tmp_path = f'{manifest_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(events, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        return events
@@ -1,25 +1,114 @@
 import pymongo
 from bson import ObjectId
 from bson.errors import InvalidId
-from datetime import datetime
+from bson.int64 import Int64
+from datetime import datetime, timedelta
 import pandas as pd
 from loguru import logger
+from pymongo import InsertOne, ReadPreference, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+import functools
+from contextlib import ExitStack
 import os
 import re
 import json
 import glob
 import shutil
+import threading
+import time
 from bill_tracker.paths import (
     get_data_root,
-    get_manifest_path,
+    get_partitions_dir,
     get_pre_restore_dir,
     get_snapshots_dir,
     get_yearly_dir,
     get_log_dir,
 )
-from bill_tracker.utils import get_client_ip
-from datetime import timedelta
-from dateutil.relativedelta import relativedelta
+from bill_tracker.db.archive import (
+    ARCHIVE_META_COLLECTION,
+    ARCHIVE_VERSION_COLLECTION,
+    BillArchive,
+    archive_collection_name,
+    exported_archive_collections,
+)
+from bill_tracker.db.backup_io import (
+    BACKUP_CONTAINER_VERSION,
+    BACKUP_KIND_FULL,
+    BACKUP_KIND_INCREMENTAL,
+    JSON_EXTENSION,
+    TOMBSTONE_COLLECTION,
+    backup_chain,
+    backup_writer,
+    default_backup_extension,
+    describe_backup,
+    glob_backups,
+    open_backup,
+    read_backup_info,
+    restored_document,
+)
+from bill_tracker.db.catalog import BackupCatalog
+from bill_tracker.db.partitions import (
+    PARTITIONED_COLLECTION,
+    collect_garbage,
+    manifest_stat,
+    write_year_partitions,
+    year_of,
+)
+from bill_tracker.db.merkle import (
+    DIGEST_COLLECTION,
+    WHOLE_COLLECTION,
+    PartitionDigests,
+    changed_partitions,
+    document_digest,
+    is_partitioned,
+    merkle_root,
+    partitions_filter,
+)
+from bill_tracker.db.lease import LEASE_COLLECTION, LeaseBusyError, MaintenanceLease
+from bill_tracker.db.offline import DatabaseUnavailableError, SnapshotReadEngine
+from bill_tracker.db.parallel_backup import ParallelBackupEngine
+from bill_tracker.db.restore_checkpoint import RestoreCheckpoint
+from bill_tracker.db.restore_diff import (
+    DIFF_KEYS,
+    SAMPLE_SIZE,
+    VIEW_MERGE,
+    VIEW_REPLACE,
+    CollectionDiff,
+    chain_documents,
+    diff_collection,
+)
+from bill_tracker.db.shadow import (
+    create_shadow,
+    drop_shadow,
+    expire_shadows,
+    export_shadow,
+    is_shadow,
+    list_shadows,
+    rollback_to_shadow,
+)
+from bill_tracker.db.snapshot_reads import SnapshotDatabase, consistent_reads, snapshot_fallback_reason
+from bill_tracker.db.staging import (
+    drop_staging_collections,
+    is_staging,
+    prepare_staging,
+    staging_name,
+    swap_in,
+)
+from bill_tracker.db.subset import BillSubset
+from bill_tracker.db.write_counter import WRITE_COUNTER_COLLECTION, WriteCounter
+from bill_tracker.db.query_stats import (
+    QUERY_SHAPES_COLLECTION,
+    IndexAdvisor,
+    QueryShapeRecorder,
+)
+from bill_tracker.money import (
+    AMOUNT_FIELD,
+    LEGACY_AMOUNT_FIELD,
+    bill_amount_cents,
+    to_cents,
+    with_yuan_amounts,
+)
+from bill_tracker.utils import get_client_ip, period_date_range
 import math
 
 log_dir = get_log_dir()
@@ -37,6 +126,108 @@ BACKUP_VERSION = '2.1'
 RESTORE_MODE_BILLS_ONLY = 'bills_only'
 RESTORE_MODE_FULL_REPLACE = 'full_replace'
 RESTORE_MODE_MERGE = 'merge'
+# 恢复前的安全网：snapshot=全量快照文件（data/pre_restore/），shadow=服务端影子副本集合
+PRE_RESTORE_SNAPSHOT = 'snapshot'
+PRE_RESTORE_SHADOW = 'shadow'
+PRE_RESTORE_MODE = os.getenv('PRE_RESTORE_MODE', PRE_RESTORE_SNAPSHOT)
+# 恢复时每次 insert_many 的文档数
+RESTORE_BATCH_SIZE = int(os.getenv('RESTORE_BATCH_SIZE', '1000'))
+# 已完成的一次性数据迁移（每项一条记录），连接时据此跳过迁移扫描
+MIGRATIONS_COLLECTION = 'schema_migrations'
+AMOUNT_MIGRATION_ID = 'amount_cents'
+# 运行期内部集合（统计/协调用），不参与数据哈希与备份（墓碑只写入增量快照）
+INTERNAL_COLLECTIONS = {
+    QUERY_SHAPES_COLLECTION, TOMBSTONE_COLLECTION, DIGEST_COLLECTION, WRITE_COUNTER_COLLECTION, LEASE_COLLECTION,
+    ARCHIVE_VERSION_COLLECTION, MIGRATIONS_COLLECTION,
+}
+# 增量快照：BACKUP_INCREMENTAL=0 时每次都写全量；链上增量达到 BACKUP_MAX_CHAIN_LENGTH 份后重新写全量基线
+BACKUP_INCREMENTAL = os.getenv('BACKUP_INCREMENTAL', '1') != '0'
+BACKUP_MAX_CHAIN_LENGTH = int(os.getenv('BACKUP_MAX_CHAIN_LENGTH', '24'))
+# 增量按 updated_at 取变化时向前多取的秒数（覆盖父快照读取期间的并发写入，重复文档回放时按 _id 覆盖）
+INCREMENTAL_OVERLAP_SECONDS = 300
+
+# 负载隔离：交互（录入/登录）、报表、维护（备份/恢复/归档）各用独立连接池
+WORKLOAD_INTERACTIVE = 'interactive'
+WORKLOAD_REPORTING = 'reporting'
+WORKLOAD_MAINTENANCE = 'maintenance'
+# 连接池默认配置，可用 MONGO_<WORKLOAD>_POOL_SIZE / MONGO_<WORKLOAD>_READ_PREFERENCE 覆盖；
+# 报表连接池承载列表与汇总页面，默认读主节点，录入或删除后下一次渲染即可看到（写后读一致）；
+# 维护（备份扫描、集合统计）默认 secondaryPreferred，单机或无副本时自动读主节点，
+# 维护中写后回读的路径用 _maintenance_db(primary=True)
+WORKLOAD_POOL_DEFAULTS = {
+    WORKLOAD_INTERACTIVE: {'max_pool_size': 20, 'read_preference': 'primary'},
+    WORKLOAD_REPORTING: {'max_pool_size': 5, 'read_preference': 'primary'},
+    WORKLOAD_MAINTENANCE: {'max_pool_size': 2, 'read_preference': 'secondaryPreferred'},
+}
+# 各方法的服务端执行时间预算（maxTimeMS），可用 MONGO_MAX_TIME_MS_<方法名大写> 覆盖，0 表示不限制
+QUERY_TIME_BUDGETS_MS = {
+    'get_user_auth_record': 3000,
+    'paginate_query': 10000,
+    'query_bills': 20000,
+    'get_annual_summary': 15000,
+    'get_period_summary': 15000,
+    'get_category_summary': 15000,
+    'get_monthly_summary': 15000,
+    'collection_counts': 5000,
+}
+# 尚未迁移为整数分的旧账单（amount 为浮点元）
+LEGACY_AMOUNT_FILTER = {AMOUNT_FIELD: {'$exists': False}, LEGACY_AMOUNT_FIELD: {'$exists': True}}
+# 金额迁移每批处理的文档数
+MIGRATION_BATCH_SIZE = 1000
+# 连接快速失败：服务器选择/建连超时（毫秒），超时后进入只读降级并后台重连
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '2000'))
+RECONNECT_INTERVAL_SECONDS = float(os.getenv('MONGO_RECONNECT_INTERVAL_SECONDS', '5'))
+
+
+def _offline_fallback(method):
+    """只读降级：数据库不可用时由快照只读引擎回答同名查询"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.is_online:
+            return getattr(self._offline_engine(), method.__name__)(*args, **kwargs)
+        try:
+            return method(self, *args, **kwargs)
+        except ConnectionFailure as e:
+            self._mark_offline(e)
+            return getattr(self._offline_engine(), method.__name__)(*args, **kwargs)
+    return wrapper
+
+
+def _with_yuan_amounts(method):
+    """汇总接口：结果在 *_cents 之外保留以元为单位的旧版键（在线与只读降级一致）"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return with_yuan_amounts(method(self, *args, **kwargs))
+    return wrapper
+
+
+def _with_maintenance_lease(purpose):
+    """
+    备份/恢复在持有维护租约期间执行，多个进程之间互斥；租约被占用时返回 busy 结果而不等待。
+    同一线程内的嵌套调用（恢复前的安全快照）复用已持有的租约。
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if getattr(self._lease_local, 'lease', None) is not None or not self.is_online:
+                return method(self, *args, **kwargs)
+            lease = MaintenanceLease(self._maintenance_db(), purpose)
+            try:
+                lease.acquire()
+            except LeaseBusyError as e:
+                logger.info(f"跳过{purpose}: {e}")
+                return {'success': False, 'busy': True, 'message': str(e)}
+            except Exception as e:
+                logger.error(f"获取维护租约失败: {e}")
+                return {'success': False, 'message': f'获取维护租约失败: {str(e)}'}
+            self._lease_local.lease = lease
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._lease_local.lease = None
+                lease.release()
+        return wrapper
+    return decorator
 
 
 class BillDatabase:
@@ -48,6 +239,16 @@ class BillDatabase:
         :param port: MongoDB端口
         :param db_name: 数据库名称，默认为None，优先使用环境变量MONGO_DB_NAME
         """
+        self._state_lock = threading.Lock()
+        self._online = False
+        self._closed = False
+        self._offline_cache = None
+        self._offline_since = None
+        self._reconnect_thread = None
+        # 当前线程持有的维护租约（备份/恢复期间）
+        self._lease_local = threading.local()
+        # 备份目录索引（data/catalog.sqlite3），列表与增量检测不再逐个解析备份文件
+        self.catalog = BackupCatalog()
         try:
             # 优先使用环境变量中的数据库名称
             if db_name is None:
@@ -58,7 +259,7 @@ class BillDatabase:
             
             if mongo_uri:
                 # 使用环境变量中的连接字符串
-                self.client = pymongo.MongoClient(mongo_uri)
+                client_args = (mongo_uri,)
             else:
                 # 检查是否在容器内运行
                 is_docker = os.path.exists('/.dockerenv')
@@ -66,29 +267,42 @@ class BillDatabase:
                 if is_docker:
                     # 容器内使用服务名
                     host = host or 'mongo'
-                    self.client = pymongo.MongoClient(host, port)
                 else:
                     # 本地开发使用 localhost
                     host = host or 'localhost'
                     port = 37017
-                    self.client = pymongo.MongoClient(host, port)
+                client_args = (host, port)
+
+            # 交互连接沿用 self.client；报表与维护流量走各自的连接池，互不抢占
+            self.client = self._create_client(WORKLOAD_INTERACTIVE, client_args)
+            self.reporting_client = self._create_client(WORKLOAD_REPORTING, client_args)
+            self.maintenance_client = self._create_client(WORKLOAD_MAINTENANCE, client_args)
             
             self.db = self.client[db_name]
             self.collection = self.db['bills']
             # 用户凭据集合（数据库优先存储登录密码）
             self.users_collection = self.db['users']
+            # 分区摘要：写入时标记所在年月分区，变化检测只重算脏分区
+            self.digests = PartitionDigests(self.db)
+            # 写入计数：备份调度器据此判断写入量，无需计算哈希
+            self.write_counter = WriteCounter(self.db)
+            # 列表与汇总查询使用的账单集合（独立连接池，默认读主节点）
+            self.reporting_collection = self.reporting_client[db_name]['bills']
+
+            # 查询形状统计（供索引建议使用），QUERY_SHAPE_RECORDING=0 可关闭
+            self.query_recorder = QueryShapeRecorder(
+                self.db[QUERY_SHAPES_COLLECTION],
+                enabled=os.getenv('QUERY_SHAPE_RECORDING', '1') != '0'
+            )
+            # 冷热分层：早期年份归档到 bills_archive_<年份>，查询按需合并
+            self.archive = BillArchive(self._maintenance_db(db_name, primary=True), on_write=self._mark_dirty)
             
-            # 创建索引以提高查询性能
-            self.collection.create_index([('bill_date', pymongo.ASCENDING)])
-            self.collection.create_index([('type', pymongo.ASCENDING)])
-            self.users_collection.create_index([('username', pymongo.ASCENDING)], unique=True)
-            
-            # 检查数据库连接状态
-            try:
-                self.client.admin.command('ping')
+            # 检查数据库连接状态（短超时；连不上时进入只读降级，由后台线程重连）
+            if self._try_connect():
                 logger.info(f"数据库连接成功: {db_name}")
-            except Exception as e:
-                logger.error(f"数据库连接测试失败: {e}")
+            else:
+                self._offline_since = datetime.now()
+                self._start_reconnect()
             
             # 只在初始化时记录IP
             logger.info(f"成功连接到MongoDB数据库: {host}:{port}/{db_name}", extra={"ip": get_client_ip()})
@@ -96,6 +310,139 @@ class BillDatabase:
             logger.error(f"连接MongoDB失败: {e}")
             raise
     
+    @staticmethod
+    def _create_client(workload, client_args):
+        """按负载类型创建独立连接池的 MongoClient"""
+        defaults = WORKLOAD_POOL_DEFAULTS[workload]
+        prefix = f'MONGO_{workload.upper()}'
+        return pymongo.MongoClient(
+            *client_args,
+            maxPoolSize=int(os.getenv(f'{prefix}_POOL_SIZE', defaults['max_pool_size'])),
+            readPreference=os.getenv(f'{prefix}_READ_PREFERENCE', defaults['read_preference']),
+            appname=f'bill_tracker-{workload}',
+            serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+        )
+
+    def _ensure_indexes(self):
+        """创建索引以提高查询性能（连接成功后执行）"""
+        self.collection.create_index([('bill_date', pymongo.ASCENDING)])
+        self.collection.create_index([('type', pymongo.ASCENDING)])
+        self.users_collection.create_index([('username', pymongo.ASCENDING)], unique=True)
+        # 增量快照按 updated_at / deleted_at 取变化
+        self.collection.create_index([('updated_at', pymongo.ASCENDING)])
+        self.db[TOMBSTONE_COLLECTION].create_index([('deleted_at', pymongo.ASCENDING)])
+
+    def _try_connect(self):
+        """ping 并初始化索引；成功时切回在线模式"""
+        try:
+            self.client.admin.command('ping')
+            self._ensure_indexes()
+            self.migrate_amounts_to_cents()
+        except Exception as e:
+            logger.error(f"数据库连接测试失败: {e}")
+            return False
+        with self._state_lock:
+            self._online = True
+            self._offline_cache = None
+            self._offline_since = None
+        return True
+
+    def _mark_offline(self, error):
+        """查询途中发现连接失败：切到只读降级并启动后台重连"""
+        with self._state_lock:
+            was_online = self._online
+            self._online = False
+            if was_online:
+                self._offline_since = datetime.now()
+        if was_online:
+            logger.warning(f"数据库连接中断，切换为只读模式: {error}")
+        self._start_reconnect()
+
+    def _start_reconnect(self):
+        with self._state_lock:
+            if self._closed or (self._reconnect_thread and self._reconnect_thread.is_alive()):
+                return
+            self._reconnect_thread = threading.Thread(
+                target=self._reconnect_loop, name='mongo-reconnect', daemon=True
+            )
+            self._reconnect_thread.start()
+
+    def _reconnect_loop(self):
+        while not self._closed:
+            time.sleep(RECONNECT_INTERVAL_SECONDS)
+            if self._closed:
+                return
+            if self._try_connect():
+                logger.info("数据库已恢复连接，退出只读模式")
+                return
+
+    @property
+    def is_online(self):
+        return self._online
+
+    def _offline_engine(self):
+        """只读降级引擎（每次断线期间只载入一次最新快照）"""
+        with self._state_lock:
+            if self._offline_cache is None:
+                self._offline_cache = SnapshotReadEngine.from_latest_snapshot()
+            return self._offline_cache
+
+    def _require_online(self, action):
+        if not self.is_online:
+            raise DatabaseUnavailableError(f'数据库暂不可用（只读模式），无法{action}，请稍后重试')
+
+    def get_connection_status(self):
+        """
+        连接状态（UI 展示只读横幅用）
+
+        :return: {'online': bool, 'offline_since', 'snapshot', 'snapshot_time'}
+        """
+        status = {'online': self.is_online, 'offline_since': self._offline_since,
+                  'snapshot': None, 'snapshot_time': None}
+        if not status['online']:
+            try:
+                engine = self._offline_engine()
+                status['snapshot'] = os.path.basename(engine.snapshot_path)
+                status['snapshot_time'] = engine.backup_time
+            except DatabaseUnavailableError:
+                pass
+        return status
+
+    @staticmethod
+    def _time_budget(method):
+        """方法的 maxTimeMS 预算（毫秒），None 表示不限制"""
+        value = os.getenv(f'MONGO_MAX_TIME_MS_{method.upper()}')
+        budget = int(value) if value else QUERY_TIME_BUDGETS_MS.get(method, 0)
+        return budget or None
+
+    def _agg_options(self, method):
+        """aggregate / count_documents 的 maxTimeMS 参数"""
+        budget = self._time_budget(method)
+        return {'maxTimeMS': budget} if budget else {}
+
+    def _maintenance_db(self, db_name=TARGET_DB_NAME, primary=False):
+        """
+        备份/恢复等维护任务使用的库句柄（独立连接池）
+
+        :param primary: 读取主节点。默认读可路由到从节点，只适合备份与统计这类扫描；
+            写入后回读校验（恢复、暂存、影子副本、归档）的路径必须读主节点，否则从节点延迟会读到旧数据
+        """
+        db = self.maintenance_client[db_name]
+        return db.with_options(read_preference=ReadPreference.PRIMARY) if primary else db
+
+    def _lease_token(self):
+        """当前线程持有的维护租约令牌（未持有时为 None）"""
+        lease = getattr(self._lease_local, 'lease', None)
+        return lease.token if lease else None
+
+    def _check_lease(self):
+        """不可逆步骤前确认仍持有维护租约（租约被接管时抛出 LeaseLostError）"""
+        lease = getattr(self._lease_local, 'lease', None)
+        if lease:
+            lease.check()
+
+    @_offline_fallback
     def get_user_auth_record(self, username):
         """
         从数据库读取用户认证信息
@@ -107,7 +454,8 @@ class BillDatabase:
         try:
             doc = self.users_collection.find_one(
                 {'username': username},
-                {'password': 1, 'force_password_change': 1, '_id': 0}
+                {'password': 1, 'force_password_change': 1, '_id': 0},
+                max_time_ms=self._time_budget('get_user_auth_record')
             )
             if not doc:
                 return None
@@ -143,6 +491,9 @@ class BillDatabase:
         :param force_password_change: 是否强制下次登录改密
         :return: 是否成功
         """
+        if not self.is_online:
+            logger.warning(f"只读模式下拒绝保存用户密码: {username}")
+            return False
         try:
             self.users_collection.update_one(
                 {'username': username},
@@ -150,10 +501,11 @@ class BillDatabase:
                     'username': username,
                     'password': password_hash,
                     'force_password_change': force_password_change,
-                    'updated_at': datetime.now().isoformat()
+                    'updated_at': datetime.utcnow()
                 }},
                 upsert=True
             )
+            self._mark_dirty('users', partitions=[WHOLE_COLLECTION])
             # 写入后立即回读校验，避免“写入看似成功但实际未生效”
             saved = self.get_user_auth_record(username)
             return bool(saved and saved.get('password') == password_hash and
@@ -169,25 +521,30 @@ class BillDatabase:
         :param bill_data: 账单数据字典
         :return: 插入结果
         """
+        self._require_online('录入账单')
         try:
             
             # 验证必填字段
-            required_fields = ['bill_date', 'type', 'category', 'amount']
+            required_fields = ['bill_date', 'type', 'category']
             for field in required_fields:
                 if field not in bill_data:
                     raise ValueError(f"缺少必填字段: {field}")
+            if AMOUNT_FIELD not in bill_data and LEGACY_AMOUNT_FIELD not in bill_data:
+                raise ValueError(f"缺少必填字段: {AMOUNT_FIELD}")
             
             # 类型转换和验证
             try:
                 # 确保日期是字符串且格式正确
                 bill_data['bill_date'] = str(bill_data['bill_date'])
                 
-                # 确保金额是数字
-                bill_data['amount'] = float(bill_data['amount'])
+                # 金额统一存为 int64 分（兼容调用方仍传 amount 元）
+                bill_data[AMOUNT_FIELD] = Int64(bill_amount_cents(bill_data))
+                bill_data.pop(LEGACY_AMOUNT_FIELD, None)
                 
                 # 可选字段处理
                 if 'remark' not in bill_data:
                     bill_data['remark'] = ''
+                bill_data['updated_at'] = datetime.utcnow()
             except (ValueError, TypeError) as e:
                 raise ValueError(f"数据类型转换错误: {e}")
             
@@ -195,16 +552,90 @@ class BillDatabase:
             
             # 插入数据
             result = self.collection.insert_one(bill_data)
+            self._mark_dirty('bills', docs=[bill_data])
             
             # 记录日志
             logger.info(f"账单插入成功: {result.inserted_id}")
             
             return result.inserted_id
         
+        except ConnectionFailure as e:
+            self._mark_offline(e)
+            raise DatabaseUnavailableError('数据库连接中断，账单未保存，请稍后重试') from e
         except Exception as e:
             logger.error(f"账单插入失败: {e}")
             raise
     
+    def _mark_dirty(self, collection_name, docs=None, partitions=None, count=None):
+        """
+        标记写入涉及的摘要分区（失败不影响写入本身，下次检测时由分区指纹发现变化）
+
+        :param count: 计入写入计数的条数，默认为 docs 条数（至少 1）
+        """
+        try:
+            self.digests.mark_dirty(collection_name, docs=docs, partitions=partitions)
+        except Exception as e:
+            logger.warning(f"标记摘要分区失败 {collection_name}: {e}")
+        self._count_writes(count if count is not None else (len(docs) if docs else 1))
+
+    def _count_writes(self, n):
+        """累加写入计数（失败只影响调度器的写入量触发，定时备份仍会兜底）"""
+        try:
+            self.write_counter.add(n)
+        except Exception as e:
+            logger.warning(f"更新写入计数失败: {e}")
+
+    def delete_bill(self, bill_id):
+        """
+        删除一条热表中的账单，并写入墓碑供增量快照回放删除
+
+        已归档年份是冻结的（快照只引用其导出文件，不参与摘要），不在此删除：
+        需先移回热表（archive_bills.py --unarchive）再删除。
+
+        :param bill_id: 账单 _id（ObjectId 或其字符串）
+        :return: {'success', 'message'}
+        """
+        self._require_online('删除账单')
+        try:
+            if isinstance(bill_id, str):
+                bill_id = ObjectId(bill_id)
+            deleted = self.collection.find_one_and_delete({'_id': bill_id})
+            if not deleted:
+                for year in sorted(self.archive.archived_years(refresh=True)):
+                    if self.db[archive_collection_name(year)].count_documents({'_id': bill_id}, limit=1):
+                        return {
+                            'success': False,
+                            'message': f'{year} 年账单已归档，请先执行 python scripts/archive_bills.py --unarchive {year} 再删除',
+                        }
+                return {'success': False, 'message': '账单不存在'}
+            self._mark_dirty('bills', docs=[deleted])
+            self.db[TOMBSTONE_COLLECTION].insert_one({
+                'collection': 'bills',
+                'doc_id': bill_id,
+                'deleted_at': datetime.utcnow(),
+            })
+            logger.info(f"账单删除成功: {bill_id}")
+            return {'success': True, 'message': '账单已删除'}
+        except ConnectionFailure as e:
+            self._mark_offline(e)
+            raise DatabaseUnavailableError('数据库连接中断，账单未删除，请稍后重试') from e
+        except InvalidId:
+            return {'success': False, 'message': '账单编号无效'}
+        except Exception as e:
+            logger.error(f"账单删除失败: {e}")
+            raise
+
+    @staticmethod
+    def _years_between(start_date, end_date):
+        """日期区间覆盖的年份（任一端缺失时返回 None，表示不限年份）"""
+        if not start_date or not end_date:
+            return None
+        return range(int(str(start_date)[:4]), int(str(end_date)[:4]) + 1)
+
+    def _bills_pipeline(self, match, years=None):
+        """账单聚合管道起始阶段：热表 $match，范围触及归档年份时 $unionWith 冷数据"""
+        return self.archive.union_pipeline(match, years)
+
     def _build_year_filter(self, year, bill_type=None, bill_categories=None, remark=None):
         """构建指定年份内的 MongoDB 查询条件（可选类型、分类、备注关键词）。"""
         year_start = int(f"{year}0101")
@@ -227,6 +658,7 @@ class BillDatabase:
             query['remark'] = {'$regex': re.escape(str(remark)), '$options': 'i'}
         return query
 
+    @_offline_fallback
     def get_bills_by_year(
         self,
         year,
@@ -256,7 +688,8 @@ class BillDatabase:
                 page=page, 
                 page_size=page_size,
                 sort_field='bill_date',
-                sort_order=-1  # 按日期降序
+                sort_order=-1,  # 按日期降序
+                years=[year]
             )
             
             logger.info(f"成功获取{year}年度账单，第{page}页，共{result['total_count']}条记录")
@@ -271,7 +704,8 @@ class BillDatabase:
                 page=1, 
                 page_size=10, 
                 sort_field='bill_date', 
-                sort_order=-1):
+                sort_order=-1,
+                years=None):
         """
         通用的分页查询方法
         
@@ -280,33 +714,45 @@ class BillDatabase:
         :param page_size: 每页记录数
         :param sort_field: 排序字段
         :param sort_order: 排序顺序，1为升序，-1为降序
+        :param years: 查询覆盖的年份，用于决定是否合并归档数据；None 表示不限
         :return: 查询结果和总记录数
         """
         try:
             
+            self.query_recorder.record('paginate_query', query, sort=[(sort_field, sort_order)])
+
             # 计算跳过的记录数
             skip = (page - 1) * page_size
             
-            # 执行查询
-            total_count = self.collection.count_documents(query)
+            base_pipeline = self._bills_pipeline(query, years)
+
+            # 执行查询（未触及归档时直接 count_documents）
+            time_options = self._agg_options('paginate_query')
+            if len(base_pipeline) == 1:
+                total_count = self.reporting_collection.count_documents(query, **time_options)
+            else:
+                counted = list(self.reporting_collection.aggregate(
+                    base_pipeline + [{'$count': 'n'}], **time_options
+                ))
+                total_count = counted[0]['n'] if counted else 0
             
             # 构建聚合管道
             pipeline = [
-                {'$match': query},
+                *base_pipeline,
                 {'$sort': {sort_field: sort_order}},
                 {'$skip': skip},
                 {'$limit': page_size}
             ]
             
             # 执行查询
-            results = list(self.collection.aggregate(pipeline))
+            results = list(self.reporting_collection.aggregate(pipeline, **time_options))
             
             # 转换为DataFrame
             df = pd.DataFrame(results)
             
             # 确保数据类型正确
             if not df.empty:
-                df['amount'] = df['amount'].astype(float)
+                df[AMOUNT_FIELD] = df[AMOUNT_FIELD].astype('int64')
                 df['bill_date'] = df['bill_date'].astype(str)
             
             # 计算总页数
@@ -325,6 +771,8 @@ class BillDatabase:
             logger.error(f"分页查询失败: {e}")
             raise
     
+    @_with_yuan_amounts
+    @_offline_fallback
     def get_annual_summary(self, year, bill_type=None, bill_categories=None, remark=None):
         """
         获取指定年份的财务年度总结（支持与明细相同的筛选条件）
@@ -333,22 +781,26 @@ class BillDatabase:
         :param bill_type: 账单类型（支出/收入）
         :param bill_categories: 账单分类列表
         :param remark: 备注关键词
-        :return: 包含年度收入、支出和净收益的字典
+        :return: 包含年度收入、支出和净收益的字典：income_cents / expense_cents / net_cents（分），
+            另有旧版以元为单位的 income / expense / net
         """
         try:
             match_query = self._build_year_filter(year, bill_type, bill_categories, remark)
+            self.query_recorder.record(
+                'get_annual_summary', match_query, fields=['bill_date', AMOUNT_FIELD]
+            )
             
             # 聚合管道
             pipeline = [
-                {'$match': match_query},
+                *self._bills_pipeline(match_query, [year]),
                 {
                     '$group': {
                         '_id': None,
                         'total_income': {
                             '$sum': {
                                 '$cond': [
-                                    {'$gt': ['$amount', 0]},  # 条件：金额大于0
-                                    '$amount',               # 为真时求和
+                                    {'$gt': ['$amount_cents', 0]},  # 条件：金额大于0
+                                    '$amount_cents',               # 为真时求和（整数分）
                                     0                        # 为假时为0
                                 ]
                             }
@@ -356,8 +808,8 @@ class BillDatabase:
                         'total_expense': {
                             '$sum': {
                                 '$cond': [
-                                    {'$lt': ['$amount', 0]},  # 条件：金额小于0
-                                    {'$abs': '$amount'},      # 取绝对值
+                                    {'$lt': ['$amount_cents', 0]},  # 条件：金额小于0
+                                    {'$abs': '$amount_cents'},      # 取绝对值
                                     0                         # 为假时为0
                                 ]
                             }
@@ -367,28 +819,33 @@ class BillDatabase:
             ]
             
             # 执行聚合查询
-            result = list(self.collection.aggregate(pipeline))
+            result = list(self.reporting_collection.aggregate(
+                pipeline, **self._agg_options('get_annual_summary')
+            ))
             
             # 处理查询结果
             if result and len(result) > 0:
                 summary = result[0]
+                income = int(summary['total_income'])
+                expense = int(summary['total_expense'])
                 return {
-                    'income': summary['total_income'],
-                    'expense': summary['total_expense'],
-                    'net': summary['total_income'] - summary['total_expense']
+                    'income_cents': income,
+                    'expense_cents': expense,
+                    'net_cents': income - expense
                 }
             else:
                 # 如果没有数据，返回全0
                 return {
-                    'income': 0,
-                    'expense': 0,
-                    'net': 0
+                    'income_cents': 0,
+                    'expense_cents': 0,
+                    'net_cents': 0
                 }
         
         except Exception as e:
             logger.error(f"{year}年度财务总结获取失败: {e}")
             raise
 
+    @_offline_fallback
     def query_bills(self, 
                   start_date=None, 
                   end_date=None, 
@@ -406,8 +863,8 @@ class BillDatabase:
         :param bill_type: 账单类型
         :param bill_category: 账单分类（单个，可选）
         :param bill_categories: 账单分类列表（多个，可选；优先于bill_category）
-        :param min_amount: 最小金额
-        :param max_amount: 最大金额
+        :param min_amount: 最小金额（元，按分精确比较）
+        :param max_amount: 最大金额（元，按分精确比较）
         :param remark: 备注关键词
         :return: 查询结果DataFrame
         """
@@ -447,30 +904,40 @@ class BillDatabase:
             # 金额范围查询
             amount_query = {}
             if min_amount is not None:
-                amount_query['$gte'] = float(min_amount)
+                amount_query['$gte'] = to_cents(min_amount)
             if max_amount is not None:
-                amount_query['$lte'] = float(max_amount)
+                amount_query['$lte'] = to_cents(max_amount)
             if amount_query:
-                query['amount'] = amount_query
+                query[AMOUNT_FIELD] = amount_query
             
             # 备注模糊查询（转义正则特殊字符，避免正则注入/ReDoS）
             if remark:
                 query['remark'] = {'$regex': re.escape(str(remark)), '$options': 'i'}
             
-            # 执行查询
-            bills = list(self.collection.find(query))
+            self.query_recorder.record('query_bills', query, sort=[('bill_date', -1)])
+
+            # 执行查询（日期范围触及归档年份时合并冷数据）
+            pipeline = self._bills_pipeline(query, self._years_between(start_date, end_date))
+            if len(pipeline) == 1:
+                bills = list(self.reporting_collection.find(query).max_time_ms(
+                    self._time_budget('query_bills')
+                ))
+            else:
+                bills = list(self.reporting_collection.aggregate(
+                    pipeline, **self._agg_options('query_bills')
+                ))
             
             # 转换为DataFrame
             df = pd.DataFrame(bills)
             
             # 确保数据类型正确
             if not df.empty:
-                df['amount'] = df['amount'].astype(float)
+                df[AMOUNT_FIELD] = df[AMOUNT_FIELD].astype('int64')
                 df['bill_date'] = df['bill_date'].astype(str)
             
             # 如果查询结果为空，返回空DataFrame
             if df.empty:
-                return pd.DataFrame(columns=['bill_date', 'type', 'category', 'amount', 'remark'])
+                return pd.DataFrame(columns=['bill_date', 'type', 'category', AMOUNT_FIELD, 'remark'])
             
             # 对结果进行排序（按日期降序）
             df = df.sort_values('bill_date', ascending=False)
@@ -481,73 +948,46 @@ class BillDatabase:
             logger.error(f"账单查询失败: {e}")
             raise
 
+    @_with_yuan_amounts
+    @_offline_fallback
     def get_period_summary(self, period_type='week', start_date=None):
         """
         获取指定周期的财务总结
         
         :param period_type: 周期类型，可选 'week', 'month', 'quarter', 'year'
         :param start_date: 开始日期，默认为当前日期
-        :return: 周期财务总结字典
+        :return: 周期财务总结字典（*_cents 单位为分，旧版 income / expense / net 为元）
         """
         try:
-            # 如果没有传入开始日期，使用当前日期
-            if start_date is None:
-                start_date = datetime.now().strftime('%Y%m%d')
-            
-            # 将开始日期转换为datetime对象
-            start_datetime = datetime.strptime(start_date, '%Y%m%d')
-            
-            # 根据周期类型计算开始和结束日期
-            if period_type == 'week':
-                # 获取本周第一天（自然周）
-                week_start = start_datetime - timedelta(days=start_datetime.weekday())
-                end_datetime = week_start + timedelta(days=6)
-                start_datetime = week_start
-            elif period_type == 'month':
-                # 获取本月第一天（自然月）
-                month_start = start_datetime.replace(day=1)
-                end_datetime = month_start + relativedelta(months=1) - timedelta(days=1)
-                start_datetime = month_start
-            elif period_type == 'quarter':
-                # 获取本季度第一天（自然季）
-                quarter_start = start_datetime.replace(
-                    day=1, 
-                    month=((start_datetime.month - 1) // 3) * 3 + 1
-                )
-                end_datetime = quarter_start + relativedelta(months=3) - timedelta(days=1)
-                start_datetime = quarter_start
-            elif period_type == 'year':
-                # 获取本年第一天（自然年）
-                year_start = start_datetime.replace(month=1, day=1)
-                end_datetime = year_start.replace(month=12, day=31)
-                start_datetime = year_start
-            else:
-                raise ValueError(f"不支持的周期类型: {period_type}")
+            start_datetime, end_datetime = period_date_range(period_type, start_date)
             
             # 构建查询条件
             start_date_int = int(start_datetime.strftime('%Y%m%d'))
             end_date_int = int(end_datetime.strftime('%Y%m%d'))
+            period_match = {
+                '$expr': {
+                    '$and': [
+                        {'$gte': [{'$toInt': '$bill_date'}, start_date_int]},
+                        {'$lte': [{'$toInt': '$bill_date'}, end_date_int]}
+                    ]
+                }
+            }
             pipeline = [
-                {
-                    '$match': {
-                        '$expr': {
-                            '$and': [
-                                {'$gte': [{'$toInt': '$bill_date'}, start_date_int]},
-                                {'$lte': [{'$toInt': '$bill_date'}, end_date_int]}
-                            ]
-                        }
-                    }
-                },
+                *self._bills_pipeline(
+                    period_match, self._years_between(start_date_int, end_date_int)
+                ),
                 {
                     '$group': {
                         '_id': '$type',  # 按账单类型分组
-                        'total_amount': {'$sum': '$amount'}  # 计算每种类型的总金额
+                        'total_amount': {'$sum': '$amount_cents'}  # 计算每种类型的总金额（整数分）
                     }
                 }
             ]
             
             # 执行聚合查询
-            result = list(self.collection.aggregate(pipeline))
+            result = list(self.reporting_collection.aggregate(
+                pipeline, **self._agg_options('get_period_summary')
+            ))
             
             # 初始化收入和支出
             income_total = 0
@@ -555,16 +995,17 @@ class BillDatabase:
             
             # 分类汇总
             for item in result:
-                if item['total_amount'] > 0:
-                    income_total += item['total_amount']
+                total_amount = int(item['total_amount'])
+                if total_amount > 0:
+                    income_total += total_amount
                 else:
-                    expense_total += abs(item['total_amount'])
+                    expense_total += abs(total_amount)
             
-            # 构建总结
+            # 构建总结（单位：分）
             summary = {
-                'income': income_total,
-                'expense': expense_total,
-                'net': income_total - expense_total,
+                'income_cents': income_total,
+                'expense_cents': expense_total,
+                'net_cents': income_total - expense_total,
                 'start_date': start_datetime.strftime('%Y%m%d'),
                 'end_date': end_datetime.strftime('%Y%m%d')
             }
@@ -575,95 +1016,108 @@ class BillDatabase:
             logger.error(f"{period_type}财务总结获取失败: {e}")
             raise
 
+    @_with_yuan_amounts
+    @_offline_fallback
     def get_category_summary(self, year, bill_type='all'):
         """
         获取指定年份的类别统计
         
         :param year: 统计年份
         :param bill_type: 统计类型 'income', 'expense', 或 'all'
-        :return: DataFrame 包含类别和金额
+        :return: DataFrame 包含类别和金额（amount_cents，单位：分；amount 为元，兼容旧调用方）
         """
         try:
             # 构建聚合管道
             year_start = int(f"{year}0101")
             year_end = int(f"{year}1231")
+            year_match = {
+                '$expr': {
+                    '$and': [
+                        {'$gte': [{'$toInt': '$bill_date'}, year_start]},
+                        {'$lte': [{'$toInt': '$bill_date'}, year_end]}
+                    ]
+                }
+            }
             pipeline = [
-                # 匹配指定年份的账单
-                {'$match': {
-                    '$expr': {
-                        '$and': [
-                            {'$gte': [{'$toInt': '$bill_date'}, year_start]},
-                            {'$lte': [{'$toInt': '$bill_date'}, year_end]}
-                        ]
-                    }
-                }},
+                # 匹配指定年份的账单（含归档年份）
+                *self._bills_pipeline(year_match, [year]),
                 # 根据账单类型过滤
-                *([{'$match': {'amount': {'$gt': 0}}}] if bill_type == 'income' 
-                  else [{'$match': {'amount': {'$lt': 0}}}] if bill_type == 'expense' 
+                *([{'$match': {AMOUNT_FIELD: {'$gt': 0}}}] if bill_type == 'income' 
+                  else [{'$match': {AMOUNT_FIELD: {'$lt': 0}}}] if bill_type == 'expense' 
                   else []),
-                # 按类别分组并计算总金额
+                # 按类别分组并计算总金额（整数分）
                 {'$group': {
                     '_id': '$category',
-                    'amount': {'$sum': {'$abs': '$amount'}}
+                    AMOUNT_FIELD: {'$sum': {'$abs': '$amount_cents'}}
                 }},
                 # 转换结果格式
                 {'$project': {
                     'category': '$_id',
-                    'amount': 1,
+                    AMOUNT_FIELD: 1,
                     '_id': 0
                 }},
                 # 按金额降序排序
-                {'$sort': {'amount': -1}}
+                {'$sort': {AMOUNT_FIELD: -1}}
             ]
             
             # 执行聚合查询
-            result = list(self.collection.aggregate(pipeline))
+            result = list(self.reporting_collection.aggregate(
+                pipeline, **self._agg_options('get_category_summary')
+            ))
             
             # 转换为DataFrame
-            df = pd.DataFrame(result) if result else pd.DataFrame(columns=['category', 'amount'])
+            if not result:
+                return pd.DataFrame(columns=['category', AMOUNT_FIELD])
+            df = pd.DataFrame(result)
+            df[AMOUNT_FIELD] = df[AMOUNT_FIELD].astype('int64')
             
             return df
         
+        except ConnectionFailure:
+            raise
         except Exception as e:
             logger.error(f"类别统计查询失败: {e}")
-            return pd.DataFrame(columns=['category', 'amount'])
+            return pd.DataFrame(columns=['category', AMOUNT_FIELD])
 
+    @_with_yuan_amounts
+    @_offline_fallback
     def get_monthly_summary(self, year):
         """
         获取指定年份的月度收支统计
         
         :param year: 统计年份
-        :return: DataFrame 包含月份、收入和支出
+        :return: DataFrame 包含月份、收入和支出（income_cents / expense_cents，单位：分；income / expense 为元）
         """
         try:
             # 构建聚合管道
             year_start = int(f"{year}0101")
             year_end = int(f"{year}1231")
+            year_match = {
+                '$expr': {
+                    '$and': [
+                        {'$gte': [{'$toInt': '$bill_date'}, year_start]},
+                        {'$lte': [{'$toInt': '$bill_date'}, year_end]}
+                    ]
+                }
+            }
             pipeline = [
-                # 匹配指定年份的账单
-                {'$match': {
-                    '$expr': {
-                        '$and': [
-                            {'$gte': [{'$toInt': '$bill_date'}, year_start]},
-                            {'$lte': [{'$toInt': '$bill_date'}, year_end]}
-                        ]
-                    }
-                }},
+                # 匹配指定年份的账单（含归档年份）
+                *self._bills_pipeline(year_match, [year]),
                 # 按月份分组并计算收入和支出
                 {'$group': {
                     '_id': {'$substr': ['$bill_date', 4, 2]},
-                    'income': {
-                        '$sum': {'$cond': [{'$gt': ['$amount', 0]}, '$amount', 0]}
+                    'income_cents': {
+                        '$sum': {'$cond': [{'$gt': ['$amount_cents', 0]}, '$amount_cents', 0]}
                     },
-                    'expense': {
-                        '$sum': {'$cond': [{'$lt': ['$amount', 0]}, {'$abs': '$amount'}, 0]}
+                    'expense_cents': {
+                        '$sum': {'$cond': [{'$lt': ['$amount_cents', 0]}, {'$abs': '$amount_cents'}, 0]}
                     }
                 }},
                 # 转换结果格式
                 {'$project': {
                     'month': {'$toInt': '$_id'},
-                    'income': 1,
-                    'expense': 1,
+                    'income_cents': 1,
+                    'expense_cents': 1,
                     '_id': 0
                 }},
                 # 按月份排序
@@ -671,59 +1125,187 @@ class BillDatabase:
             ]
             
             # 执行聚合查询
-            result = list(self.collection.aggregate(pipeline))
+            result = list(self.reporting_collection.aggregate(
+                pipeline, **self._agg_options('get_monthly_summary')
+            ))
             
             # 转换为DataFrame
-            df = pd.DataFrame(result) if result else pd.DataFrame(columns=['month', 'income', 'expense'])
+            df = pd.DataFrame(result) if result else pd.DataFrame(columns=['month', 'income_cents', 'expense_cents'])
             
             # 补全缺失月份
             all_months = pd.DataFrame({
                 'month': range(1, 13)
             })
             df = all_months.merge(df, on='month', how='left').fillna(0)
+            df[['income_cents', 'expense_cents']] = df[['income_cents', 'expense_cents']].astype('int64')
             
             return df
         
+        except ConnectionFailure:
+            raise
         except Exception as e:
             logger.error(f"月度统计查询失败: {e}")
-            return pd.DataFrame(columns=['month', 'income', 'expense'])
+            return pd.DataFrame(columns=['month', 'income_cents', 'expense_cents'])
+
+    def get_partition_digests(self, verify=None):
+        """
+        各集合按年月分区的叶子摘要（只重算有写入的分区）
+
+        :param verify: True 时先做指纹核对，找出绕过应用写入的分区（整集合聚合，较慢）；
+            默认按 DIGEST_VERIFY_INTERVAL_SECONDS 的间隔核对
+        :return: {集合名: {分区: 摘要}}，失败时返回 None
+        """
+        try:
+            db = self._maintenance_db(TARGET_DB_NAME)
+            return PartitionDigests(db).refresh(self._backup_collection_names(db), verify=verify)
+        except Exception as e:
+            logger.error(f"计算分区摘要失败: {e}")
+            return None
 
     def get_data_hash(self):
         """
-        获取数据的哈希值，用于检测数据变化
+        获取数据的哈希值（分区摘要的 Merkle 根），用于检测数据变化
         
         :return: 数据哈希值
         """
+        digests = self.get_partition_digests()
+        return merkle_root(digests) if digests is not None else None
+
+    def compare_backup_with_live(self, backup_path):
+        """
+        对比备份记录的分区摘要与当前数据库，列出此后发生变化的分区
+
+        :return: {'success', 'identical', 'changed_partitions': {集合名: [分区]}, 'backup_hash', 'current_hash'}
+        """
+        if not self.is_online:
+            return {'success': False, 'message': '数据库暂不可用（只读模式），无法对比'}
         try:
-            import hashlib
-            
-            # 获取bill_tracker数据库的基本统计信息
-            target_db_name = 'bill_tracker'
-            db = self.client[target_db_name]
-            collections = db.list_collection_names()
-            
-            hash_data = []
-            for collection_name in collections:
-                collection = db[collection_name]
-                count = collection.count_documents({})
-                
-                # 获取最新和最旧记录的时间戳
-                latest = list(collection.find().sort('_id', -1).limit(1))
-                oldest = list(collection.find().sort('_id', 1).limit(1))
-                
-                latest_id = str(latest[0]['_id']) if latest else ''
-                oldest_id = str(oldest[0]['_id']) if oldest else ''
-                
-                hash_data.append(f"{collection_name}:{count}:{latest_id}:{oldest_id}")
-            
-            # 生成哈希值
-            hash_string = '|'.join(sorted(hash_data))
-            return hashlib.md5(hash_string.encode()).hexdigest()
-            
+            info = read_backup_info(backup_path)
+            recorded = info.get('partition_digests')
+            if recorded is None:
+                return {'success': False, 'message': '该备份不含分区摘要（早期版本），无法对比'}
+            current = self.get_partition_digests()
+            if current is None:
+                return {'success': False, 'message': '计算当前分区摘要失败'}
+            changed = changed_partitions(recorded, current)
+            return {
+                'success': True,
+                'identical': not changed,
+                'changed_partitions': changed,
+                'backup_hash': info.get('data_hash'),
+                'current_hash': merkle_root(current),
+            }
         except Exception as e:
-            logger.error(f"获取数据哈希失败: {e}")
-            return None
-    
+            logger.error(f"对比备份失败: {e}")
+            return {'success': False, 'message': str(e)}
+
+    def dry_run_restore(self, backup_path, include_users=False, years=None, sample_size=SAMPLE_SIZE):
+        """
+        恢复预演：不写入数据库，统计各恢复模式将插入、更新、保持不变与删除的文档数（含样例）
+
+        快照链与现网集合按 _id 顺序归并对比，耗时约为一次顺序扫描，内存与数据量无关；
+        单份全量快照带分区摘要时，摘要与现网一致的分区直接计为不变，不再逐条比较。
+
+        :param include_users: full_replace / merge 是否包含 users 集合（与恢复参数一致）
+        :param years: 只预演这些年份的账单
+        :return: {'success', 'modes': {恢复模式: {'inserted', 'updated', 'unchanged', 'deleted', 'kept',
+                  'collections': {集合名: {..., 'samples'}}}}, 'compared_partitions', 'chain'}
+        """
+        if not self.is_online:
+            return {'success': False, 'message': '数据库暂不可用（只读模式），无法预演'}
+        years = sorted({str(y) for y in years}) if years else None
+        try:
+            chain = backup_chain(backup_path)
+            db = self._maintenance_db(primary=True)
+            with ExitStack() as stack:
+                readers = [stack.enter_context(open_backup(path)) for path in chain]
+                if readers[0].database_name != TARGET_DB_NAME:
+                    return {'success': False, 'message': f'备份中未找到数据库 {TARGET_DB_NAME}'}
+
+                # 与 restore_from_backup 的目标集合一致
+                names = []
+                for reader in readers:
+                    for name in reader.collection_names() + list(reader.info.get('replaced_partitions') or {}):
+                        if name not in names and name != TOMBSTONE_COLLECTION:
+                            names.append(name)
+                if not include_users and 'users' in names:
+                    names.remove('users')
+                if years:
+                    names = [name for name in names if is_partitioned(name)]
+
+                # 单份全量快照：只逐条比较摘要与现网不同的分区
+                compared, unchanged = {}, {}
+                recorded = readers[0].info.get('partition_digests') if len(chain) == 1 else None
+                if recorded is not None:
+                    digests = PartitionDigests(db)
+                    changed = changed_partitions(recorded, digests.refresh(self._backup_collection_names(db)))
+                    counts = digests.counts(names)
+                    for name in names:
+                        def in_scope(partition, name=name):
+                            return not years or not is_partitioned(name) or year_of(partition) in years
+
+                        coll_changed = changed.get(name, [])
+                        compared[name] = [p for p in coll_changed if in_scope(p)]
+                        unchanged[name] = sum(
+                            count for p, count in counts[name].items() if p not in coll_changed and in_scope(p)
+                        )
+
+                diffs = {}
+                for name in names:
+                    if compared.get(name) == []:
+                        diffs[name] = CollectionDiff(sample_size)
+                    else:
+                        diffs[name] = diff_collection(
+                            db[name], readers, name,
+                            years=years if is_partitioned(name) else None,
+                            partitions=compared.get(name),
+                            normalize=self._doc_for_mongo,
+                            sample_size=sample_size,
+                        )
+                    diffs[name].add_unchanged(unchanged.get(name, 0))
+
+            modes = {}
+            for mode, view, targets in (
+                (RESTORE_MODE_BILLS_ONLY, VIEW_REPLACE, [name for name in names if name == 'bills']),
+                (RESTORE_MODE_FULL_REPLACE, VIEW_REPLACE, names),
+                (RESTORE_MODE_MERGE, VIEW_MERGE, names),
+            ):
+                collections = {name: diffs[name].views[view] for name in targets}
+                summary = {key: sum(c[key] for c in collections.values()) for key in DIFF_KEYS}
+                summary['collections'] = collections
+                modes[mode] = summary
+            return {
+                'success': True,
+                'backup_path': backup_path,
+                'chain': [os.path.basename(p) for p in chain],
+                'years': years,
+                'modes': modes,
+                'compared_partitions': compared if recorded is not None else None,
+            }
+        except Exception as e:
+            logger.error(f"恢复预演失败: {e}")
+            return {'success': False, 'message': f'预演失败: {str(e)}'}
+
+    def _backup_collection_names(self, db):
+        """需要参与哈希与备份的集合（排除内部统计集合、恢复暂存集合、影子副本与已冻结导出的归档集合）"""
+        frozen = exported_archive_collections(db)
+        return [
+            name for name in db.list_collection_names()
+            if name not in INTERNAL_COLLECTIONS and name not in frozen
+            and not is_staging(name) and not is_shadow(name)
+        ]
+
+    def _archived_years_info(self, db):
+        """备份中引用的冻结归档年份（按年份记录集合名、条数与导出文件）"""
+        return {
+            str(meta['_id']): {
+                'collection': name,
+                'count': meta.get('count', 0),
+                'export_file': meta.get('export_file'),
+            }
+            for name, meta in exported_archive_collections(db).items()
+        }
+
     def _ensure_data_layout(self):
         """创建 data 子目录，并将旧版 data/*.json 迁移到 snapshots/"""
         data_root = get_data_root()
@@ -731,6 +1313,7 @@ class BillDatabase:
         os.makedirs(snapshots_dir, exist_ok=True)
         os.makedirs(get_pre_restore_dir(), exist_ok=True)
         os.makedirs(get_yearly_dir(), exist_ok=True)
+        os.makedirs(get_partitions_dir(), exist_ok=True)
 
         for path in glob.glob(os.path.join(data_root, 'bills_backup_*.json')):
             dest = os.path.join(snapshots_dir, os.path.basename(path))
@@ -742,64 +1325,71 @@ class BillDatabase:
                     logger.warning(f"迁移旧备份失败 {path}: {e}")
 
     def _write_manifest(self, event_type, **payload):
-        """记录最近一次备份/恢复操作"""
+        """记录最近一次备份/恢复操作（写入索引的 events 表，manifest.json 原子重写）"""
         try:
-            manifest = {}
-            manifest_path = get_manifest_path()
-            if os.path.exists(manifest_path):
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    manifest = json.load(f)
-            manifest[event_type] = {
-                'time': datetime.now().isoformat(),
-                **payload
-            }
-            with open(manifest_path, 'w', encoding='utf-8') as f:
-                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            self.catalog.record_event(event_type, **payload)
         except Exception as e:
             logger.warning(f"写入 manifest 失败: {e}")
 
-    def _bills_date_range(self, documents):
-        dates = [str(d.get('bill_date')) for d in documents if d.get('bill_date')]
-        if not dates:
-            return None, None
-        return min(dates), max(dates)
+    @staticmethod
+    def _backup_dir_kind(backup_dir):
+        """备份目录对应的 (类别, 文件名前缀)"""
+        if 'pre_restore' in backup_dir.replace('\\', '/'):
+            return 'pre_restore', 'pre_restore_'
+        return 'snapshot', 'bills_backup_'
 
     def _doc_for_mongo(self, doc):
-        """将备份 JSON 中的文档还原为可写入 MongoDB 的格式"""
-        doc = dict(doc)
-        if '_id' in doc and isinstance(doc['_id'], str):
-            try:
-                doc['_id'] = ObjectId(doc['_id'])
-            except (InvalidId, TypeError):
-                del doc['_id']
-        return doc
+        """将备份中的文档还原为可写入 MongoDB 的格式（见 restored_document）"""
+        return restored_document(doc)
 
-    def cleanup_old_backups(self, backup_dir, max_backups=5, filename_pattern='bills_backup_*.json'):
+    def cleanup_old_backups(self, backup_dir, max_backups=5, prefix='bills_backup_'):
         """
-        清理旧的备份文件，只保留最新的几份
+        清理旧的备份文件，只保留最新的几条快照链（全量基线及其增量整体保留或删除）
         
         :param backup_dir: 备份目录
-        :param max_backups: 最大保留备份数量
-        :param filename_pattern: 匹配文件名模式
+        :param max_backups: 最大保留快照链数量
+        :param prefix: 备份文件名前缀（.jzb 与 .json 一并计算）
         """
         try:
-            backup_pattern = os.path.join(backup_dir, filename_pattern)
-            backup_files = glob.glob(backup_pattern)
+            backup_files = glob_backups(backup_dir, prefix)
             
             if len(backup_files) <= max_backups:
                 return
             
             backup_files.sort(key=os.path.getmtime, reverse=True)
-            files_to_delete = backup_files[max_backups:]
+            category, _ = self._backup_dir_kind(backup_dir)
+            self.catalog.reconcile(backup_dir, prefix, category)
+            chain_of = {}
+            for file_path in backup_files:
+                meta = self.catalog.get(file_path) or {}
+                chain_of[file_path] = meta.get('base') or os.path.basename(file_path)
+            kept_chains = []
+            for file_path in backup_files:
+                if chain_of[file_path] not in kept_chains:
+                    kept_chains.append(chain_of[file_path])
+            kept_chains = set(kept_chains[:max_backups])
+            files_to_delete = [p for p in backup_files if chain_of[p] not in kept_chains]
             for file_path in files_to_delete:
                 try:
                     os.remove(file_path)
+                    self.catalog.remove(file_path)
                     logger.info(f"删除旧备份文件: {os.path.basename(file_path)}")
                 except Exception as e:
                     logger.error(f"删除备份文件失败 {file_path}: {e}")
+            if files_to_delete:
+                self._collect_partition_garbage()
                     
         except Exception as e:
             logger.error(f"清理备份文件失败: {e}")
+
+    @staticmethod
+    def _collect_partition_garbage():
+        """回收不再被任何快照（含 pre_restore）引用的年度分区文件"""
+        backup_paths = (
+            glob_backups(get_snapshots_dir(), 'bills_backup_')
+            + glob_backups(get_pre_restore_dir(), 'pre_restore_')
+        )
+        return collect_garbage(backup_paths)
     
     def check_backup_needed(self, backup_dir):
         """
@@ -809,37 +1399,34 @@ class BillDatabase:
         :return: (是否需要备份, 当前哈希值, 上次哈希值)
         """
         try:
-            import os
-            import json
-            import glob
-            
-            # 获取当前数据哈希
-            current_hash = self.get_data_hash()
-            if not current_hash:
+            # 获取当前分区摘要与根哈希
+            current_digests = self.get_partition_digests()
+            if current_digests is None:
                 return True, None, None  # 无法获取哈希时，默认需要备份
+            current_hash = merkle_root(current_digests)
             
-            # 查找最新的备份文件
-            backup_pattern = os.path.join(backup_dir, 'bills_backup_*.json')
-            backup_files = glob.glob(backup_pattern)
-            
-            if not backup_files:
-                return True, current_hash, None  # 没有备份文件，需要备份
-            
-            # 获取最新备份文件
-            latest_backup = max(backup_files, key=os.path.getmtime)
-            
+            # 从备份索引取最新一份（目录有变化时才对账）
             try:
-                with open(latest_backup, 'r', encoding='utf-8') as f:
-                    backup_data = json.load(f)
-                    last_hash = backup_data.get('backup_info', {}).get('data_hash')
+                category, prefix = self._backup_dir_kind(backup_dir)
+                self.catalog.reconcile(backup_dir, prefix, category)
+                latest_backup = self.catalog.latest(backup_dir)
+                
+                if not latest_backup:
+                    return True, current_hash, None  # 没有备份文件，需要备份
+                
+                last_hash = latest_backup.get('data_hash')
+                
+                if last_hash == current_hash:
+                    logger.info(f"数据未发生变化，跳过备份 (哈希: {current_hash})")
+                    return False, current_hash, last_hash
+                else:
+                    logger.info(f"检测到数据变化，需要备份 (旧哈希: {last_hash}, 新哈希: {current_hash})")
+                    last_digests = read_backup_info(latest_backup['backup_path']).get('partition_digests')
+                    if last_digests is not None:
+                        changed = changed_partitions(last_digests, current_digests)
+                        logger.info("变化分区: " + '; '.join(f"{n}[{','.join(p)}]" for n, p in changed.items()))
+                    return True, current_hash, last_hash
                     
-                    if last_hash == current_hash:
-                        logger.info(f"数据未发生变化，跳过备份 (哈希: {current_hash})")
-                        return False, current_hash, last_hash
-                    else:
-                        logger.info(f"检测到数据变化，需要备份 (旧哈希: {last_hash}, 新哈希: {current_hash})")
-                        return True, current_hash, last_hash
-                        
             except Exception as e:
                 logger.warning(f"读取上次备份信息失败: {e}，将进行备份")
                 return True, current_hash, None
@@ -848,14 +1435,93 @@ class BillDatabase:
             logger.error(f"检查备份需求失败: {e}")
             return True, None, None  # 出错时默认需要备份
 
-    def backup_all_data(self, backup_path=None, force=False):
+    def _collection_watermarks(self, db, collections):
+        """各集合当前最大 _id（增量快照据此识别新插入的文档）"""
+        watermarks = {}
+        for name in collections:
+            last = list(db[name].find({}, {'_id': 1}).sort('_id', -1).limit(1))
+            watermarks[name] = str(last[0]['_id']) if last else None
+        return watermarks
+
+    @staticmethod
+    def _archive_state(db):
+        """归档年份及条数；与父快照不同说明发生过归档/回迁，需要重新写全量基线"""
+        return {str(meta['_id']): meta.get('count', 0) for meta in db[ARCHIVE_META_COLLECTION].find()}
+
+    @staticmethod
+    def _changes_since(parent_info):
+        return datetime.fromisoformat(parent_info['started_at']) - timedelta(seconds=INCREMENTAL_OVERLAP_SECONDS)
+
+    def _incremental_query(self, parent_info, collection_name):
+        """自父快照以来新增（_id 超过水位）或修改（updated_at 更新）的文档；父快照中没有该集合时整体写出"""
+        watermark = (parent_info.get('watermarks') or {}).get(collection_name)
+        if not watermark or not ObjectId.is_valid(watermark):
+            return None
+        return {'$or': [
+            {'_id': {'$gt': ObjectId(watermark)}},
+            {'updated_at': {'$gt': self._changes_since(parent_info)}},
+        ]}
+
+    def _incremental_parent(self, backup_dir, collections, archive_state):
         """
-        备份所有数据到JSON文件
+        增量快照的父快照（目录中最新的一份）；不满足条件时返回 (None, None)，改写全量基线
+
+        :return: (父快照路径, 父快照 backup_info)
+        """
+        try:
+            category, prefix = self._backup_dir_kind(backup_dir)
+            self.catalog.reconcile(backup_dir, prefix, category)
+            latest = self.catalog.latest(backup_dir)
+            if not latest:
+                return None, None
+            parent_path = latest['backup_path']
+            parent_info = read_backup_info(parent_path)
+            reason = None
+            if not parent_info.get('started_at') or parent_info.get('watermarks') is None:
+                reason = '父快照不含增量水位'
+            elif parent_info.get('chain_length', 0) >= BACKUP_MAX_CHAIN_LENGTH:
+                reason = f'快照链已达 {BACKUP_MAX_CHAIN_LENGTH} 份增量'
+            elif parent_info.get('archive_state') != archive_state:
+                reason = '归档状态已变化'
+            elif not set(parent_info['watermarks']) <= set(collections):
+                reason = '有集合被删除'
+            else:
+                last_restore = self.catalog.event('last_restore')
+                if last_restore and last_restore.get('time', '') > (parent_info.get('backup_time') or ''):
+                    reason = '父快照之后执行过恢复'
+            if reason is None:
+                backup_chain(parent_path)
+                return parent_path, parent_info
+            logger.info(f"写入全量基线: {reason}")
+        except Exception as e:
+            logger.warning(f"无法确定增量父快照，写入全量基线: {e}")
+        return None, None
+
+    def _prune_tombstones(self, db, before):
+        """全量基线写完后，早于基线的墓碑不再需要"""
+        try:
+            cutoff = before - timedelta(seconds=INCREMENTAL_OVERLAP_SECONDS)
+            removed = db[TOMBSTONE_COLLECTION].delete_many({'deleted_at': {'$lt': cutoff}}).deleted_count
+            if removed:
+                logger.info(f"已清理删除记录: {removed} 条")
+        except Exception as e:
+            logger.warning(f"清理删除记录失败: {e}")
+
+    @_with_maintenance_lease('backup')
+    def backup_all_data(self, backup_path=None, force=False, kind=None):
+        """
+        备份所有数据到JSON文件（服务端游标分批读取、流式写出，内存占用与数据量无关）
+
+        定时快照默认写增量：只含自父快照以来新增、修改（_id 水位 + updated_at）和删除（墓碑）
+        的文档；没有可用父快照、链过长或归档状态变化时写全量基线。pre_restore 始终为全量。
         
         :param backup_path: 备份文件路径，如果为None则自动生成
         :param force: 是否强制备份，忽略增量检测
+        :param kind: full | incremental | None（按 BACKUP_INCREMENTAL 自动选择）
         :return: 备份结果字典
         """
+        if not self.is_online:
+            return {'success': False, 'message': '数据库暂不可用（只读模式），无法备份'}
         try:
             import os
             import json
@@ -881,83 +1547,130 @@ class BillDatabase:
                         'current_hash': current_hash,
                         'last_hash': last_hash
                     }
-            else:
-                current_hash = self.get_data_hash()
             
             # 生成备份文件名
             if not backup_path:
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                backup_path = os.path.join(backup_dir, f'bills_backup_{timestamp}.json')
+                backup_path = os.path.join(backup_dir, f'bills_backup_{timestamp}{default_backup_extension()}')
             
             target_db_name = TARGET_DB_NAME
-            db = self.client[target_db_name]
-            collections = db.list_collection_names()
-            collection_stats = {}
-            
-            backup_data = {
-                'backup_info': {
+            started_at = datetime.utcnow()
+            with consistent_reads(self._maintenance_db(target_db_name)) as db:
+                collections = self._backup_collection_names(db)
+                backup_type = (
+                    'pre_restore'
+                    if backup_path and 'pre_restore' in backup_path.replace('\\', '/')
+                    else 'snapshot'
+                )
+
+                # 分区摘要、水位与各集合文档在同一快照读会话内读取（支持时），对应同一集群时间点；
+                # 开始时间早于第一次读取：之后写入的文档必然落在下一份增量的范围内
+                partition_digests = PartitionDigests(db).refresh(collections)
+                current_hash = merkle_root(partition_digests)
+                watermarks = self._collection_watermarks(db, collections)
+                archive_state = self._archive_state(db)
+                parent_path, parent_info = None, None
+                if backup_type == 'snapshot' and kind != BACKUP_KIND_FULL and (kind or BACKUP_INCREMENTAL):
+                    parent_path, parent_info = self._incremental_parent(backup_dir, collections, archive_state)
+            
+                backup_info = {
                     'timestamp': datetime.now().strftime('%Y%m%d_%H%M%S'),
                     'backup_time': datetime.now().isoformat(),
                     'database_name': target_db_name,
-                    'version': BACKUP_VERSION,
+                    'version': BACKUP_VERSION if backup_path.endswith(JSON_EXTENSION) else BACKUP_CONTAINER_VERSION,
                     'data_hash': current_hash,
-                    'type': (
-                        'pre_restore'
-                        if backup_path and 'pre_restore' in backup_path.replace('\\', '/')
-                        else 'snapshot'
-                    ),
-                },
-                'databases': {}
-            }
-            
-            total_records = 0
-            db_data = {'collections': {}}
-            for collection_name in collections:
-                collection = db[collection_name]
-                documents = []
-                
-                for doc in collection.find():
-                    doc = dict(doc)
-                    if '_id' in doc:
-                        doc['_id'] = str(doc['_id'])
-                    documents.append(doc)
-                
-                stat = {'count': len(documents)}
-                if collection_name == 'bills':
-                    min_d, max_d = self._bills_date_range(documents)
-                    stat['bill_date_min'] = min_d
-                    stat['bill_date_max'] = max_d
-                collection_stats[collection_name] = stat
-                
-                db_data['collections'][collection_name] = {
-                    'count': len(documents),
-                    'documents': documents
+                    'type': backup_type,
+                    'backup_kind': BACKUP_KIND_INCREMENTAL if parent_info else BACKUP_KIND_FULL,
+                    'started_at': started_at.isoformat(),
+                    'watermarks': watermarks,
+                    'archive_state': archive_state,
+                    'partition_digests': partition_digests,
+                    # 是否在快照读会话内读取；cluster_time 为读取的集群时间点，snapshot_fallback 为未使用的原因
+                    'snapshot_read': isinstance(db, SnapshotDatabase),
+                    'cluster_time': db.cluster_time() if isinstance(db, SnapshotDatabase) else None,
+                    'snapshot_fallback': snapshot_fallback_reason(db),
+                    # 维护租约的防护令牌：同一时刻只有一个进程在备份，令牌随每次获取递增
+                    'lease_token': self._lease_token(),
                 }
-                total_records += len(documents)
-                logger.info(f"备份集合 {target_db_name}.{collection_name}: {len(documents)} 条记录")
-            
-            backup_data['backup_info']['collection_stats'] = collection_stats
-            backup_data['databases'][target_db_name] = db_data
-            
-            # 写入备份文件
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, ensure_ascii=False, indent=2, default=str)
+                # 父快照带分区摘要时，增量只写变化的分区（恢复时整分区替换）；否则按 _id 水位与 updated_at 取变化
+                replaced = None
+                if parent_info and parent_info.get('partition_digests') is not None:
+                    replaced = changed_partitions(parent_info['partition_digests'], partition_digests)
+                    backup_info['replaced_partitions'] = replaced
+                if parent_info:
+                    backup_info['parent'] = os.path.basename(parent_path)
+                    backup_info['base'] = parent_info.get('base') or os.path.basename(parent_path)
+                    backup_info['chain_length'] = parent_info.get('chain_length', 0) + 1
+                else:
+                    backup_info['base'] = os.path.basename(backup_path)
+                    backup_info['chain_length'] = 0
+            
+                # 流式写入：文档逐批编码落盘（.jzb 为分块压缩容器，.json 为流式 JSON）；
+                # 大集合按 _id 区间多游标并发读取、进程池压缩（BACKUP_WORKERS 控制并发度）
+                with ParallelBackupEngine() as engine, \
+                        backup_writer(backup_path, target_db_name, engine=engine) as writer:
+                    for collection_name in collections:
+                        if not parent_info and collection_name == PARTITIONED_COLLECTION and not backup_path.endswith(JSON_EXTENSION):
+                            # 全量快照的账单按年写入内容寻址的分区文件，未变化的年份直接复用，快照只记录引用
+                            manifest = write_year_partitions(
+                                db, partition_digests.get(collection_name, {}), target_db_name, collection_name, engine
+                            )
+                            backup_info['partitions'] = {collection_name: manifest}
+                            count, date_range = manifest_stat(manifest)
+                            writer.add_stat(collection_name, count, date_range)
+                            logger.info(f"备份集合 {target_db_name}.{collection_name}: {count} 条记录（{len(manifest)} 个年度分区）")
+                            continue
+                        if replaced is not None:
+                            if collection_name not in replaced:
+                                continue
+                            query = partitions_filter(replaced[collection_name])
+                        else:
+                            query = self._incremental_query(parent_info, collection_name) if parent_info else None
+                        stat = writer.write_collection(
+                            collection_name, db[collection_name],
+                            track_dates=collection_name == 'bills', query=query
+                        )
+                        logger.info(f"备份集合 {target_db_name}.{collection_name}: {stat['count']} 条记录")
+                    if parent_info and replaced is None:
+                        stat = writer.write_collection(
+                            TOMBSTONE_COLLECTION, db[TOMBSTONE_COLLECTION],
+                            query={'deleted_at': {'$gt': self._changes_since(parent_info)}}
+                        )
+                        logger.info(f"备份删除记录: {stat['count']} 条")
+                    backup_info['archived_years'] = self._archived_years_info(db)
+                    backup_info = writer.finish(backup_info)
+            total_records = writer.total_documents
+            collection_stats = backup_info['collection_stats']
+            # 清理旧快照前确认租约未被其他备份进程接管
+            self._check_lease()
             
             # 获取文件大小
             file_size = os.path.getsize(backup_path)
             file_size_mb = file_size / (1024 * 1024)
             
-            if 'pre_restore' in backup_dir:
-                self.cleanup_old_backups(backup_dir, max_backups=5, filename_pattern='pre_restore_*.json')
-            else:
-                self.cleanup_old_backups(backup_dir, max_backups=5, filename_pattern='bills_backup_*.json')
+            category, prefix = self._backup_dir_kind(backup_dir)
+            try:
+                self.catalog.record(backup_path, category, describe_backup(backup_path))
+            except Exception as e:
+                logger.warning(f"登记备份索引失败: {e}")
+            if category == 'snapshot' and not parent_info:
+                # 新基线之后的增量只需要此后的墓碑
+                self._prune_tombstones(self._maintenance_db(target_db_name, primary=True), started_at)
+            self.cleanup_old_backups(backup_dir, max_backups=5, prefix=prefix)
+            if category == 'snapshot':
                 self._write_manifest('last_backup', path=backup_path, documents=total_records)
 
-            logger.info(f"数据备份完成: {backup_path}, 共{total_records}条记录, 文件大小: {file_size_mb:.2f}MB")
+            logger.info(
+                f"数据备份完成（{backup_info['backup_kind']}）: {backup_path}, "
+                f"共{total_records}条记录, 文件大小: {file_size_mb:.2f}MB"
+            )
             
+            message = f'备份完成: {os.path.basename(backup_path)}'
+            if backup_info.get('snapshot_fallback'):
+                message += f"（未使用快照读：{backup_info['snapshot_fallback']}，读取期间的并发写入可能使快照不一致）"
             return {
                 'success': True,
-                'message': f'备份完成: {os.path.basename(backup_path)}',
+                'message': message,
                 'backup_path': backup_path,
                 'total_databases': 1,
                 'total_documents': total_records,
@@ -965,7 +1678,11 @@ class BillDatabase:
                 'file_size_mb': round(file_size_mb, 2),
                 'data_hash': current_hash,
                 'skipped': False,
-                'collection_stats': collection_stats
+                'collection_stats': collection_stats,
+                'backup_kind': backup_info['backup_kind'],
+                'parent': backup_info.get('parent'),
+                'snapshot_read': backup_info['snapshot_read'],
+                'snapshot_fallback': backup_info.get('snapshot_fallback'),
             }
             
         except Exception as e:
@@ -986,35 +1703,17 @@ class BillDatabase:
             if not os.path.exists(backup_path):
                 return {'success': False, 'message': '备份文件不存在'}
 
-            with open(backup_path, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-
-            info = backup_data.get('backup_info', {})
-            db_data = backup_data.get('databases', {}).get(TARGET_DB_NAME, {})
-            collections = db_data.get('collections', {})
-            total = sum(c.get('count', 0) for c in collections.values())
-            file_size_mb = os.path.getsize(backup_path) / (1024 * 1024)
-
-            return {
-                'success': True,
-                'backup_path': backup_path,
-                'file_name': os.path.basename(backup_path),
-                'backup_time': info.get('backup_time'),
-                'version': info.get('version'),
-                'backup_type': info.get('type', 'snapshot'),
-                'collection_stats': info.get('collection_stats') or {
-                    name: {'count': col.get('count', 0)} for name, col in collections.items()
-                },
-                'total_documents': total,
-                'file_size_mb': round(file_size_mb, 2),
-                'collections': list(collections.keys()),
-            }
+            # 索引中已登记且文件未变化时直接返回；否则只读 backup_info（容器读头部、JSON 读尾部）
+            meta = self.catalog.get(backup_path)
+            if meta:
+                return meta
+            return dict(describe_backup(backup_path), success=True)
         except Exception as e:
             logger.error(f"解析备份文件失败: {e}")
             return {'success': False, 'message': str(e)}
 
     def list_backup_files(self, include_pre_restore=False):
-        """列出可恢复的备份文件（snapshots，可选含 pre_restore）"""
+        """列出可恢复的备份文件（snapshots，可选含 pre_restore），元数据来自备份索引"""
         self._ensure_data_layout()
         files = []
 
@@ -1024,35 +1723,418 @@ class BillDatabase:
         ]:
             if label == 'pre_restore' and not include_pre_restore:
                 continue
-            pattern = os.path.join(
-                pattern_dir,
-                'bills_backup_*.json' if label == 'snapshot' else 'pre_restore_*.json'
-            )
-            for path in glob.glob(pattern):
-                meta = self.parse_backup_file(path)
-                if meta.get('success'):
-                    meta['category'] = label
-                    files.append(meta)
+            prefix = 'bills_backup_' if label == 'snapshot' else 'pre_restore_'
+            try:
+                self.catalog.reconcile(pattern_dir, prefix, label)
+                files.extend(self.catalog.list(pattern_dir))
+            except Exception as e:
+                logger.error(f"读取备份索引失败 {pattern_dir}: {e}")
 
-        files.sort(key=lambda x: os.path.getmtime(x['backup_path']), reverse=True)
+        files.sort(key=lambda x: x.get('mtime') or 0, reverse=True)
         return files
 
     def create_pre_restore_snapshot(self):
         """恢复前自动全量快照"""
         self._ensure_data_layout()
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = os.path.join(get_pre_restore_dir(), f'pre_restore_{timestamp}.json')
+        backup_path = os.path.join(get_pre_restore_dir(), f'pre_restore_{timestamp}{default_backup_extension()}')
         return self.backup_all_data(backup_path=backup_path, force=True)
 
-    def restore_from_backup(self, backup_path, mode=RESTORE_MODE_BILLS_ONLY, include_users=False):
+    def _pre_restore_collections(self, db, mode, include_users, years, preview):
+        """恢复可能改写的集合：现网与快照中的集合，按恢复模式与年份筛选"""
+        if mode == RESTORE_MODE_BILLS_ONLY:
+            return ['bills']
+        names = self._backup_collection_names(db)
+        names += [
+            name for name in (preview.get('collection_stats') or {})
+            if name not in names and name != TOMBSTONE_COLLECTION
+        ]
+        if not include_users and 'users' in names:
+            names.remove('users')
+        if years:
+            names = [name for name in names if is_partitioned(name)]
+        if mode != RESTORE_MODE_MERGE:
+            # 替换式恢复会按快照删除或重建归档集合与元数据（含已冻结的归档集合）
+            names += [
+                name for name in db.list_collection_names()
+                if (is_partitioned(name) or name == ARCHIVE_META_COLLECTION) and name not in names
+            ]
+        return names
+
+    def create_pre_restore_shadow(self, collection_names, reason=None):
+        """
+        恢复前服务端影子副本（$out 复制，数据不经过 Python），顺带删除过期副本
+
+        :return: {'success', 'message', 'shadow_id', 'collections'}
+        """
+        try:
+            db = self._maintenance_db(primary=True)
+            expire_shadows(db)
+            record = create_shadow(db, collection_names, reason=reason)
+            return {
+                'success': True,
+                'message': f"影子副本已创建: {record['_id']}",
+                'shadow_id': record['_id'],
+                'collections': record['collections'],
+            }
+        except Exception as e:
+            logger.error(f"创建影子副本失败: {e}")
+            return {'success': False, 'message': str(e)}
+
+    def list_pre_restore_shadows(self):
+        """
+        未过期的恢复前影子副本（新的在前）
+
+        :return: [{'shadow_id', 'created_at', 'expires_at', 'reason', 'collections'}]
+        """
+        if not self.is_online:
+            return []
+        try:
+            db = self._maintenance_db(primary=True)
+            expire_shadows(db)
+            return [
+                {
+                    'shadow_id': record['_id'],
+                    'created_at': record['created_at'],
+                    'expires_at': record['expires_at'],
+                    'reason': record.get('reason'),
+                    'collections': record['collections'],
+                }
+                for record in list_shadows(db)
+            ]
+        except Exception as e:
+            logger.error(f"读取影子副本失败: {e}")
+            return []
+
+    @_with_maintenance_lease('rollback')
+    def rollback_pre_restore_shadow(self, shadow_id):
+        """
+        回滚到恢复前影子副本（逐集合暂存后原子替换；同时放弃未完成的恢复）
+
+        :return: {'success', 'message', 'collections': {集合名: 条数}}
+        """
+        if not self.is_online:
+            return {'success': False, 'message': '数据库暂不可用（只读模式），无法回滚'}
+        try:
+            db = self._maintenance_db(primary=True)
+            RestoreCheckpoint().clear()
+            drop_staging_collections(db)
+            self._check_lease()
+            restored = rollback_to_shadow(db, shadow_id)
+            digests = PartitionDigests(db)
+            for coll_name in restored:
+                digests.invalidate(coll_name)
+            self._write_manifest('last_rollback', shadow_id=shadow_id, collections=restored)
+            self._count_writes(sum(restored.values()) or 1)
+            return {'success': True, 'message': '回滚完成', 'collections': restored}
+        except Exception as e:
+            logger.error(f"回滚影子副本失败: {e}")
+            return {'success': False, 'message': f'回滚失败: {str(e)}'}
+
+    def export_pre_restore_shadow(self, shadow_id):
+        """
+        将影子副本导出为 data/pre_restore/ 下的快照文件（按需导出，用于离线保存或下载）
+
+        :return: {'success', 'message', 'backup_path'}
+        """
+        if not self.is_online:
+            return {'success': False, 'message': '数据库暂不可用（只读模式），无法导出'}
+        try:
+            self._ensure_data_layout()
+            db = self._maintenance_db(primary=True)
+            backup_path = os.path.join(
+                get_pre_restore_dir(), f'pre_restore_{shadow_id}{default_backup_extension()}'
+            )
+            export_shadow(db, shadow_id, backup_path, {
+                'database_name': TARGET_DB_NAME,
+                'version': BACKUP_VERSION if backup_path.endswith(JSON_EXTENSION) else BACKUP_CONTAINER_VERSION,
+            })
+            self.catalog.record(backup_path, 'pre_restore', describe_backup(backup_path))
+            self.cleanup_old_backups(get_pre_restore_dir(), max_backups=5, prefix='pre_restore_')
+            return {'success': True, 'message': f'已导出: {os.path.basename(backup_path)}', 'backup_path': backup_path}
+        except Exception as e:
+            logger.error(f"导出影子副本失败: {e}")
+            return {'success': False, 'message': f'导出失败: {str(e)}'}
+
+    @_with_maintenance_lease('drop_shadow')
+    def drop_pre_restore_shadow(self, shadow_id):
+        """删除一份影子副本（持有维护租约，不与进行中的回滚冲突）"""
+        drop_shadow(self._maintenance_db(primary=True), shadow_id)
+        return {'success': True, 'message': f'影子副本已删除: {shadow_id}'}
+
+    @staticmethod
+    def _insert_batch(collection, docs, tolerate_duplicates=False):
+        """
+        写入一批文档，返回写入条数
+
+        断点续传时中断前的最后一批可能已部分写入：无序写入并忽略重复键，其余文档照常写入。
+        """
+        try:
+            return len(collection.insert_many(docs, ordered=not tolerate_duplicates).inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if tolerate_duplicates and errors and all(err.get('code') == 11000 for err in errors):
+                return e.details.get('nInserted', 0)
+            raise
+
+    @staticmethod
+    def _upsert_documents(collection, docs, coll_stat):
+        """
+        按 _id 覆盖写入（合并/增量回放）
+
+        先按 _id 批量读出库中已有的文档并比较内容摘要，内容相同的文档不写；
+        其余为库中没有的 InsertOne 与内容变化的 ReplaceOne，合并为一次无序 bulk_write。
+
+        :return: 被替换的现网文档（调用方据此标记旧文档所在的摘要分区）
+        """
+        ids = [doc['_id'] for doc in docs if doc.get('_id') is not None]
+        live = {doc['_id']: doc for doc in (collection.find({'_id': {'$in': ids}}) if ids else [])}
+        operations = []
+        replaced = []
+        unchanged = 0
+        for doc in docs:
+            doc_id = doc.get('_id')
+            if doc_id is None or doc_id not in live:
+                operations.append(InsertOne(doc))
+            elif document_digest(live[doc_id]) == document_digest(doc):
+                unchanged += 1
+            else:
+                operations.append(ReplaceOne({'_id': doc_id}, doc))
+                replaced.append(live[doc_id])
+        coll_stat['unchanged'] = coll_stat.get('unchanged', 0) + unchanged
+        if not operations:
+            return replaced
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+            inserted, modified = result.inserted_count, result.modified_count
+        except BulkWriteError as e:
+            # 读取后被并发写入的 _id 会插入失败（重复键），其余操作照常生效
+            errors = e.details.get('writeErrors', [])
+            if not all(err.get('code') == 11000 for err in errors):
+                raise
+            inserted, modified = e.details.get('nInserted', 0), e.details.get('nModified', 0)
+            logger.warning(f"合并恢复 {collection.name}: {len(errors)} 条文档已存在，跳过")
+        coll_stat['inserted'] += inserted
+        coll_stat['updated'] += modified
+        return replaced
+
+    def _restore_collection(self, reader, collection, coll_name, replace, coll_stat, years=None,
+                            skip=0, on_batch=None):
+        """
+        恢复单个集合：replace 时分批 insert_many 写入暂存集合，否则按 _id 覆盖（合并/增量回放）
+
+        文档逐块读取，每批最多 RESTORE_BATCH_SIZE 条写入，内存只保留当前块。
+        years 不为空时只写入这些年份的账单（按年分区的快照只读取对应分区文件）。
+
+        :param skip: 断点续传时该集合已写入的条数，跳过这些文档
+        :param on_batch: 每批写入后回调 on_batch(已处理条数)，用于进度与检查点
+        :return: 已处理的条数（含跳过的）
         """
-        从 JSON 备份恢复数据
+        done = 0
+        for batch in reader.iter_document_batches(coll_name, years, raw=True):
+            if done + len(batch) <= skip:
+                done += len(batch)
+                continue
+            if done < skip:
+                batch = batch[skip - done:]
+                done = skip
+            for start in range(0, len(batch), RESTORE_BATCH_SIZE):
+                docs = [self._doc_for_mongo(d) for d in batch[start:start + RESTORE_BATCH_SIZE]]
+                if replace:
+                    coll_stat['inserted'] += self._insert_batch(collection, docs, tolerate_duplicates=bool(skip))
+                else:
+                    self._upsert_documents(collection, docs, coll_stat)
+                done += len(docs)
+                if on_batch:
+                    on_batch(done)
+        return done
+
+    def _apply_tombstones(self, reader, collection_for, target_collections, collection_stats, years=None):
+        """
+        回放增量快照中的删除记录（指定年份时只删除这些年份的账单）
+
+        :param collection_for: 集合名 → 实际写入的 Collection（替换式恢复为暂存集合）
+        """
+        for tomb in reader.iter_documents(TOMBSTONE_COLLECTION):
+            coll_name = tomb.get('collection')
+            if coll_name not in target_collections:
+                continue
+            doc_id = tomb.get('doc_id')
+            if isinstance(doc_id, str) and ObjectId.is_valid(doc_id):
+                doc_id = ObjectId(doc_id)
+            coll_stat = collection_stats.setdefault(coll_name, {'inserted': 0, 'updated': 0, 'deleted': 0})
+            query = {'_id': doc_id}
+            if years and is_partitioned(coll_name):
+                query.update(partitions_filter(years))
+            coll_stat['deleted'] += collection_for(coll_name).delete_one(query).deleted_count
+
+    @_with_maintenance_lease('restore')
+    def restore_bills_subset(self, backup_path, date_from=None, date_to=None, categories=None, bill_type=None,
+                             scoped_replace=True, collection_name='bills', pre_restore=None, progress=None):
+        """
+        按条件局部恢复账单：只恢复快照中 bill_date 区间、分类、类型匹配的账单
+
+        快照链流式读取并还原到所选快照的时间点，边读边筛选；匹配的文档按批与现网比较后无序 bulk_write
+        （新增插入、内容变化替换、相同跳过）。scoped_replace 时，现网中匹配同一条件而快照中没有的账单被删除，
+        条件范围外的账单不受影响；否则只合并。读写量与匹配的账单数成正比（给定日期区间时只读取涉及年份的分区），
+        可重复执行。
+
+        :param date_from: 起始日期 YYYYMMDD（含）
+        :param date_to: 结束日期 YYYYMMDD（含）
+        :param categories: 分类列表
+        :param bill_type: 账单类型
+        :param scoped_replace: 是否删除条件范围内快照中没有的现网账单
+        :param collection_name: 目标集合（热表或某个归档集合）
+        :param pre_restore: 恢复前安全网 snapshot | shadow，默认 PRE_RESTORE_MODE（局部修复推荐 shadow）
+        :param progress: 进度回调 progress({'collection', 'done'})
+        :return: {'success', 'message', 'stats': {'inserted', 'updated', 'unchanged', 'deleted', 'matched'}, ...}
+        """
+        if not self.is_online:
+            return {'success': False, 'message': '数据库暂不可用（只读模式），无法恢复'}
+        try:
+            subset = BillSubset(date_from, date_to, categories, bill_type)
+            if subset.is_empty:
+                return {'success': False, 'message': '请至少指定一个筛选条件（日期区间、分类或类型）'}
+            chain = backup_chain(backup_path)
+
+            if (pre_restore or PRE_RESTORE_MODE) == PRE_RESTORE_SHADOW:
+                pre = self.create_pre_restore_shadow([collection_name], reason=os.path.basename(backup_path))
+            else:
+                pre = self.create_pre_restore_snapshot()
+            if not pre.get('success'):
+                return {'success': False, 'message': f"恢复前自动备份失败: {pre.get('message')}", 'pre_restore': pre}
+
+            db = self._maintenance_db(primary=True)
+            collection = db[collection_name]
+            digests = PartitionDigests(db)
+            stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'matched': 0}
+            restored_ids = set()
+
+            def write(batch):
+                self._check_lease()
+                replaced = self._upsert_documents(collection, batch, stats)
+                digests.mark_dirty(collection_name, docs=batch + replaced)
+                restored_ids.update(doc['_id'] for doc in batch if doc.get('_id') is not None)
+                stats['matched'] += len(batch)
+                if progress:
+                    progress({'collection': collection_name, 'done': stats['matched']})
+
+            years = subset.years() if is_partitioned(collection_name) else None
+            with ExitStack() as stack:
+                readers = [stack.enter_context(open_backup(path)) for path in chain]
+                if readers[0].database_name != TARGET_DB_NAME:
+                    return {'success': False, 'message': f'备份中未找到数据库 {TARGET_DB_NAME}'}
+                if len(chain) == 1:
+                    # 单份快照不要求按 _id 排序（兼容早期 JSON）
+                    docs = (self._doc_for_mongo(doc) for doc in readers[0].iter_documents(collection_name, years))
+                else:
+                    docs = chain_documents(readers, collection_name, years, normalize=self._doc_for_mongo)
+                batch = []
+                for doc in docs:
+                    if not subset.matches(doc):
+                        continue
+                    batch.append(doc)
+                    if len(batch) >= RESTORE_BATCH_SIZE:
+                        write(batch)
+                        batch = []
+                if batch:
+                    write(batch)
+
+            if scoped_replace:
+                stale = []
+
+                def delete(docs):
+                    self._check_lease()
+                    stats['deleted'] += collection.delete_many(
+                        {'_id': {'$in': [doc['_id'] for doc in docs]}}
+                    ).deleted_count
+                    digests.mark_dirty(collection_name, docs=docs)
+
+                cursor = collection.find(subset.query(), {'_id': 1, 'bill_date': 1}).batch_size(RESTORE_BATCH_SIZE)
+                for doc in cursor:
+                    if doc['_id'] in restored_ids:
+                        continue
+                    stale.append(doc)
+                    if len(stale) >= RESTORE_BATCH_SIZE:
+                        delete(stale)
+                        stale = []
+                if stale:
+                    delete(stale)
+
+            self._count_writes(stats['inserted'] + stats['updated'] + stats['deleted'] or 1)
+            self._write_manifest(
+                'last_restore',
+                path=backup_path,
+                mode='subset',
+                subset=subset.as_dict(),
+                scoped_replace=scoped_replace,
+                collection=collection_name,
+                pre_restore_path=pre.get('backup_path'),
+                pre_restore_shadow=pre.get('shadow_id'),
+                stats=stats,
+            )
+            logger.info(f"局部恢复 {collection_name} {subset.as_dict()}: {stats}")
+            return {
+                'success': True,
+                'message': '局部恢复完成',
+                'backup_path': backup_path,
+                'subset': subset.as_dict(),
+                'pre_restore_path': pre.get('backup_path'),
+                'pre_restore_shadow': pre.get('shadow_id'),
+                'stats': stats,
+            }
+        except Exception as e:
+            logger.error(f"局部恢复失败: {e}")
+            return {'success': False, 'message': f'局部恢复失败: {str(e)}'}
+
+    def get_restore_checkpoint(self):
+        """未完成的恢复检查点（可调用 restore_from_backup(..., resume=True) 继续）；没有时返回 None"""
+        return RestoreCheckpoint().load()
+
+    @_with_maintenance_lease('discard_restore')
+    def discard_restore_checkpoint(self):
+        """
+        放弃未完成的恢复：删除检查点与暂存集合（替换式恢复在替换前中断时现网数据未被改动）
+
+        持有维护租约，其他进程正在恢复时返回 busy，不会删掉其暂存集合。
+        """
+        RestoreCheckpoint().clear()
+        drop_staging_collections(self._maintenance_db(primary=True))
+        return {'success': True, 'message': '已放弃未完成的恢复'}
+
+    @_with_maintenance_lease('restore')
+    def restore_from_backup(self, backup_path, mode=RESTORE_MODE_BILLS_ONLY, include_users=False, years=None,
+                            progress=None, resume=False, pre_restore=None):
+        """
+        从备份恢复数据（3.x 容器逐块读取，2.1 JSON 增量解析；按批写入，内存与备份大小无关）
+
+        增量快照会先按 mode 恢复链首的全量基线，再依次回放链上各增量（按 _id 覆盖并执行删除；
+        bills_only / full_replace 下增量中变化的分区整体替换），恢复到所选快照的时间点。
+        bills_only / full_replace 把整条链写入暂存集合，建索引、校验条数后用
+        renameCollection(dropTarget=True) 原子替换现网集合，读者不会看到空的或半恢复的集合。
+        每批写入后更新检查点（data/restore_checkpoint.json）；中断后以相同参数 resume=True
+        调用即从断点继续，不再重复做 pre_restore，已完成的集合也不再重写。
 
         :param backup_path: 备份文件路径
         :param mode: bills_only | full_replace | merge
         :param include_users: full_replace 时是否恢复 users 集合（默认 False）
+        :param years: 只恢复这些年份的账单（如 ['2023']），其余年份保持不变；None 表示全部
+        :param progress: 进度回调 progress({'layer', 'layers', 'collection', 'done', 'total'})
+        :param resume: 是否从检查点继续
+        :param pre_restore: 恢复前安全网 snapshot | shadow，默认 PRE_RESTORE_MODE；
+                            shadow 只在服务端复制将被改写的集合，秒级完成，可用 rollback_pre_restore_shadow 回滚
         :return: 恢复结果字典
         """
+        if not self.is_online:
+            return {'success': False, 'message': '数据库暂不可用（只读模式），无法恢复'}
+        years = sorted({str(y) for y in years}) if years else None
+        checkpoint = RestoreCheckpoint()
+        params = {
+            'backup_path': os.path.abspath(backup_path),
+            'mode': mode,
+            'include_users': include_users,
+            'years': years,
+        }
         try:
             if mode not in (RESTORE_MODE_BILLS_ONLY, RESTORE_MODE_FULL_REPLACE, RESTORE_MODE_MERGE):
                 return {'success': False, 'message': f'不支持的恢复模式: {mode}'}
@@ -1060,82 +2142,181 @@ class BillDatabase:
             preview = self.parse_backup_file(backup_path)
             if not preview.get('success'):
                 return preview
+            try:
+                chain = backup_chain(backup_path)
+            except (OSError, ValueError) as e:
+                return {'success': False, 'message': f'快照链不完整，无法恢复: {e}'}
 
-            pre = self.create_pre_restore_snapshot()
+            if resume:
+                state = checkpoint.load()
+                if not state or state.get('params') != params:
+                    return {'success': False, 'message': '没有与该恢复参数一致的中断记录，无法继续'}
+                pre = {
+                    'success': True,
+                    'backup_path': state.get('pre_restore_path'),
+                    'shadow_id': state.get('pre_restore_shadow'),
+                }
+                logger.info(f"从检查点继续恢复: 已完成 {state['completed']}，进行中 {state.get('current')}")
+            elif (pre_restore or PRE_RESTORE_MODE) == PRE_RESTORE_SHADOW:
+                pre = self.create_pre_restore_shadow(
+                    self._pre_restore_collections(self._maintenance_db(primary=True), mode, include_users, years, preview),
+                    reason=os.path.basename(backup_path),
+                )
+            else:
+                pre = self.create_pre_restore_snapshot()
             if not pre.get('success'):
                 return {
                     'success': False,
                     'message': f"恢复前自动备份失败: {pre.get('message')}",
                     'pre_restore': pre
                 }
+            if not resume:
+                checkpoint.start(params, pre.get('backup_path'), pre.get('shadow_id'))
 
-            with open(backup_path, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
+            db = self._maintenance_db(primary=True)
+            if not resume:
+                drop_staging_collections(db)
+            collection_stats = checkpoint.state.get('stats') or {}
+            staged = checkpoint.staged
 
-            db_payload = backup_data.get('databases', {}).get(TARGET_DB_NAME)
-            if not db_payload:
-                return {'success': False, 'message': f'备份中未找到数据库 {TARGET_DB_NAME}'}
+            def collection_for(name):
+                return db[staging_name(name)] if name in staged else db[name]
 
-            collections_data = db_payload.get('collections', {})
-            db = self.client[TARGET_DB_NAME]
-            stats = {'inserted': 0, 'updated': 0, 'deleted': 0, 'collections': {}}
+            archived_info = archive_state = None
+            snapshot_collections = []
+            for index, layer_path in enumerate(chain):
+                with open_backup(layer_path) as reader:
+                    if reader.database_name != TARGET_DB_NAME:
+                        checkpoint.clear()
+                        return {'success': False, 'message': f'备份中未找到数据库 {TARGET_DB_NAME}'}
 
-            if mode == RESTORE_MODE_BILLS_ONLY:
-                target_collections = ['bills']
-            elif mode == RESTORE_MODE_FULL_REPLACE:
-                target_collections = list(collections_data.keys())
-                if not include_users and 'users' in target_collections:
-                    target_collections.remove('users')
-            else:
-                target_collections = list(collections_data.keys())
-                if not include_users and 'users' in target_collections:
-                    target_collections.remove('users')
+                    available = reader.collection_names()
+                    replaced = (reader.info.get('replaced_partitions') or {}) if index > 0 else {}
+                    if mode == RESTORE_MODE_BILLS_ONLY:
+                        # 未冻结的归档集合也是账单，随热表一起恢复
+                        target_collections = ['bills'] + [
+                            name for name in available if name != 'bills' and is_partitioned(name)
+                        ]
+                    else:
+                        target_collections = [name for name in available if name != TOMBSTONE_COLLECTION]
+                        target_collections += [name for name in replaced if name not in target_collections]
+                        if not include_users and 'users' in target_collections:
+                            target_collections.remove('users')
+                        if years:
+                            # 按年恢复只涉及账单（热表与归档集合）
+                            target_collections = [name for name in target_collections if is_partitioned(name)]
+
+                    # 链首全量按 mode 恢复，其后的增量按 _id 覆盖（替换模式下先清空变化的分区）
+                    replace = index == 0 and mode in (RESTORE_MODE_BILLS_ONLY, RESTORE_MODE_FULL_REPLACE)
+                    stats_of_layer = reader.info.get('collection_stats') or {}
+                    for coll_name in target_collections:
+                        if checkpoint.is_completed(index, coll_name):
+                            continue
+                        coll_stat = collection_stats.setdefault(
+                            coll_name, {'inserted': 0, 'updated': 0, 'deleted': 0}
+                        )
+                        coll_years = years if is_partitioned(coll_name) else None
+                        skip = checkpoint.resume_offset(index, coll_name)
+                        if replace and coll_name in available and not skip:
+                            # 按年恢复时，其余年份由服务端从现网复制到暂存集合
+                            keep = {'$nor': [partitions_filter(coll_years)]} if coll_years else None
+                            checkpoint.stage(coll_name, prepare_staging(db, coll_name, keep))
+                        if coll_name in replaced and mode != RESTORE_MODE_MERGE and not skip:
+                            partitions = [
+                                p for p in replaced[coll_name] if not coll_years or year_of(p) in coll_years
+                            ]
+                            if partitions:
+                                coll_stat['deleted'] += collection_for(coll_name).delete_many(
+                                    partitions_filter(partitions)
+                                ).deleted_count
+                        if coll_name in available:
+                            def on_batch(done, index=index, coll_name=coll_name):
+                                checkpoint.update(index, coll_name, done, collection_stats)
+                                self._check_lease()
+                                if progress:
+                                    progress({
+                                        'layer': index + 1,
+                                        'layers': len(chain),
+                                        'collection': coll_name,
+                                        'done': done,
+                                        'total': stats_of_layer.get(coll_name, {}).get('count'),
+                                    })
 
-            for coll_name in target_collections:
-                if coll_name not in collections_data:
+                            target = collection_for(coll_name)
+                            done = self._restore_collection(
+                                reader, target, coll_name, replace, coll_stat, coll_years,
+                                skip=skip, on_batch=on_batch,
+                            )
+                            if replace:
+                                expected = staged[coll_name] + done
+                                actual = target.count_documents({})
+                                if actual != expected:
+                                    raise ValueError(
+                                        f'暂存集合 {target.name} 条数校验失败: 期望 {expected}，实际 {actual}'
+                                    )
+                            logger.info(f"恢复集合 {coll_name}（{os.path.basename(layer_path)}）: {coll_stat}")
+                        checkpoint.complete(index, coll_name, collection_stats)
+                    if index > 0 and TOMBSTONE_COLLECTION in available \
+                            and not checkpoint.is_completed(index, TOMBSTONE_COLLECTION):
+                        self._apply_tombstones(reader, collection_for, target_collections, collection_stats, years)
+                        checkpoint.complete(index, TOMBSTONE_COLLECTION, collection_stats)
+
+                    archived_info = reader.info.get('archived_years')
+                    archive_state = reader.info.get('archive_state')
+                    snapshot_collections = available
+
+            # 整条链写完后，暂存集合逐个原子替换现网集合
+            for coll_name in list(staged):
+                if checkpoint.is_completed('swap', coll_name):
                     continue
+                coll_years = years if is_partitioned(coll_name) else None
+                replaced_count = db[coll_name].count_documents(partitions_filter(coll_years) if coll_years else {})
+                self._check_lease()
+                swap_in(db, coll_name)
+                collection_stats[coll_name]['deleted'] += replaced_count
+                checkpoint.complete('swap', coll_name, collection_stats)
 
-                documents = collections_data[coll_name].get('documents', [])
-                collection = db[coll_name]
-                coll_stat = {'inserted': 0, 'updated': 0, 'deleted': 0}
-
-                if mode in (RESTORE_MODE_BILLS_ONLY, RESTORE_MODE_FULL_REPLACE):
-                    deleted = collection.delete_many({}).deleted_count
-                    coll_stat['deleted'] = deleted
-                    stats['deleted'] += deleted
-
-                    if documents:
-                        mongo_docs = [self._doc_for_mongo(d) for d in documents]
-                        result = collection.insert_many(mongo_docs)
-                        coll_stat['inserted'] = len(result.inserted_ids)
-                        stats['inserted'] += coll_stat['inserted']
-
-                elif mode == RESTORE_MODE_MERGE:
-                    for raw in documents:
-                        doc = self._doc_for_mongo(raw)
-                        doc_id = doc.get('_id')
-                        if doc_id is None:
-                            collection.insert_one(doc)
-                            coll_stat['inserted'] += 1
-                            stats['inserted'] += 1
-                        else:
-                            res = collection.replace_one({'_id': doc_id}, doc, upsert=True)
-                            if res.upserted_id:
-                                coll_stat['inserted'] += 1
-                                stats['inserted'] += 1
-                            elif res.modified_count:
-                                coll_stat['updated'] += 1
-                                stats['updated'] += 1
+            # 替换式恢复：归档集合与元数据对齐快照（快照早于归档时删除现网归档，避免与热表重复计数）
+            archive_dropped = []
+            if mode != RESTORE_MODE_MERGE:
+                self._check_lease()
+                archive_dropped = BillArchive(db).reconcile(
+                    archive_state, archived_info, snapshot_collections, years
+                )
+
+            # 恢复改写了集合内容，分区摘要整集合重建
+            digests = PartitionDigests(db)
+            for coll_name in [*collection_stats, *archive_dropped]:
+                digests.invalidate(coll_name)
+
+            stats = {
+                key: sum(c.get(key, 0) for c in collection_stats.values())
+                for key in ('inserted', 'updated', 'deleted', 'unchanged')
+            }
+            stats['collections'] = collection_stats
+            if len(chain) > 1:
+                stats['chain'] = [os.path.basename(p) for p in chain]
+            if years:
+                stats['years'] = years
 
-                stats['collections'][coll_name] = coll_stat
-                logger.info(f"恢复集合 {coll_name}: {coll_stat}")
+            # 快照只引用冻结年份的导出文件；库中缺失对应归档集合时从导出补齐
+            if archive_dropped:
+                stats['archived_dropped'] = archive_dropped
+            if archived_info:
+                stats['archived_restored'] = BillArchive(db).ensure_collections_restored(archived_info)
+            # 恢复可能改变元数据中的年份（合并模式也会写入元数据），通知其他进程的缓存失效
+            self.archive.mark_changed()
 
+            checkpoint.clear()
+            self._count_writes(stats['inserted'] + stats['updated'] + stats['deleted'] or 1)
             self._write_manifest(
                 'last_restore',
                 path=backup_path,
                 mode=mode,
                 include_users=include_users,
+                years=years,
                 pre_restore_path=pre.get('backup_path'),
+                pre_restore_shadow=pre.get('shadow_id'),
                 stats=stats
             )
 
@@ -1146,20 +2327,131 @@ class BillDatabase:
                 'include_users': include_users,
                 'backup_path': backup_path,
                 'pre_restore_path': pre.get('backup_path'),
+                'pre_restore_shadow': pre.get('shadow_id'),
                 'stats': stats,
                 'preview': preview
             }
 
         except Exception as e:
             logger.error(f"数据恢复失败: {e}")
-            return {'success': False, 'message': f'恢复失败: {str(e)}', 'error': str(e)}
+            return {
+                'success': False,
+                'message': f'恢复失败: {str(e)}',
+                'error': str(e),
+                # 已开始写入时保留检查点，可用 resume=True 继续
+                'resumable': checkpoint.state is not None,
+            }
+
+    def migrate_amounts_to_cents(self, force=False):
+        """
+        将旧账单的 amount（浮点元）迁移为 amount_cents（int64 分）
+
+        逐批读取旧文档，按 money.to_cents 换算后写回：与录入、导入使用同一个十进制解析与
+        ROUND_HALF_UP 规则（服务端 $round 为银行家舍入，半分金额会与新录入不一致）。
+        覆盖热表与全部归档集合；已迁移的文档不受影响，可重复执行。
+        完成后在 schema_migrations 中记录，之后每次连接只读这一条记录，不再扫描账单集合。
+
+        :param force: 忽略完成记录重新检查（外部导入了旧格式账单时使用）
+        :return: {'success': bool, 'message': str, 'migrated': {集合名: 条数}}
+        """
+        migrated = {}
+        migrations = self.db[MIGRATIONS_COLLECTION]
+        try:
+            if not force and migrations.find_one({'_id': AMOUNT_MIGRATION_ID}) is not None:
+                return {'success': True, 'message': '金额已迁移为整数分', 'migrated': migrated}
+            for coll_name in ['bills', *self.archive.collections_for_years()]:
+                collection = self.db[coll_name]
+                if collection.find_one(LEGACY_AMOUNT_FILTER, {'_id': 1}) is None:
+                    continue
+                count = 0
+                while True:
+                    # 已写回的文档不再满足条件，每轮从头取下一批
+                    batch = list(
+                        collection.find(LEGACY_AMOUNT_FILTER, {LEGACY_AMOUNT_FIELD: 1}).limit(MIGRATION_BATCH_SIZE)
+                    )
+                    if not batch:
+                        break
+                    now = datetime.utcnow()
+                    result = collection.bulk_write([
+                        UpdateOne(
+                            {'_id': doc['_id'], **LEGACY_AMOUNT_FILTER},
+                            {
+                                '$set': {AMOUNT_FIELD: Int64(bill_amount_cents(doc)), 'updated_at': now},
+                                '$unset': {LEGACY_AMOUNT_FIELD: ''},
+                            },
+                        )
+                        for doc in batch
+                    ], ordered=False)
+                    count += result.modified_count
+                migrated[coll_name] = count
+                self.digests.invalidate(coll_name)
+                logger.info(f"金额已迁移为整数分: {coll_name} {count} 条")
+            migrations.update_one(
+                {'_id': AMOUNT_MIGRATION_ID},
+                {'$set': {'completed_at': datetime.utcnow(), 'migrated': migrated}},
+                upsert=True,
+            )
+            total = sum(migrated.values())
+            return {'success': True, 'message': f'已迁移 {total} 条账单', 'migrated': migrated}
+        except Exception as e:
+            logger.error(f"金额迁移失败: {e}")
+            return {'success': False, 'message': f'金额迁移失败: {str(e)}', 'migrated': migrated}
+
+    @_with_maintenance_lease('archive')
+    def archive_bills(self, hot_years=None):
+        """
+        归档所有超出热数据期限的年份（持有维护租约，不与备份/恢复同时进行）
+
+        :return: {'success', 'years', 'results'}，失败时含 message
+        """
+        self._require_online('归档')
+        try:
+            return self.archive.run(hot_years=hot_years)
+        except Exception as e:
+            logger.error(f"归档失败: {e}")
+            return {'success': False, 'message': f'归档失败: {str(e)}'}
+
+    @_with_maintenance_lease('unarchive')
+    def unarchive_year(self, year):
+        """将归档年份移回热表（持有维护租约）"""
+        self._require_online('移回归档年份')
+        try:
+            return self.archive.unarchive_year(year)
+        except Exception as e:
+            logger.error(f"移回归档年份失败: {e}")
+            return {'success': False, 'message': f'移回归档年份失败: {str(e)}'}
+
+    @_offline_fallback
+    def get_collection_counts(self, db_name=TARGET_DB_NAME):
+        """
+        各集合文档数（备份页库状态展示用，走维护连接池并受时间预算约束）
+
+        :return: {集合名: 文档数}
+        """
+        db = self._maintenance_db(db_name)
+        options = self._agg_options('collection_counts')
+        return {name: db[name].count_documents({}, **options) for name in db.list_collection_names()}
+
+    def get_index_advisor(self):
+        """
+        获取索引建议器（先落盘内存中的查询形状统计）
+
+        :return: IndexAdvisor
+        """
+        self.query_recorder.flush()
+        return IndexAdvisor(self.db)
 
     def close(self):
         """
         关闭数据库连接
         """
+        self._closed = True
         try:
+            if self.is_online:
+                self.query_recorder.flush()
             self.client.close()
+            self.reporting_client.close()
+            self.maintenance_client.close()
             logger.info("数据库连接已关闭")
         except Exception as e:
             logger.error(f"关闭数据库连接时发生错误: {e}")
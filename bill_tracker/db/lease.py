@@ -0,0 +1,160 @@
+"""
+维护租约：多个备份进程（扩容的 backup 服务、多台主机上的 scheduled_backup.py）与恢复共用同一把库内租约，
+同一时刻只有一个进程在备份或恢复。
+
+租约是 maintenance_leases 集合中的一条记录：持有者、到期时间与防护令牌（fencing token）。
+- 获取：记录不存在、已释放或已过期时原子地改为自己持有，令牌加一；否则失败（不等待）。
+- 心跳：持有期间后台线程每 TTL/3 续期；持有者崩溃后租约在 TTL 内自然过期，其他进程可接管。
+- 防护：续期与 check() 都要求记录中的令牌仍是自己的。进程停顿（GC、挂起）超过 TTL 后
+  租约可能已被接管，删除旧快照、替换现网集合等不可逆步骤前调用 check()，令牌不符即中止。
+记录不设 TTL 索引（删除会让令牌归零），到期时间由各进程按 UTC 时钟比较，主机间需要时钟同步。
+租约记录固定读写主节点（majority 读写关注）：从节点的延迟会让刚获取的租约「消失」，
+或让已被接管的旧持有者仍看到自己的令牌，防护失效。
+"""
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from loguru import logger
+from pymongo import ReadPreference, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+
+LEASE_COLLECTION = 'maintenance_leases'
+# 备份与恢复共用的租约名
+MAINTENANCE_LEASE = 'maintenance'
+MAINTENANCE_LEASE_TTL_SECONDS = float(os.getenv('MAINTENANCE_LEASE_TTL_SECONDS', '60'))
+
+
+class LeaseBusyError(RuntimeError):
+    """租约被其他进程持有"""
+
+
+class LeaseLostError(RuntimeError):
+    """持有期间租约过期并被其他进程接管（令牌已变化）"""
+
+
+def _describe(record):
+    holder = record.get('holder') or {}
+    expires_at = record.get('expires_at')
+    return (
+        f"{holder.get('purpose', '-')}（{holder.get('host', '-')} pid {holder.get('pid', '-')}，"
+        f"到期 {expires_at.strftime('%H:%M:%S') if expires_at else '-'} UTC）"
+    )
+
+
+class MaintenanceLease:
+    """单个租约的持有与心跳"""
+
+    def __init__(self, db, purpose, name=MAINTENANCE_LEASE, ttl_seconds=None):
+        """
+        :param db: pymongo Database
+        :param purpose: 用途说明（backup / restore 等），记录在租约中便于排查
+        :param ttl_seconds: 租约时长，默认 MAINTENANCE_LEASE_TTL_SECONDS
+        """
+        self.collection = db[LEASE_COLLECTION].with_options(
+            read_preference=ReadPreference.PRIMARY,
+            read_concern=ReadConcern('majority'),
+            write_concern=WriteConcern('majority'),
+        )
+        self.name = name
+        self.purpose = purpose
+        self.ttl = MAINTENANCE_LEASE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.token = None
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _holder_filter(self):
+        return {'_id': self.name, 'owner': self.owner, 'token': self.token}
+
+    def acquire(self):
+        """
+        获取租约并启动心跳
+
+        :return: 防护令牌
+        :raises LeaseBusyError: 租约被其他进程持有且未过期
+        """
+        now = datetime.utcnow()
+        try:
+            record = self.collection.find_one_and_update(
+                {'_id': self.name, '$or': [{'owner': None}, {'expires_at': {'$lte': now}}]},
+                {
+                    '$set': {
+                        'owner': self.owner,
+                        'holder': {'purpose': self.purpose, 'host': socket.gethostname(), 'pid': os.getpid()},
+                        'acquired_at': now,
+                        'heartbeat_at': now,
+                        'expires_at': now + timedelta(seconds=self.ttl),
+                    },
+                    '$inc': {'token': 1},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            current = self.collection.find_one({'_id': self.name}) or {}
+            raise LeaseBusyError(f'另一个备份/恢复任务正在进行：{_describe(current)}')
+        self.token = record['token']
+        self.lost = False
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat, name=f'lease-{self.name}', daemon=True)
+        self._heartbeat.start()
+        logger.info(f"已获取维护租约 {self.name}（{self.purpose}，令牌 {self.token}）")
+        return self.token
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self.renew():
+                return
+
+    def renew(self):
+        """续期；令牌已变化时标记为丢失并返回 False"""
+        now = datetime.utcnow()
+        try:
+            result = self.collection.update_one(
+                self._holder_filter(),
+                {'$set': {'heartbeat_at': now, 'expires_at': now + timedelta(seconds=self.ttl)}},
+            )
+        except Exception as e:
+            # 暂时连不上时继续尝试，真正过期与否由 check() 判断
+            logger.warning(f"维护租约续期失败: {e}")
+            return True
+        if result.matched_count == 0:
+            self.lost = True
+            logger.error(f"维护租约 {self.name} 已被其他进程接管（令牌 {self.token}）")
+            return False
+        return True
+
+    def check(self):
+        """
+        不可逆步骤前确认仍持有租约
+
+        :raises LeaseLostError: 租约已被接管
+        """
+        if self.lost or not self.collection.find_one(self._holder_filter(), {'_id': 1}):
+            self.lost = True
+            raise LeaseLostError(f'维护租约已失效（令牌 {self.token}），已中止以免与其他任务冲突')
+
+    def release(self):
+        """停止心跳并释放（只释放自己持有的租约；令牌保留，下次获取继续递增）"""
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join(timeout=5)
+            self._heartbeat = None
+        if self.token is None:
+            return
+        try:
+            self.collection.update_one(
+                self._holder_filter(),
+                {'$set': {'owner': None, 'expires_at': datetime.utcnow()}},
+            )
+        except Exception as e:
+            logger.warning(f"释放维护租约失败（将在到期后自动失效）: {e}")
+        logger.info(f"已释放维护租约 {self.name}（令牌 {self.token}）")
+        self.token = None
+
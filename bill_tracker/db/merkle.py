@@ -0,0 +1,356 @@
+"""
+分区摘要（Merkle 树）变化检测
+
+账单集合按 bill_date 的年月分区，其余集合整体为一个分区。每个分区的叶子摘要是
+分区内文档（按 _id 排序、键排序后的紧凑 JSON）的 sha256；集合根与整库根由叶子逐层汇总。
+写入时只把所在分区标记为脏，日常检测只重算脏分区，开销与变化的分区数成正比；没有登记记录时整集合重建。
+核对（显式请求，或距上次核对超过 DIGEST_VERIFY_INTERVAL_SECONDS）时再用一次服务端分组聚合
+取各分区的廉价指纹（条数、最大 _id、最大 updated_at、金额合计），与登记时的指纹不同的分区
+（绕过应用的新增、删除、删一增一、修改）同样重算。核对是整集合扫描，已冻结导出的归档年份不参与。
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from loguru import logger
+
+from bill_tracker.db.archive import ARCHIVE_COLLECTION_PREFIX
+from bill_tracker.money import AMOUNT_FIELD
+
+DIGEST_COLLECTION = 'backup_digests'
+PARTITION_FIELD = 'bill_date'
+# 不分区集合的唯一分区 / 账单缺少 bill_date 时的分区
+WHOLE_COLLECTION = '*'
+NO_DATE_PARTITION = '-'
+# 指纹核对的最长间隔（秒），0 表示只在显式请求时核对
+DIGEST_VERIFY_INTERVAL_SECONDS = int(os.getenv('DIGEST_VERIFY_INTERVAL_SECONDS', '86400'))
+
+
+def is_partitioned(collection_name):
+    """按年月分区的集合（热表与归档集合）"""
+    return collection_name == 'bills' or collection_name.startswith(ARCHIVE_COLLECTION_PREFIX)
+
+
+def partition_of(collection_name, doc):
+    """文档所在分区：账单为 bill_date 前 6 位（YYYYMM）"""
+    if not is_partitioned(collection_name):
+        return WHOLE_COLLECTION
+    bill_date = doc.get(PARTITION_FIELD)
+    return str(bill_date)[:6] if bill_date else NO_DATE_PARTITION
+
+
+def partition_filter(partition):
+    """
+    分区对应的查询条件
+
+    bill_date 为 YYYYMMDD 字符串，前缀区间 [p, p 的字典序后继) 恰好覆盖以 p 开头的日期，可走 bill_date 索引。
+    """
+    if partition == WHOLE_COLLECTION:
+        return {}
+    if partition == NO_DATE_PARTITION:
+        return {PARTITION_FIELD: {'$in': [None, '']}}
+    upper = partition[:-1] + chr(ord(partition[-1]) + 1)
+    return {PARTITION_FIELD: {'$gte': partition, '$lt': upper}}
+
+
+def partitions_filter(partitions):
+    """多个分区的并集条件"""
+    partitions = list(partitions)
+    if WHOLE_COLLECTION in partitions:
+        return {}
+    if len(partitions) == 1:
+        return partition_filter(partitions[0])
+    return {'$or': [partition_filter(p) for p in partitions]}
+
+
+def merkle_root(partition_digests):
+    """
+    整库根摘要
+
+    :param partition_digests: {集合名: {分区: 叶子摘要}}
+    :return: sha256 十六进制串
+    """
+    root = hashlib.sha256()
+    for name in sorted(partition_digests):
+        root.update(f'{name}:{leaves_root(partition_digests[name])}\n'.encode('utf-8'))
+    return root.hexdigest()
+
+
+def leaves_root(leaves):
+    """一组叶子的汇总摘要（集合根；取某年的叶子即为该年的年度摘要）"""
+    return hashlib.sha256(''.join(f'{p}:{leaves[p]}\n' for p in sorted(leaves)).encode('utf-8')).hexdigest()
+
+
+def changed_partitions(old, new):
+    """
+    两组分区摘要的差异（新增、删除或内容变化的分区）
+
+    :return: {集合名: [分区, ...]}；集合整体新增或删除时列出其全部分区
+    """
+    changed = {}
+    for name in set(old or {}) | set(new or {}):
+        old_leaves = (old or {}).get(name, {})
+        new_leaves = (new or {}).get(name, {})
+        partitions = sorted(
+            p for p in set(old_leaves) | set(new_leaves) if old_leaves.get(p) != new_leaves.get(p)
+        )
+        if partitions:
+            changed[name] = partitions
+    return changed
+
+
+def canonical_document(doc):
+    """摘要用的文档编码：键排序，与字段写入顺序无关（恢复后的文档摘要不变）"""
+    if isinstance(doc, RawBSONDocument):
+        doc = bson.decode(doc.raw)
+    return json.dumps(doc, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def document_digest(doc):
+    """单条文档的内容摘要（合并恢复时判断文档是否变化）"""
+    return hashlib.sha256(canonical_document(doc).encode('utf-8')).hexdigest()
+
+
+class LeafHasher:
+    """单个分区的叶子摘要：按 _id 顺序逐条累加"""
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.count = 0
+
+    def add(self, doc):
+        self.digest.update(canonical_document(doc).encode('utf-8'))
+        self.digest.update(b'\n')
+        self.count += 1
+
+
+class PartitionDigests:
+    """
+    分区摘要存储（backup_digests 集合）
+
+    每个分区一条记录：叶子摘要、条数、指纹，以及 dirty_seq / computed_seq 两个序号。
+    写入只递增 dirty_seq；重算前先读取序号，写回时记为 computed_seq，
+    重算期间发生的写入会让两者不相等，分区保持为脏，不会丢失变化。
+    每个集合另有一条核对记录（_id 为 verify:<集合名>）保存上次指纹核对的时间。
+    """
+
+    def __init__(self, db, batch_size=1000):
+        """
+        :param db: pymongo Database（摘要记录与数据集合同库）
+        :param batch_size: 重算时游标批大小
+        """
+        self.db = db
+        self.store = db[DIGEST_COLLECTION]
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _key(collection_name, partition):
+        return f'{collection_name}:{partition}'
+
+    def mark_dirty(self, collection_name, docs=None, partitions=None):
+        """
+        写入后标记分区为脏
+
+        :param docs: 写入（或删除）的文档，用于确定分区
+        :param partitions: 直接指定的分区
+        """
+        parts = set(partitions or [])
+        parts.update(partition_of(collection_name, doc) for doc in (docs or []))
+        for partition in parts:
+            self.store.update_one(
+                {'_id': self._key(collection_name, partition)},
+                {
+                    '$inc': {'dirty_seq': 1},
+                    '$setOnInsert': {
+                        'collection': collection_name,
+                        'partition': partition,
+                        'computed_seq': 0,
+                        'count': 0,
+                    },
+                },
+                upsert=True,
+            )
+
+    def invalidate(self, collection_name):
+        """整集合作废（恢复、批量迁移等），下次 refresh 时重建"""
+        self.store.delete_many({'collection': collection_name})
+
+    def _fingerprints(self, collection_name, partition=None):
+        """
+        各分区的廉价指纹：条数、最大 _id、最大 updated_at 与金额合计（服务端分组聚合，不传输文档）
+
+        新增、删除、删一增一、带 updated_at 或改变金额的修改都会改变指纹；
+        绕过应用、既不改 updated_at 也不改金额的原地修改仍需 mark_dirty。
+
+        :param partition: 只取该分区（按 bill_date 索引过滤），None 表示整集合
+        :return: {分区: 指纹}
+        """
+        if is_partitioned(collection_name):
+            # 与 partition_of 一致：bill_date 前 6 位，缺失或为空时为无日期分区
+            key = {'$let': {
+                'vars': {'date': {'$ifNull': [f'${PARTITION_FIELD}', '']}},
+                'in': {'$cond': [
+                    {'$eq': ['$$date', '']},
+                    NO_DATE_PARTITION,
+                    {'$substr': [{'$toString': '$$date'}, 0, 6]},
+                ]},
+            }}
+        else:
+            key = WHOLE_COLLECTION
+        pipeline = [{'$match': partition_filter(partition)}] if partition is not None else []
+        pipeline.append({'$group': {
+            '_id': key,
+            'count': {'$sum': 1},
+            'max_id': {'$max': '$_id'},
+            'max_updated_at': {'$max': '$updated_at'},
+            'amount_sum': {'$sum': f'${AMOUNT_FIELD}'},
+        }})
+        return {item.pop('_id'): item for item in self.db[collection_name].aggregate(pipeline)}
+
+    def _hash_partition(self, collection_name, partition):
+        leaf = LeafHasher()
+        cursor = (
+            self.db[collection_name].find(partition_filter(partition))
+            .sort('_id', 1).batch_size(self.batch_size)
+        )
+        for doc in cursor:
+            leaf.add(doc)
+        return leaf
+
+    def _save(self, collection_name, partition, leaf, seq, fingerprint=None):
+        """
+        写回重算结果，返回该分区的登记记录（分区已空时为 None）
+
+        :param fingerprint: 重算前取得的分区指纹；重算期间有写入时与之后的指纹不同，下次再重算
+        """
+        key = self._key(collection_name, partition)
+        if leaf.count == 0:
+            # 分区已空：仅在重算期间没有新写入时删除记录
+            self.store.delete_one({'_id': key, 'dirty_seq': seq})
+            return None
+        entry = {
+            'collection': collection_name,
+            'partition': partition,
+            'digest': leaf.digest.hexdigest(),
+            'count': leaf.count,
+            'computed_seq': seq,
+            'fingerprint': fingerprint,
+        }
+        self.store.update_one(
+            {'_id': key},
+            {'$set': entry, '$setOnInsert': {'dirty_seq': seq}},
+            upsert=True,
+        )
+        return entry
+
+    def _rebuild(self, collection_name, entries, fingerprints):
+        """单次 _id 顺序扫描重建整集合的全部分区，返回重建后的登记记录"""
+        leaves = {}
+        cursor = self.db[collection_name].find().sort('_id', 1).batch_size(self.batch_size)
+        for doc in cursor:
+            partition = partition_of(collection_name, doc)
+            leaves.setdefault(partition, LeafHasher()).add(doc)
+        rebuilt = {}
+        for partition in set(entries) | set(leaves):
+            seq = entries.get(partition, {}).get('dirty_seq', 0)
+            entry = self._save(
+                collection_name, partition, leaves.get(partition, LeafHasher()), seq, fingerprints.get(partition)
+            )
+            if entry:
+                rebuilt[partition] = entry
+        if leaves:
+            logger.info(f"分区摘要已重建: {collection_name}（{len(leaves)} 个分区）")
+        if leaves or entries:
+            self._mark_verified(collection_name)
+        return rebuilt
+
+    @staticmethod
+    def _verify_key(collection_name):
+        return f'verify:{collection_name}'
+
+    def _mark_verified(self, collection_name):
+        self.store.update_one(
+            {'_id': self._verify_key(collection_name)},
+            {'$set': {'verify_of': collection_name, 'verified_at': datetime.utcnow()}},
+            upsert=True,
+        )
+
+    def _verify_due(self, collection_name):
+        """距上次核对是否已超过 DIGEST_VERIFY_INTERVAL_SECONDS"""
+        if DIGEST_VERIFY_INTERVAL_SECONDS <= 0:
+            return False
+        record = self.store.find_one({'_id': self._verify_key(collection_name)})
+        verified_at = (record or {}).get('verified_at')
+        return verified_at is None or (
+            datetime.utcnow() - verified_at > timedelta(seconds=DIGEST_VERIFY_INTERVAL_SECONDS)
+        )
+
+    def refresh(self, collection_names, verify=None):
+        """
+        重算脏分区，必要时整集合重建
+
+        结果由本次读取与重算得出，不再回读摘要集合：db 为快照读句柄时，
+        摘要与备份内容对应同一时间点（写回的记录不在快照内可见）。
+
+        :param collection_names: 参与检测的集合
+        :param verify: True 时先做指纹核对，找出绕过应用写入的分区；False 时只看脏标记；
+            None（默认）时距上次核对超过 DIGEST_VERIFY_INTERVAL_SECONDS 的集合才核对
+        :return: {集合名: {分区: 叶子摘要}}
+        """
+        result = {}
+        for name in collection_names:
+            entries = {e['partition']: e for e in self.store.find({'collection': name})}
+            if not entries:
+                # 首次检测：一次扫描重建比逐分区查询更省
+                entries = self._rebuild(name, entries, self._fingerprints(name))
+            else:
+                changed = {
+                    partition for partition, entry in entries.items()
+                    if entry.get('dirty_seq') != entry.get('computed_seq')
+                }
+                if verify or (verify is None and self._verify_due(name)):
+                    fingerprints = self._fingerprints(name)
+                    changed.update(
+                        partition for partition in set(entries) | set(fingerprints)
+                        if partition not in entries
+                        or entries[partition].get('fingerprint') != fingerprints.get(partition)
+                    )
+                    self._mark_verified(name)
+                for partition in sorted(changed):
+                    entry = entries.get(partition, {})
+                    fingerprint = self._fingerprints(name, partition).get(partition)
+                    saved = self._save(
+                        name, partition, self._hash_partition(name, partition),
+                        entry.get('dirty_seq', 0), fingerprint,
+                    )
+                    if saved:
+                        entries[partition] = dict(entry, **saved)
+                    else:
+                        entries.pop(partition, None)
+            leaves = {p: e['digest'] for p, e in entries.items() if e.get('digest')}
+            if leaves:
+                result[name] = leaves
+        stale = [n for n in self.store.distinct('collection') if n not in collection_names]
+        stale_verified = [n for n in self.store.distinct('verify_of') if n not in collection_names]
+        if stale or stale_verified:
+            self.store.delete_many({'$or': [
+                {'collection': {'$in': stale}}, {'verify_of': {'$in': stale_verified}},
+            ]})
+        return result
+
+    def counts(self, collection_names):
+        """当前登记的各分区条数（不重算）"""
+        result = {name: {} for name in collection_names}
+        for entry in self.store.find({'collection': {'$in': list(collection_names)}, 'digest': {'$exists': True}}):
+            result[entry['collection']][entry['partition']] = entry.get('count', 0)
+        return result
+
+    def digests(self, collection_names):
+        """当前登记的叶子摘要（不重算）"""
+        result = {name: {} for name in collection_names}
+        for entry in self.store.find({'collection': {'$in': list(collection_names)}, 'digest': {'$exists': True}}):
+            result[entry['collection']][entry['partition']] = entry['digest']
+        return {name: leaves for name, leaves in result.items() if leaves}
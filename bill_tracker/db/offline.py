@@ -0,0 +1,237 @@
+"""只读降级引擎：MongoDB 不可用时，从最新快照载入内存列式数据继续提供查询与报表。"""
+import math
+import os
+
+import pandas as pd
+from loguru import logger
+
+from bill_tracker.db.backup_io import TOMBSTONE_COLLECTION, backup_chain, glob_backups, open_backup
+from bill_tracker.db.merkle import WHOLE_COLLECTION, partition_of
+from bill_tracker.money import AMOUNT_FIELD, LEGACY_AMOUNT_FIELD, to_cents
+from bill_tracker.paths import get_snapshots_dir, get_yearly_dir
+from bill_tracker.utils import period_date_range
+
+BILL_COLUMNS = ['bill_date', 'type', 'category', AMOUNT_FIELD, 'remark']
+
+
+class DatabaseUnavailableError(RuntimeError):
+    """数据库不可用（只读降级期间的写操作，或没有可用快照时的查询）"""
+
+
+def _amount_cents_series(df):
+    """金额列（int64 分）；旧快照只有 amount（元）时逐条精确换算"""
+    if AMOUNT_FIELD in df.columns:
+        cents = pd.to_numeric(df[AMOUNT_FIELD], errors='coerce')
+    else:
+        cents = pd.Series(float('nan'), index=df.index)
+    if LEGACY_AMOUNT_FIELD in df.columns:
+        missing = cents.isna() & df[LEGACY_AMOUNT_FIELD].notna()
+        if missing.any():
+            cents[missing] = df.loc[missing, LEGACY_AMOUNT_FIELD].map(to_cents)
+    return cents.fillna(0).astype('int64')
+
+
+class SnapshotReadEngine:
+    """
+    基于快照的只读查询引擎
+
+    账单载入为 pandas DataFrame（type/category 用 category 类型，日期预先转为整数，
+    金额为 int64 分），各方法与 BillDatabase 的同名读接口返回相同结构。
+    """
+
+    def __init__(self, bills, users=None, snapshot_path=None, backup_time=None, collection_counts=None):
+        df = pd.DataFrame(bills)
+        for column in BILL_COLUMNS:
+            if column not in df.columns:
+                df[column] = pd.Series(dtype='object')
+        df['bill_date'] = df['bill_date'].astype(str)
+        df[AMOUNT_FIELD] = _amount_cents_series(df)
+        if LEGACY_AMOUNT_FIELD in df.columns:
+            df = df.drop(columns=[LEGACY_AMOUNT_FIELD])
+        df['remark'] = df['remark'].fillna('').astype(str)
+        df['type'] = df['type'].astype('category')
+        df['category'] = df['category'].astype('category')
+        self._date_int = pd.to_numeric(df['bill_date'], errors='coerce').fillna(0).astype('int64')
+        self.bills = df
+        self.users = {u.get('username'): u for u in (users or []) if u.get('username')}
+        self.snapshot_path = snapshot_path
+        self.backup_time = backup_time
+        self.collection_counts = collection_counts or {'bills': len(df), 'users': len(self.users)}
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """从一个快照文件（增量快照先回放整条链，含其引用的年度归档导出）构建引擎"""
+        chain = backup_chain(path)
+        docs = {'bills': {}, 'users': {}}
+        counts = {}
+        info = {}
+        for index, layer_path in enumerate(chain):
+            with open_backup(layer_path) as reader:
+                info = reader.info
+                names = reader.collection_names()
+                # 增量中变化的分区整体替换
+                for name, partitions in ((info.get('replaced_partitions') or {}) if index else {}).items():
+                    by_id = docs.get(name, {})
+                    for doc_id in [k for k, d in by_id.items() if partition_of(name, d) in partitions
+                                   or WHOLE_COLLECTION in partitions]:
+                        del by_id[doc_id]
+                for name, by_id in docs.items():
+                    for doc in (reader.iter_documents(name) if name in names else []):
+                        by_id[str(doc.get('_id'))] = doc
+                if index == 0:
+                    counts = {n: stat.get('count', 0) for n, stat in (info.get('collection_stats') or {}).items()}
+                elif TOMBSTONE_COLLECTION in names:
+                    for tomb in reader.iter_documents(TOMBSTONE_COLLECTION):
+                        docs.get(tomb.get('collection'), {}).pop(str(tomb.get('doc_id')), None)
+        bills = list(docs['bills'].values())
+        users = list(docs['users'].values())
+        counts.update({name: len(by_id) for name, by_id in docs.items()})
+
+        for info_year in (info.get('archived_years') or {}).values():
+            export_file = info_year.get('export_file')
+            export_path = os.path.join(get_yearly_dir(), export_file) if export_file else None
+            if not export_path or not os.path.exists(export_path):
+                logger.warning(f"只读模式缺少年度归档导出: {export_file}")
+                continue
+            with open_backup(export_path) as archived:
+                for name in archived.collection_names():
+                    before = len(bills)
+                    bills.extend(archived.iter_documents(name))
+                    counts[name] = len(bills) - before
+
+        logger.info(f"只读模式已载入快照: {os.path.basename(path)}，账单 {len(bills)} 条")
+        return cls(bills, users, snapshot_path=path, backup_time=info.get('backup_time'),
+                   collection_counts=counts)
+
+    @classmethod
+    def from_latest_snapshot(cls, snapshots_dir=None):
+        """载入最新可解析的快照；没有可用快照时抛出 DatabaseUnavailableError"""
+        snapshots_dir = snapshots_dir or get_snapshots_dir()
+        paths = sorted(
+            glob_backups(snapshots_dir, 'bills_backup_'),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for path in paths:
+            try:
+                return cls.from_snapshot(path)
+            except Exception as e:
+                logger.warning(f"载入快照失败 {path}: {e}")
+        raise DatabaseUnavailableError('数据库不可用，且没有可用的快照')
+
+    def _mask(self, start_date=None, end_date=None, bill_type=None, bill_categories=None,
+              min_amount=None, max_amount=None, remark=None):
+        df = self.bills
+        mask = pd.Series(True, index=df.index)
+        if start_date and end_date:
+            mask &= (self._date_int >= int(start_date)) & (self._date_int <= int(end_date))
+        if bill_type:
+            mask &= df['type'] == bill_type
+        if bill_categories:
+            valid = [c for c in bill_categories if isinstance(c, str) and c.strip()]
+            if valid:
+                mask &= df['category'].isin(valid)
+        if min_amount is not None:
+            mask &= df[AMOUNT_FIELD] >= to_cents(min_amount)
+        if max_amount is not None:
+            mask &= df[AMOUNT_FIELD] <= to_cents(max_amount)
+        if remark:
+            mask &= df['remark'].str.contains(str(remark), case=False, regex=False)
+        return mask
+
+    def _year_mask(self, year, **filters):
+        return self._mask(start_date=int(f'{year}0101'), end_date=int(f'{year}1231'), **filters)
+
+    @staticmethod
+    def _as_output(df):
+        out = df.copy()
+        out['type'] = out['type'].astype(object)
+        out['category'] = out['category'].astype(object)
+        return out
+
+    def query_bills(self, start_date=None, end_date=None, bill_type=None, bill_category=None,
+                    bill_categories=None, min_amount=None, max_amount=None, remark=None):
+        categories = bill_categories or ([bill_category] if bill_category else None)
+        mask = self._mask(start_date, end_date, bill_type, categories, min_amount, max_amount, remark)
+        df = self.bills[mask]
+        if df.empty:
+            return pd.DataFrame(columns=BILL_COLUMNS)
+        return self._as_output(df.sort_values('bill_date', ascending=False))
+
+    def get_bills_by_year(self, year, page=1, page_size=10, bill_type=None, bill_categories=None,
+                          remark=None):
+        mask = self._year_mask(year, bill_type=bill_type, bill_categories=bill_categories, remark=remark)
+        df = self.bills[mask].sort_values('bill_date', ascending=False)
+        total_count = len(df)
+        skip = (page - 1) * page_size
+        return {
+            'data': self._as_output(df.iloc[skip:skip + page_size]),
+            'total_count': total_count,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': math.ceil(total_count / page_size),
+        }
+
+    def get_annual_summary(self, year, bill_type=None, bill_categories=None, remark=None):
+        mask = self._year_mask(year, bill_type=bill_type, bill_categories=bill_categories, remark=remark)
+        amounts = self.bills.loc[mask, AMOUNT_FIELD]
+        income = int(amounts[amounts > 0].sum())
+        expense = int(amounts[amounts < 0].abs().sum())
+        return {'income_cents': income, 'expense_cents': expense, 'net_cents': income - expense}
+
+    def get_period_summary(self, period_type='week', start_date=None):
+        start_datetime, end_datetime = period_date_range(period_type, start_date)
+        mask = self._mask(start_datetime.strftime('%Y%m%d'), end_datetime.strftime('%Y%m%d'))
+        by_type = self.bills.loc[mask].groupby('type', observed=True)[AMOUNT_FIELD].sum()
+        income_total = int(by_type[by_type > 0].sum())
+        expense_total = int(by_type[by_type <= 0].abs().sum())
+        return {
+            'income_cents': income_total,
+            'expense_cents': expense_total,
+            'net_cents': income_total - expense_total,
+            'start_date': start_datetime.strftime('%Y%m%d'),
+            'end_date': end_datetime.strftime('%Y%m%d'),
+        }
+
+    def get_category_summary(self, year, bill_type='all'):
+        df = self.bills[self._year_mask(year)]
+        if bill_type == 'income':
+            df = df[df[AMOUNT_FIELD] > 0]
+        elif bill_type == 'expense':
+            df = df[df[AMOUNT_FIELD] < 0]
+        if df.empty:
+            return pd.DataFrame(columns=['category', AMOUNT_FIELD])
+        result = (
+            df.assign(**{AMOUNT_FIELD: df[AMOUNT_FIELD].abs()})
+            .groupby('category', observed=True)[AMOUNT_FIELD].sum()
+            .reset_index()
+            .sort_values(AMOUNT_FIELD, ascending=False)
+        )
+        result['category'] = result['category'].astype(object)
+        return result.reset_index(drop=True)
+
+    def get_monthly_summary(self, year):
+        df = self.bills[self._year_mask(year)]
+        month = pd.to_numeric(df['bill_date'].str[4:6], errors='coerce')
+        amounts = df[AMOUNT_FIELD]
+        grouped = pd.DataFrame({
+            'month': month,
+            'income_cents': amounts.where(amounts > 0, 0),
+            'expense_cents': amounts.where(amounts < 0, 0).abs(),
+        }).groupby('month').sum().reset_index()
+        all_months = pd.DataFrame({'month': range(1, 13)})
+        result = all_months.merge(grouped, on='month', how='left').fillna(0)
+        result[['income_cents', 'expense_cents']] = result[['income_cents', 'expense_cents']].astype('int64')
+        return result
+
+    def get_user_auth_record(self, username):
+        doc = self.users.get(username)
+        if not doc:
+            return None
+        return {
+            'password': doc.get('password'),
+            'force_password_change': bool(doc.get('force_password_change', False)),
+        }
+
+    def get_collection_counts(self, db_name=None):
+        return dict(self.collection_counts)
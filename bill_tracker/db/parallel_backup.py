@@ -0,0 +1,170 @@
+"""
+并行备份引擎
+
+大集合按 _id 切成若干区间，由线程池中的多个游标并发读取并编码；块的 gzip 压缩
+提交到进程池，避开 GIL。写入器按 _id 顺序逐块取回结果并写出，文件内容与串行写出一致
+（块顺序、统计、内容摘要与分区摘要都按 _id 升序累计）。
+
+压缩进程池在进程内首次并行备份时创建，之后各次备份复用，spawn 启动解释器与导入模块的
+开销每个进程只付一次（Streamlit 内点击备份也不会每次重新拉起子进程）；进程退出时关闭。
+"""
+import atexit
+import gzip
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bson
+from loguru import logger
+
+
+def default_backup_workers():
+    """默认并发度：CPU 核数的一半，最多 4，避免备份占满生产机"""
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+
+# 备份并发度（读取线程数与压缩进程数），1 表示串行
+BACKUP_WORKERS = int(os.getenv('BACKUP_WORKERS', '0')) or default_backup_workers()
+# 每个读取区间的块数；区间越大切分开销越小，预读占用的内存越多
+RANGE_CHUNKS = 4
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _shared_process_pool(workers):
+    """进程内共享的压缩进程池（首次使用时创建；子进程异常退出导致池损坏时重建）"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None and getattr(_process_pool, '_broken', False):
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+        if _process_pool is None:
+            # spawn：子进程只做压缩，不继承 MongoClient 等线程状态
+            _process_pool = ProcessPoolExecutor(
+                max(workers, BACKUP_WORKERS), mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+
+@atexit.register
+def _shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def _range_filter(query, lower, upper):
+    bounds = {}
+    if lower is not None:
+        bounds['$gte'] = lower
+    if upper is not None:
+        bounds['$lt'] = upper
+    if not bounds:
+        return query or {}
+    id_filter = {'_id': bounds}
+    return {'$and': [query, id_filter]} if query else id_filter
+
+
+class ParallelBackupEngine:
+    """
+    备份期间的读取线程池（多游标读取）与压缩进程池（进程内共享，跨备份复用）
+
+    用法：with ParallelBackupEngine() as engine，再把 engine 传给 backup_writer。
+    workers 为 1 时不使用任何池，写入器走串行路径。
+    """
+
+    def __init__(self, workers=None):
+        """
+        :param workers: 并发度，默认 BACKUP_WORKERS
+        """
+        self.workers = max(1, int(workers or BACKUP_WORKERS))
+        self._threads = None
+        self._processes = None
+
+    @property
+    def parallel(self):
+        return self.workers > 1
+
+    def __enter__(self):
+        if self.parallel:
+            self._threads = ThreadPoolExecutor(self.workers, thread_name_prefix='backup-reader')
+            self._processes = _shared_process_pool(self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._threads:
+            self._threads.shutdown(wait=True, cancel_futures=True)
+        # 进程池留给下一次备份；本次未取回的压缩任务由写入器在异常路径上丢弃
+        self._processes = None
+        return False
+
+    def split_ranges(self, collection, query, range_documents):
+        """
+        按 _id 切分读取区间（只扫描 _id 索引）
+
+        :return: [(下界, 上界), ...]，None 表示不设界
+        """
+        boundaries = []
+        cursor = collection.find(query or {}, {'_id': 1}).sort('_id', 1).batch_size(10000)
+        for index, doc in enumerate(cursor):
+            if index and index % range_documents == 0:
+                boundaries.append(doc['_id'])
+        edges = [None, *boundaries, None]
+        return list(zip(edges[:-1], edges[1:]))
+
+    @staticmethod
+    def _read_range(collection, query, batch_size, chunk_documents, encode):
+        """读取一个区间并编码，返回 [(文档列表, 编码结果列表), ...]"""
+        chunks = []
+        docs, items = [], []
+        cursor = collection.find(query).sort('_id', 1).batch_size(batch_size)
+        for doc in cursor:
+            docs.append(doc)
+            items.append(encode(doc))
+            if len(docs) >= chunk_documents:
+                chunks.append((docs, items))
+                docs, items = [], []
+        if docs:
+            chunks.append((docs, items))
+        return chunks
+
+    def iter_chunks(self, collection, query, batch_size, chunk_documents, encode=bson.encode):
+        """
+        并发读取集合，按 _id 顺序产出 (文档列表, 编码结果列表)
+
+        同时在读的区间不超过 workers 个，内存上限约为 workers × RANGE_CHUNKS 个块。
+        """
+        ranges = self.split_ranges(collection, query, chunk_documents * RANGE_CHUNKS)
+        if len(ranges) > 1:
+            logger.info(f"并行读取 {collection.name}: {len(ranges)} 个 _id 区间，{self.workers} 个线程")
+        pending = deque()
+        remaining = iter(ranges)
+
+        def submit_next():
+            for lower, upper in remaining:
+                pending.append(self._threads.submit(
+                    self._read_range, collection, _range_filter(query, lower, upper),
+                    batch_size, chunk_documents, encode,
+                ))
+                return
+
+        for _ in range(self.workers):
+            submit_next()
+        while pending:
+            chunks = pending.popleft().result()
+            submit_next()
+            yield from chunks
+
+    def compress(self, data, compresslevel):
+        """提交一块压缩任务，返回 Future（池已损坏时重建一次再提交）"""
+        try:
+            return self._processes.submit(gzip.compress, data, compresslevel)
+        except BrokenProcessPool:
+            self._processes = _shared_process_pool(self.workers)
+            return self._processes.submit(gzip.compress, data, compresslevel)
@@ -0,0 +1,230 @@
+"""
+账单按年分区的内容寻址存储（data/yearly/partitions/）
+
+全量快照不再内联账单，而是在 backup_info.partitions 中引用各年份的分区文件。
+文件名含该年的年度摘要（月分区叶子摘要的汇总），内容不变的年份直接复用已有文件；
+清理快照后，不再被任何快照引用的分区文件被回收。
+"""
+import os
+import tempfile
+import time
+import zipfile
+
+from loguru import logger
+
+from bill_tracker.db.backup_io import (
+    JSON_EXTENSION,
+    backup_chain,
+    backup_mime_type,
+    backup_writer,
+    default_backup_extension,
+    glob_backups,
+    read_backup_info,
+)
+from bill_tracker.db.merkle import NO_DATE_PARTITION, LeafHasher, leaves_root, partition_filter, partition_of
+from bill_tracker.paths import get_data_root, get_partitions_dir
+
+PARTITIONED_COLLECTION = 'bills'
+# 回收时跳过最近修改过的分区文件（可能正被进行中的备份写入或复用）
+PARTITION_GC_GRACE_SECONDS = 3600
+
+
+def year_of(partition):
+    """月分区（YYYYMM）所属年份；无日期分区单独成组"""
+    return NO_DATE_PARTITION if partition == NO_DATE_PARTITION else partition[:4]
+
+
+def year_digests(leaves):
+    """
+    年度摘要
+
+    :param leaves: 月分区叶子摘要 {YYYYMM: 摘要}
+    :return: {年份: 摘要}
+    """
+    by_year = {}
+    for partition, digest in leaves.items():
+        by_year.setdefault(year_of(partition), {})[partition] = digest
+    return {year: leaves_root(year_leaves) for year, year_leaves in by_year.items()}
+
+
+def partition_file_name(collection_name, year, digest, extension=None):
+    return f'{collection_name}-{year}-{digest}{extension or default_backup_extension()}'
+
+
+def _find_partition_file(collection_name, year, digest):
+    directory = get_partitions_dir()
+    for path in glob_backups(directory, f'{collection_name}-{year}-{digest}'):
+        return path
+    return None
+
+
+def _write_year(db, collection_name, year, database_name, engine=None):
+    """写出一个年份的分区文件，按实际写出内容的年度摘要命名"""
+    directory = get_partitions_dir()
+    extension = default_backup_extension()
+    pending = os.path.join(directory, f'{collection_name}-{year}-pending-{os.getpid()}{extension}')
+    leaves = {}
+
+    def add_leaf(doc):
+        leaves.setdefault(partition_of(collection_name, doc), LeafHasher()).add(doc)
+
+    with backup_writer(pending, database_name, engine=engine) as writer:
+        stat = writer.write_collection(
+            collection_name, db[collection_name], track_dates=True,
+            query=partition_filter(year), on_document=add_leaf,
+        )
+        digest = year_digests({p: leaf.digest.hexdigest() for p, leaf in leaves.items()}).get(year)
+        writer.finish({
+            'database_name': database_name,
+            'type': 'partition',
+            'collection': collection_name,
+            'year': year,
+            'partition_hash': digest,
+        })
+    if digest is None:
+        os.remove(pending)
+        return None, stat
+    path = os.path.join(directory, partition_file_name(collection_name, year, digest, extension))
+    if os.path.exists(path):
+        os.remove(pending)
+    else:
+        os.replace(pending, path)
+    return path, stat
+
+
+def write_year_partitions(db, leaves, database_name, collection_name=PARTITIONED_COLLECTION, engine=None):
+    """
+    按年写出（或复用）分区文件
+
+    :param db: pymongo Database
+    :param leaves: 该集合当前的月分区叶子摘要（写出前刚刷新）
+    :param database_name: 记录在分区文件中的库名
+    :param engine: ParallelBackupEngine（可选），大年份并发读取
+    :return: {年份: {'file', 'hash', 'count', 'bill_date_min', 'bill_date_max', 'reused'}}
+    """
+    os.makedirs(get_partitions_dir(), exist_ok=True)
+    manifest = {}
+    for year, digest in sorted(year_digests(leaves).items()):
+        path = _find_partition_file(collection_name, year, digest)
+        if path:
+            # 复用：刷新修改时间，避免被并发的回收误删
+            os.utime(path)
+            stat = (read_backup_info(path).get('collection_stats') or {}).get(collection_name, {})
+            reused = True
+        else:
+            path, stat = _write_year(db, collection_name, year, database_name, engine)
+            reused = False
+            if path is None:
+                continue
+            digest = os.path.basename(path)[len(f'{collection_name}-{year}-'):].split('.')[0]
+        manifest[year] = {
+            'file': os.path.basename(path),
+            'hash': digest,
+            'count': stat.get('count', 0),
+            'bill_date_min': stat.get('bill_date_min'),
+            'bill_date_max': stat.get('bill_date_max'),
+            'reused': reused,
+        }
+    written = [y for y, part in manifest.items() if not part['reused']]
+    logger.info(f"账单年度分区: 共 {len(manifest)} 年，新写出 {written or '无'}")
+    return manifest
+
+
+def manifest_stat(manifest):
+    """分区引用汇总为集合统计 (条数, (bill_date 最小值, 最大值))"""
+    count = sum(part['count'] for part in manifest.values())
+    mins = [part['bill_date_min'] for part in manifest.values() if part.get('bill_date_min')]
+    maxs = [part['bill_date_max'] for part in manifest.values() if part.get('bill_date_max')]
+    return count, (min(mins) if mins else None, max(maxs) if maxs else None)
+
+
+def referenced_partition_files(backup_paths):
+    """一组快照引用的分区文件名"""
+    referenced = set()
+    for path in backup_paths:
+        try:
+            partitions = read_backup_info(path).get('partitions') or {}
+        except Exception as e:
+            logger.warning(f"读取快照分区引用失败 {path}: {e}")
+            # 无法确认引用关系时不回收任何文件
+            return None
+        for years in partitions.values():
+            referenced.update(part['file'] for part in years.values())
+    return referenced
+
+
+def collect_garbage(backup_paths, grace_seconds=PARTITION_GC_GRACE_SECONDS):
+    """
+    回收未被任何快照引用的分区文件
+
+    :param backup_paths: 现存的全部快照（含 pre_restore）
+    :return: 删除的文件名列表
+    """
+    referenced = referenced_partition_files(backup_paths)
+    if referenced is None:
+        return []
+    removed = []
+    cutoff = time.time() - grace_seconds
+    for path in glob_backups(get_partitions_dir(), ''):
+        name = os.path.basename(path)
+        if name in referenced or os.path.getmtime(path) > cutoff:
+            continue
+        try:
+            os.remove(path)
+            removed.append(name)
+        except OSError as e:
+            logger.warning(f"删除分区文件失败 {name}: {e}")
+    if removed:
+        logger.info(f"已回收未引用的分区文件: {removed}")
+    return removed
+
+
+def backup_dependencies(path):
+    """
+    快照恢复所需的全部文件：快照链（基线到自身）及其引用的分区文件
+
+    :return: 文件路径列表
+    """
+    chain = backup_chain(path)
+    files = referenced_partition_files(chain)
+    if files is None:
+        raise ValueError(f'无法读取快照的分区引用: {os.path.basename(path)}')
+    return chain + [os.path.join(get_partitions_dir(), name) for name in sorted(files)]
+
+
+def open_backup_download(path):
+    """
+    打开下载用的快照内容：自包含的单个文件直接打开，否则逐个文件写入 zip 临时文件（按数据目录的相对路径存放）
+
+    zip 直接从磁盘分块读取成员，不在内存中拼接；未压缩的 JSON 快照随打包压缩（deflate），
+    容器与分区文件本身已压缩，只做归档。
+
+    :return: (定位在开头的二进制文件对象, 文件名, MIME 类型)，由调用方关闭
+    """
+    files = backup_dependencies(path)
+    if len(files) == 1:
+        return open(path, 'rb'), os.path.basename(path), backup_mime_type(path)
+    root = get_data_root()
+    handle = tempfile.TemporaryFile()
+    try:
+        with zipfile.ZipFile(handle, 'w', zipfile.ZIP_STORED) as bundle:
+            for file_path in files:
+                compress_type = zipfile.ZIP_DEFLATED if file_path.endswith(JSON_EXTENSION) else zipfile.ZIP_STORED
+                bundle.write(file_path, os.path.relpath(file_path, root), compress_type=compress_type)
+    except Exception:
+        handle.close()
+        raise
+    handle.seek(0)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return handle, f'{name}.zip', 'application/zip'
+
+
+def backup_download(path):
+    """
+    下载用的快照内容（按需调用：读取整个文件或打包依赖，不要在每次渲染页面时调用）
+
+    :return: (字节内容, 文件名, MIME 类型)
+    """
+    handle, file_name, mime = open_backup_download(path)
+    with handle:
+        return handle.read(), file_name, mime
@@ -0,0 +1,397 @@
+"""查询形状统计与索引建议：记录账单查询的归一化形状，并据此推荐复合/覆盖索引。"""
+import atexit
+import os
+import threading
+import weakref
+from datetime import datetime
+
+import pymongo
+from bson import json_util
+from loguru import logger
+
+QUERY_SHAPES_COLLECTION = 'query_shapes'
+# 内存中的查询形状最迟多少秒后写入（常驻的 Web 进程不关闭连接，也要让索引建议脚本看到）
+QUERY_SHAPE_FLUSH_SECONDS = float(os.getenv('QUERY_SHAPE_FLUSH_SECONDS', '30'))
+
+# 谓词类型：eq/in 可作为索引等值前缀；range 放在排序字段之后（ESR 规则）；
+# regex（非前缀、忽略大小写）与 expr（$expr/$toInt）无法利用索引边界
+PREDICATE_EQ = 'eq'
+PREDICATE_IN = 'in'
+PREDICATE_RANGE = 'range'
+PREDICATE_REGEX = 'regex'
+PREDICATE_EXPR = 'expr'
+PREDICATE_OTHER = 'other'
+
+_RANGE_OPS = {'$gt', '$gte', '$lt', '$lte'}
+_EXPR_COMPARE_OPS = {'$gt', '$gte', '$lt', '$lte', '$eq', '$ne'}
+
+
+def _expr_fields(expr, found):
+    """从 $expr 表达式中提取被引用的字段名（'$bill_date' -> 'bill_date'）。"""
+    if isinstance(expr, str):
+        if expr.startswith('$') and not expr.startswith('$$'):
+            found.add(expr[1:])
+    elif isinstance(expr, dict):
+        for value in expr.values():
+            _expr_fields(value, found)
+    elif isinstance(expr, (list, tuple)):
+        for value in expr:
+            _expr_fields(value, found)
+    return found
+
+
+def _predicate_kind(value):
+    if isinstance(value, dict) and any(str(k).startswith('$') for k in value):
+        ops = set(value)
+        if '$regex' in ops:
+            return PREDICATE_REGEX
+        if '$in' in ops:
+            return PREDICATE_IN
+        if ops & _RANGE_OPS:
+            return PREDICATE_RANGE
+        if '$eq' in ops:
+            return PREDICATE_EQ
+        return PREDICATE_OTHER
+    if hasattr(value, 'pattern'):
+        return PREDICATE_REGEX
+    return PREDICATE_EQ
+
+
+def normalize_query_shape(query):
+    """
+    将 MongoDB 查询条件归一化为「字段 -> 谓词类型」，去掉具体取值
+
+    :param query: MongoDB 查询条件
+    :return: {'bill_date': 'expr', 'category': 'in', ...}
+    """
+    shape = {}
+    for key, value in (query or {}).items():
+        if key == '$expr':
+            for field in _expr_fields(value, set()):
+                shape[field] = PREDICATE_EXPR
+        elif key in ('$and', '$or', '$nor') and isinstance(value, list):
+            for sub in value:
+                for field, kind in normalize_query_shape(sub).items():
+                    # $or 分支无法共同使用一个复合索引前缀，统一视为 other
+                    shape[field] = kind if key == '$and' else PREDICATE_OTHER
+        else:
+            shape[key] = _predicate_kind(value)
+    return shape
+
+
+def shape_key(collection_name, shape, sort=None):
+    """形状的稳定字符串标识（同时作为 query_shapes 文档的 _id）。"""
+    predicates = ','.join(f'{f}:{k}' for f, k in sorted(shape.items()))
+    sort_part = ','.join(f'{f}:{d}' for f, d in (sort or []))
+    return f'{collection_name}|{predicates}|{sort_part}'
+
+
+class QueryShapeRecorder:
+    """
+    记录查询形状及频次
+
+    在内存中按形状累加计数，每累计 flush_every 次、第一条待写记录满 flush_seconds 秒、
+    关闭连接或进程退出时用 $inc 批量写入 query_shapes 集合，避免每次查询都额外产生一次写入。
+    """
+
+    def __init__(self, shapes_collection, flush_every=50, enabled=True, flush_seconds=None):
+        """
+        :param flush_seconds: 待写记录的最长停留时间，默认 QUERY_SHAPE_FLUSH_SECONDS，0 表示不按时间写入
+        """
+        self.shapes_collection = shapes_collection
+        self.flush_every = flush_every
+        self.enabled = enabled
+        self.flush_seconds = QUERY_SHAPE_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self._pending = {}
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._timer = None
+        atexit.register(_flush_at_exit, weakref.ref(self))
+
+    def record(self, source, query, sort=None, fields=None, collection_name='bills'):
+        """
+        记录一次查询
+
+        :param source: 调用来源（方法名），用于报告
+        :param query: MongoDB 查询条件
+        :param sort: [(字段, 1/-1)] 排序
+        :param fields: 查询实际需要的字段（聚合场景用于覆盖索引建议）
+        :param collection_name: 集合名
+        """
+        if not self.enabled:
+            return
+        try:
+            shape = normalize_query_shape(query)
+            sort = [(f, int(d)) for f, d in (sort or [])]
+            key = shape_key(collection_name, shape, sort)
+            with self._lock:
+                entry = self._pending.setdefault(key, {
+                    'collection': collection_name,
+                    'predicates': shape,
+                    'sort': sort,
+                    'count': 0,
+                    'sources': set(),
+                    'fields': set(),
+                    'sample': None,
+                })
+                entry['count'] += 1
+                entry['sources'].add(source)
+                entry['fields'].update(fields or [])
+                entry['sample'] = json_util.dumps(query or {})
+                self._pending_total += 1
+                should_flush = self._pending_total >= self.flush_every
+                if not should_flush and self._timer is None and self.flush_seconds > 0:
+                    self._timer = threading.Timer(self.flush_seconds, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+            if should_flush:
+                self.flush()
+        except Exception as e:
+            logger.warning(f"记录查询形状失败: {e}")
+
+    def flush(self):
+        """将内存中的计数写入 query_shapes 集合"""
+        with self._lock:
+            pending, self._pending, self._pending_total = self._pending, {}, 0
+            timer, self._timer = self._timer, None
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+        if not pending:
+            return
+        requests = []
+        now = datetime.now()
+        for key, entry in pending.items():
+            requests.append(pymongo.UpdateOne(
+                {'_id': key},
+                {
+                    '$inc': {'count': entry['count']},
+                    '$set': {
+                        'collection': entry['collection'],
+                        'predicates': entry['predicates'],
+                        'sort': [list(s) for s in entry['sort']],
+                        'sample': entry['sample'],
+                        'last_seen': now,
+                    },
+                    '$addToSet': {
+                        'sources': {'$each': sorted(entry['sources'])},
+                        'fields': {'$each': sorted(entry['fields'])},
+                    },
+                    '$setOnInsert': {'first_seen': now},
+                },
+                upsert=True,
+            ))
+        try:
+            self.shapes_collection.bulk_write(requests, ordered=False)
+        except Exception as e:
+            logger.warning(f"写入查询形状统计失败: {e}")
+
+
+def _flush_at_exit(recorder_ref):
+    """进程退出时写入仍在内存中的查询形状（Streamlit 缓存的连接不会被显式关闭）"""
+    recorder = recorder_ref()
+    if recorder is not None:
+        recorder.flush()
+
+
+def _plan_stages(plan, stages=None):
+    """递归收集 explain 计划中的 stage 名称（兼容经典引擎与 SBE 的 queryPlan 嵌套）。"""
+    stages = stages if stages is not None else []
+    if not isinstance(plan, dict):
+        return stages
+    if 'queryPlan' in plan:
+        return _plan_stages(plan['queryPlan'], stages)
+    if 'stage' in plan:
+        stages.append(plan['stage'])
+    for key in ('inputStage', 'outerStage', 'innerStage'):
+        if key in plan:
+            _plan_stages(plan[key], stages)
+    for sub in plan.get('inputStages', []):
+        _plan_stages(sub, stages)
+    return stages
+
+
+class IndexAdvisor:
+    """
+    基于 query_shapes 统计推荐索引
+
+    按 ESR（等值 -> 排序 -> 范围）规则为每个形状生成复合索引键；聚合场景下把
+    其余所需字段追加到末尾形成覆盖索引。预计收益 = 频次 ×（当前计划扫描文档数
+    - 仅按可走索引谓词命中的文档数），两者都用样本查询在当前数据上实测。
+    """
+
+    def __init__(self, database, shapes_collection_name=QUERY_SHAPES_COLLECTION):
+        self.database = database
+        self.shapes_collection = database[shapes_collection_name]
+
+    def explain(self, collection_name, query, sort=None):
+        """
+        对 find 查询执行 explain(executionStats)
+
+        :return: {'stages': [...], 'docs_examined': int, 'keys_examined': int, 'index_names': [...]}
+        """
+        command = {'find': collection_name, 'filter': query or {}}
+        if sort:
+            command['sort'] = dict(sort)
+        result = self.database.command({'explain': command, 'verbosity': 'executionStats'})
+        winning = result.get('queryPlanner', {}).get('winningPlan', {})
+        stats = result.get('executionStats', {})
+        index_names = []
+
+        def _collect_index(plan):
+            if not isinstance(plan, dict):
+                return
+            if plan.get('indexName'):
+                index_names.append(plan['indexName'])
+            for value in plan.values():
+                if isinstance(value, dict):
+                    _collect_index(value)
+                elif isinstance(value, list):
+                    for item in value:
+                        _collect_index(item)
+
+        _collect_index(winning)
+        return {
+            'stages': _plan_stages(winning),
+            'docs_examined': stats.get('totalDocsExamined', 0),
+            'keys_examined': stats.get('totalKeysExamined', 0),
+            'index_names': index_names,
+        }
+
+    @staticmethod
+    def index_keys_for_shape(shape_doc):
+        """
+        为一个形状生成 ESR 顺序的索引键
+
+        :return: (keys, covering_keys, unindexable_fields)
+        """
+        predicates = shape_doc.get('predicates', {})
+        sort = [tuple(s) for s in shape_doc.get('sort', [])]
+        eq_fields = sorted(f for f, k in predicates.items() if k == PREDICATE_EQ)
+        in_fields = sorted(f for f, k in predicates.items() if k == PREDICATE_IN)
+        range_fields = sorted(f for f, k in predicates.items() if k == PREDICATE_RANGE)
+        unindexable = sorted(
+            f for f, k in predicates.items() if k in (PREDICATE_REGEX, PREDICATE_EXPR, PREDICATE_OTHER)
+        )
+
+        keys = [(f, pymongo.ASCENDING) for f in eq_fields + in_fields]
+        for field, direction in sort:
+            if field not in dict(keys):
+                keys.append((field, direction))
+        for field in range_fields:
+            if field not in dict(keys):
+                keys.append((field, pymongo.ASCENDING))
+
+        covering = list(keys)
+        for field in sorted(set(shape_doc.get('fields', [])) | set(unindexable)):
+            if field != '_id' and field not in dict(covering):
+                covering.append((field, pymongo.ASCENDING))
+        if covering == keys or not shape_doc.get('fields'):
+            covering = None
+        return keys, covering, unindexable
+
+    def _existing_prefixes(self, collection_name):
+        prefixes = []
+        for info in self.database[collection_name].index_information().values():
+            prefixes.append([(f, int(d)) for f, d in info['key']])
+        return prefixes
+
+    @staticmethod
+    def _is_served_by(keys, existing):
+        """已有索引以 keys 为前缀时，无需再建"""
+        normalized = [(f, int(d)) for f, d in keys]
+        return any(index[:len(normalized)] == normalized for index in existing)
+
+    @staticmethod
+    def _sargable_filter(query, keys):
+        """仅保留可利用索引边界的谓词（用于估算走索引后的扫描量）"""
+        key_fields = {f for f, _ in keys}
+        return {
+            f: v for f, v in (query or {}).items()
+            if f in key_fields and _predicate_kind(v) in (PREDICATE_EQ, PREDICATE_IN, PREDICATE_RANGE)
+        }
+
+    def propose(self, limit=10, min_count=1):
+        """
+        生成按预计收益降序排列的索引建议
+
+        :param limit: 最多返回条数
+        :param min_count: 形状最少出现次数
+        :return: 建议列表
+        """
+        proposals = {}
+        existing_by_coll = {}
+        for shape_doc in self.shapes_collection.find({'count': {'$gte': min_count}}):
+            collection_name = shape_doc.get('collection', 'bills')
+            if collection_name not in existing_by_coll:
+                existing_by_coll[collection_name] = self._existing_prefixes(collection_name)
+            existing = existing_by_coll[collection_name]
+
+            keys, covering, unindexable = self.index_keys_for_shape(shape_doc)
+            if not keys:
+                continue
+            candidate = covering or keys
+            if self._is_served_by(candidate, existing):
+                continue
+
+            sample = json_util.loads(shape_doc.get('sample') or '{}')
+            sort = [tuple(s) for s in shape_doc.get('sort', [])]
+            try:
+                current = self.explain(collection_name, sample, sort)
+                expected_docs = self.database[collection_name].count_documents(
+                    self._sargable_filter(sample, keys)
+                )
+            except Exception as e:
+                logger.warning(f"评估查询形状失败 {shape_doc['_id']}: {e}")
+                continue
+
+            saved_per_query = max(current['docs_examined'] - expected_docs, 0)
+            if 'SORT' in current['stages'] and sort:
+                # 内存排序被索引顺序消除，按一次排序的文档量计入收益
+                saved_per_query += expected_docs
+            key_id = (collection_name, tuple(candidate))
+            proposal = proposals.setdefault(key_id, {
+                'collection': collection_name,
+                'keys': candidate,
+                'covering': covering is not None,
+                'shapes': [],
+                'query_count': 0,
+                'estimated_docs_saved': 0,
+                'unindexable_fields': set(),
+                'sample': sample,
+                'sort': sort,
+                'current_plan': current,
+            })
+            proposal['shapes'].append(shape_doc['_id'])
+            proposal['query_count'] += shape_doc.get('count', 0)
+            proposal['estimated_docs_saved'] += shape_doc.get('count', 0) * saved_per_query
+            proposal['unindexable_fields'].update(unindexable)
+
+        ranked = sorted(proposals.values(), key=lambda p: p['estimated_docs_saved'], reverse=True)
+        for proposal in ranked:
+            proposal['unindexable_fields'] = sorted(proposal['unindexable_fields'])
+        return ranked[:limit]
+
+    def apply(self, proposal):
+        """
+        创建建议的索引，并用 explain 对比创建前后的执行计划
+
+        :return: {'index_name', 'before', 'after', 'verified'}
+        """
+        collection_name = proposal['collection']
+        keys = [(f, int(d)) for f, d in proposal['keys']]
+        name = 'advisor_' + '_'.join(f'{f}_{d}' for f, d in keys)
+        before = proposal.get('current_plan') or self.explain(
+            collection_name, proposal['sample'], proposal['sort']
+        )
+        self.database[collection_name].create_index(keys, name=name)
+        after = self.explain(collection_name, proposal['sample'], proposal['sort'])
+        verified = name in after['index_names'] and (
+            after['docs_examined'] < before['docs_examined']
+            or ('SORT' in before['stages'] and 'SORT' not in after['stages'])
+            or 'COLLSCAN' in before['stages']
+        )
+        logger.info(
+            f"索引建议已应用: {collection_name}.{name}, 扫描文档 {before['docs_examined']} -> "
+            f"{after['docs_examined']}, 计划 {before['stages']} -> {after['stages']}"
+        )
+        return {'index_name': name, 'before': before, 'after': after, 'verified': verified}
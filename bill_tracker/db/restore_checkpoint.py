@@ -0,0 +1,103 @@
+"""恢复检查点：记录进行中的恢复已完成的层/集合与当前集合已写入的条数，中断后可从断点继续。"""
+import json
+import os
+from datetime import datetime
+
+from loguru import logger
+
+from bill_tracker.paths import get_restore_checkpoint_path
+
+
+class RestoreCheckpoint:
+    """
+    恢复检查点（data/restore_checkpoint.json）
+
+    每写完一批即原子重写：params 为恢复参数（继续时必须一致），completed 为已完成的
+    "层序号:集合名"，current 为进行中的集合及已写入条数，stats 为累计统计，
+    staged 为已建立暂存集合的集合及其从现网复制的条数。恢复成功后删除。
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: 检查点文件路径，默认 data/restore_checkpoint.json
+        """
+        self.path = path or get_restore_checkpoint_path()
+        self.state = None
+
+    @staticmethod
+    def key(layer_index, collection_name):
+        return f'{layer_index}:{collection_name}'
+
+    def load(self):
+        """读取检查点；不存在或损坏时返回 None"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = None
+        except (OSError, ValueError) as e:
+            logger.warning(f"恢复检查点无法读取，忽略: {e}")
+            self.state = None
+        return self.state
+
+    def _save(self):
+        self.state['updated_at'] = datetime.now().isoformat()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, self.path)
+
+    def start(self, params, pre_restore_path, pre_restore_shadow=None):
+        """开始一次新的恢复（记录恢复前快照文件或影子副本编号）"""
+        self.state = {
+            'params': params,
+            'pre_restore_path': pre_restore_path,
+            'pre_restore_shadow': pre_restore_shadow,
+            'started_at': datetime.now().isoformat(),
+            'completed': [],
+            'current': None,
+            'stats': {},
+            'staged': {},
+        }
+        self._save()
+
+    def is_completed(self, layer_index, collection_name):
+        return self.key(layer_index, collection_name) in self.state['completed']
+
+    def resume_offset(self, layer_index, collection_name):
+        """进行中的集合已写入的条数（不是该集合时为 0）"""
+        current = self.state.get('current') or {}
+        if current.get('key') != self.key(layer_index, collection_name):
+            return 0
+        return current.get('done', 0)
+
+    def update(self, layer_index, collection_name, done, stats):
+        """一批写入完成"""
+        self.state['current'] = {'key': self.key(layer_index, collection_name), 'done': done}
+        self.state['stats'] = stats
+        self._save()
+
+    def complete(self, layer_index, collection_name, stats):
+        """一个集合（或一层的删除回放）完成"""
+        self.state['completed'].append(self.key(layer_index, collection_name))
+        self.state['current'] = None
+        self.state['stats'] = stats
+        self._save()
+
+    @property
+    def staged(self):
+        """{集合名: 从现网复制到暂存集合的条数}"""
+        return self.state.setdefault('staged', {})
+
+    def stage(self, collection_name, copied):
+        """记录已建立暂存集合（该集合从头开始写入）"""
+        self.staged[collection_name] = copied
+        self._save()
+
+    def clear(self):
+        self.state = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
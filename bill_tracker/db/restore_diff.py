@@ -0,0 +1,319 @@
+"""
+恢复预演（dry-run）
+
+按 _id 升序同时遍历快照与现网集合做归并对比，统计各恢复模式下将插入、更新、保持不变与删除的文档数，
+并给出少量样例；不写入数据库，内存只与块大小和样例数有关。
+
+快照链按层归并：同一 _id 取最高层的文档；之后的层删除记录（墓碑）或整分区替换掉的文档视为不存在
+（合并模式不执行分区替换，只执行墓碑删除）。分区文件逐年有序，多个年份再做一次归并。
+早期未按 _id 排序的 JSON 快照退回为按批 $in 查询现网文档。
+"""
+import datetime
+import heapq
+import os
+from contextlib import ExitStack
+
+from bson import ObjectId
+from loguru import logger
+
+from bill_tracker.db.backup_io import TOMBSTONE_COLLECTION, open_backup
+from bill_tracker.db.merkle import document_digest, is_partitioned, partition_of, partitions_filter
+from bill_tracker.paths import get_partitions_dir
+
+SAMPLE_SIZE = 5
+# 两种视图：替换式恢复（bills_only / full_replace）与合并恢复
+VIEW_REPLACE = 'replace'
+VIEW_MERGE = 'merge'
+DIFF_KEYS = ('inserted', 'updated', 'unchanged', 'deleted', 'kept')
+LOOKUP_BATCH_SIZE = 1000
+
+
+def id_sort_key(value):
+    """与 MongoDB 排序一致的 _id 比较键（数字 < 字符串 < 对象 < ObjectId < 布尔 < 日期）"""
+    if value is None:
+        return 0, 0
+    if isinstance(value, bool):
+        return 8, value
+    if isinstance(value, (int, float)):
+        return 1, value
+    if isinstance(value, str):
+        return 2, value
+    if isinstance(value, ObjectId):
+        return 7, value
+    if isinstance(value, datetime.datetime):
+        return 9, value
+    return 3, str(value)
+
+
+class _Unsorted(Exception):
+    """快照中的文档未按 _id 升序（早期 JSON 快照）"""
+
+
+def _new_stat():
+    stat = dict.fromkeys(DIFF_KEYS, 0)
+    stat['samples'] = {key: [] for key in DIFF_KEYS if key != 'unchanged'}
+    return stat
+
+
+def changed_fields(doc, live):
+    """内容不同的顶层字段"""
+    return sorted(
+        key for key in set(doc) | set(live)
+        if key not in doc or key not in live or document_digest({key: doc[key]}) != document_digest({key: live[key]})
+    )
+
+
+class CollectionDiff:
+    """单个集合在两种视图下的统计与样例"""
+
+    def __init__(self, sample_size=SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.views = {VIEW_REPLACE: _new_stat(), VIEW_MERGE: _new_stat()}
+
+    def _count(self, view, key, doc=None, live=None, n=1):
+        stat = self.views[view]
+        stat[key] += n
+        samples = stat['samples'].get(key)
+        if samples is None or doc is None or len(samples) >= self.sample_size:
+            return
+        sample = {'_id': str(doc.get('_id'))}
+        if doc.get('bill_date'):
+            sample['bill_date'] = doc['bill_date']
+        if live is not None:
+            sample['fields'] = changed_fields(doc, live)
+        samples.append(sample)
+
+    def classify(self, view, doc, live, backup_seen=True):
+        """
+        :param doc: 该视图下恢复后的文档（None 表示恢复后不存在）
+        :param live: 现网文档
+        :param backup_seen: 快照链中出现过该 _id（合并模式下只有被删除记录命中的才会删除）
+        """
+        if doc is None:
+            if live is None:
+                return
+            if view == VIEW_MERGE and not backup_seen:
+                self._count(view, 'kept', live)
+            else:
+                self._count(view, 'deleted', live)
+        elif live is None:
+            self._count(view, 'inserted', doc)
+        elif document_digest(doc) == document_digest(live):
+            self._count(view, 'unchanged')
+        else:
+            self._count(view, 'updated', doc, live)
+
+    def add_unchanged(self, n):
+        """摘要相同、未逐条比较的分区"""
+        for view in self.views:
+            self.views[view]['unchanged'] += n
+
+    def add_inserted(self, doc):
+        """没有 _id 的快照文档（恢复时总是新插入）"""
+        for view in self.views:
+            self._count(view, 'inserted', doc)
+
+
+class _Source:
+    """快照文档的读取方式：规范化、对比范围与没有 _id 的文档的处理"""
+
+    def __init__(self, normalize, include, on_unkeyed):
+        self.normalize = normalize
+        self.include = include
+        self.on_unkeyed = on_unkeyed
+
+    def documents(self, docs):
+        for doc in docs:
+            doc = self.normalize(doc)
+            if self.include is None or self.include(doc):
+                yield doc
+
+
+def _keyed(docs, source):
+    """规范化文档并产出 (_id 比较键, 文档)，检查升序"""
+    last = None
+    for doc in source.documents(docs):
+        if '_id' not in doc:
+            source.on_unkeyed(doc)
+            continue
+        key = id_sort_key(doc['_id'])
+        if last is not None and key <= last:
+            raise _Unsorted()
+        last = key
+        yield key, doc
+
+
+def _layer_documents(reader, name, years, source):
+    """一层快照中某集合按 _id 升序的文档；分区文件逐年读取后归并"""
+    if name not in reader.partitions:
+        yield from _keyed(reader.iter_documents(name, years), source)
+        return
+    with ExitStack() as stack:
+        streams = []
+        for year, part in sorted(reader.partitions[name].items()):
+            if years and year not in years:
+                continue
+            sub = stack.enter_context(open_backup(os.path.join(get_partitions_dir(), part['file'])))
+            streams.append(_keyed(sub.iter_documents(name), source))
+        yield from heapq.merge(*streams, key=lambda item: item[0])
+
+
+def _normalize_id(doc_id):
+    if isinstance(doc_id, str) and ObjectId.is_valid(doc_id):
+        return ObjectId(doc_id)
+    return doc_id
+
+
+class _Layer:
+    """快照链中的一层：读取器、该集合的删除记录与整分区替换"""
+
+    def __init__(self, index, reader, name):
+        self.index = index
+        self.reader = reader
+        self.replaced = set((reader.info.get('replaced_partitions') or {}).get(name, [])) if index > 0 else set()
+        self.tombstones = set()
+        if index > 0 and TOMBSTONE_COLLECTION in reader.collection_names():
+            for tomb in reader.iter_documents(TOMBSTONE_COLLECTION):
+                if tomb.get('collection') == name:
+                    try:
+                        self.tombstones.add(_normalize_id(tomb.get('doc_id')))
+                    except TypeError:
+                        pass
+
+
+def _layer_stream(layer, name, years, source):
+    for key, doc in _layer_documents(layer.reader, name, years, source):
+        yield key, -layer.index, doc
+
+
+def _chain_stream(layers, name, years, source):
+    """多层归并：按 _id 升序产出 (比较键, 最高层文档, 最高层序号)"""
+    streams = [_layer_stream(layer, name, years, source) for layer in layers]
+    last_key = None
+    for key, neg_index, doc in heapq.merge(*streams, key=lambda item: item[:2]):
+        if key == last_key:
+            continue
+        last_key = key
+        yield key, doc, -neg_index
+
+
+def _removed_later(layers, name, doc, top, replacements=True):
+    """
+    最高层为 top 的文档是否被之后的层移除
+
+    恢复在同一层写入文档之后才回放删除记录；之后的层整分区替换会先清掉该分区（合并恢复不执行）。
+    """
+    if any(doc['_id'] in layer.tombstones for layer in layers[max(top, 1):]):
+        return True
+    return replacements and any(partition_of(name, doc) in layer.replaced for layer in layers[top + 1:])
+
+
+def chain_documents(readers, name, years=None, normalize=None):
+    """
+    快照链按替换式恢复还原后某集合的文档，按 _id 升序逐条产出（单份快照即其本身）
+
+    :param readers: 快照链各层的读取器（基线在前）
+    :raises ValueError: 快照中的文档未按 _id 排序
+    """
+    layers = [_Layer(index, reader, name) for index, reader in enumerate(readers)]
+    source = _Source(normalize or dict, None, lambda doc: None)
+    try:
+        for _, doc, top in _chain_stream(layers, name, years, source):
+            if not _removed_later(layers, name, doc, top):
+                yield doc
+    except _Unsorted:
+        raise ValueError(f'快照中的 {name} 未按 _id 排序，无法流式对比')
+
+
+def diff_collection(live, readers, name, years=None, partitions=None, normalize=None, sample_size=SAMPLE_SIZE):
+    """
+    对比快照链与现网集合
+
+    :param live: 现网 Collection
+    :param readers: 快照链各层的读取器（基线在前）
+    :param years: 只对比这些年份（账单集合）
+    :param partitions: 只对比这些分区（摘要不同的分区）；None 表示全部
+    :param normalize: 快照文档规范化（与恢复写入时一致）
+    :return: CollectionDiff
+    """
+    if partitions is not None:
+        wanted = set(partitions)
+        query = partitions_filter(partitions)
+        years = sorted({p[:4] for p in partitions}) if is_partitioned(name) else None
+        include = (lambda doc: partition_of(name, doc) in wanted) if is_partitioned(name) else None
+    else:
+        query = partitions_filter(years) if years else {}
+        include = None
+    layers = [_Layer(index, reader, name) for index, reader in enumerate(readers)]
+
+    diff = CollectionDiff(sample_size)
+    try:
+        _merge_join(diff, layers, name, live, query, years, _Source(normalize or dict, include, diff.add_inserted))
+    except _Unsorted:
+        if len(layers) > 1:
+            raise ValueError(f'快照中的 {name} 未按 _id 排序，无法对比快照链')
+        logger.info(f"快照中的 {name} 未按 _id 排序，改为按批查询现网文档对比")
+        diff = CollectionDiff(sample_size)
+        _lookup_join(diff, layers[0], name, live, query, years, _Source(normalize or dict, include, diff.add_inserted))
+    return diff
+
+
+def _merge_join(diff, layers, name, live, query, years, source):
+    backup = _chain_stream(layers, name, years, source)
+    cursor = live.find(query).sort('_id', 1).batch_size(LOOKUP_BATCH_SIZE)
+    live_docs = ((id_sort_key(doc['_id']), doc) for doc in cursor)
+    b = next(backup, None)
+    lv = next(live_docs, None)
+    while b is not None or lv is not None:
+        if lv is None or (b is not None and b[0] < lv[0]):
+            _classify(diff, layers, name, b, None)
+            b = next(backup, None)
+        elif b is None or lv[0] < b[0]:
+            _classify(diff, layers, name, None, lv[1])
+            lv = next(live_docs, None)
+        else:
+            _classify(diff, layers, name, b, lv[1])
+            b = next(backup, None)
+            lv = next(live_docs, None)
+
+
+def _classify(diff, layers, name, backup_item, live_doc):
+    if backup_item is None:
+        diff.classify(VIEW_REPLACE, None, live_doc, backup_seen=False)
+        diff.classify(VIEW_MERGE, None, live_doc, backup_seen=False)
+        return
+    _, doc, top = backup_item
+    replace_removed = _removed_later(layers, name, doc, top)
+    merge_removed = _removed_later(layers, name, doc, top, replacements=False)
+    diff.classify(VIEW_REPLACE, None if replace_removed else doc, live_doc)
+    diff.classify(VIEW_MERGE, None if merge_removed else doc, live_doc)
+
+
+def _lookup_join(diff, layer, name, live, query, years, source):
+    """未排序的单层快照：按批 $in 查询现网文档，未匹配的现网文档数由条数相减得到"""
+    matched = 0
+    batch = []
+
+    def flush():
+        nonlocal matched
+        ids = [doc['_id'] for doc in batch]
+        id_filter = {'_id': {'$in': ids}}
+        found = {doc['_id']: doc for doc in live.find({'$and': [query, id_filter]} if query else id_filter)}
+        matched += len(found)
+        for doc in batch:
+            for view in (VIEW_REPLACE, VIEW_MERGE):
+                diff.classify(view, doc, found.get(doc['_id']))
+        batch.clear()
+
+    for doc in source.documents(layer.reader.iter_documents(name, years)):
+        if '_id' not in doc:
+            source.on_unkeyed(doc)
+            continue
+        batch.append(doc)
+        if len(batch) >= LOOKUP_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    remaining = live.count_documents(query) - matched
+    diff.views[VIEW_REPLACE]['deleted'] += remaining
+    diff.views[VIEW_MERGE]['kept'] += remaining
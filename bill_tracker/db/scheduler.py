@@ -0,0 +1,241 @@
+"""
+常驻备份调度器
+
+一个进程、一个 BillDatabase 连接，按以下任一条件调用 backup_all_data（仍做哈希检测，无变化则跳过）：
+- 写入量：自上次备份以来的写入计数达到 BACKUP_WRITE_THRESHOLD；
+- 空闲：有未备份的写入，且距最后一次写入已超过 BACKUP_IDLE_SECONDS（导入等突发写入结束后尽快备份）；
+- 定时：距上次备份超过 BACKUP_INTERVAL_SECONDS（加 0~BACKUP_JITTER_SECONDS 的随机抖动），
+  兜底覆盖绕过应用的写入。
+每 BACKUP_POLL_SECONDS 只读取一条写入计数记录，空闲时不计算哈希。备份失败按指数退避重试
+（上限 BACKUP_MAX_BACKOFF_SECONDS）；维护租约被其他进程持有时推迟一分钟再试，多个调度器不会重复备份。运行状态（上次/下次备份、待备份写入数）原子写入
+data/backup_scheduler.json，Web 备份页与 --status 据此展示。
+"""
+import json
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+from bill_tracker.paths import get_scheduler_state_path
+
+BACKUP_INTERVAL_SECONDS = float(os.getenv('BACKUP_INTERVAL_SECONDS', '86400'))
+BACKUP_WRITE_THRESHOLD = int(os.getenv('BACKUP_WRITE_THRESHOLD', '500'))
+BACKUP_IDLE_SECONDS = float(os.getenv('BACKUP_IDLE_SECONDS', '300'))
+BACKUP_JITTER_SECONDS = float(os.getenv('BACKUP_JITTER_SECONDS', '300'))
+BACKUP_POLL_SECONDS = float(os.getenv('BACKUP_POLL_SECONDS', '30'))
+BACKUP_MAX_BACKOFF_SECONDS = float(os.getenv('BACKUP_MAX_BACKOFF_SECONDS', '3600'))
+# 第一次失败后的重试间隔，之后每次翻倍
+BACKUP_RETRY_SECONDS = 60
+
+TRIGGER_STARTUP = 'startup'
+TRIGGER_WRITES = 'writes'
+TRIGGER_IDLE = 'idle'
+TRIGGER_INTERVAL = 'interval'
+TRIGGER_RETRY = 'retry'
+
+
+def load_scheduler_state(path=None):
+    """读取调度器状态；不存在或损坏时返回 None"""
+    try:
+        with open(path or get_scheduler_state_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _parse(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class BackupScheduler:
+    """
+    常驻备份调度器（时间均为 UTC）
+
+    用法：BackupScheduler(BillDatabase()).run()；stop() 可从其他线程或信号处理中结束循环。
+    """
+
+    def __init__(self, database, interval_seconds=None, write_threshold=None, idle_seconds=None,
+                 jitter_seconds=None, poll_seconds=None, max_backoff_seconds=None, state_path=None):
+        """
+        :param database: BillDatabase（整个进程复用这一个连接）
+        :param state_path: 状态文件路径，默认 data/backup_scheduler.json
+        """
+        self.database = database
+        self.interval = BACKUP_INTERVAL_SECONDS if interval_seconds is None else interval_seconds
+        self.write_threshold = BACKUP_WRITE_THRESHOLD if write_threshold is None else write_threshold
+        self.idle = BACKUP_IDLE_SECONDS if idle_seconds is None else idle_seconds
+        self.jitter = BACKUP_JITTER_SECONDS if jitter_seconds is None else jitter_seconds
+        self.poll = BACKUP_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.max_backoff = BACKUP_MAX_BACKOFF_SECONDS if max_backoff_seconds is None else max_backoff_seconds
+        self.state_path = state_path or get_scheduler_state_path()
+        self._stop = threading.Event()
+        self._saved = None
+
+        # 重启后沿用上次的写入基线与定时；没有状态时启动即备份一次
+        previous = load_scheduler_state(self.state_path) or {}
+        last_success = _parse(previous.get('last_success_at'))
+        self.state = {
+            'status': 'waiting',
+            'pid': os.getpid(),
+            'started_at': _iso(datetime.utcnow()),
+            'writes_at_last_backup': previous.get('writes_at_last_backup'),
+            'pending_writes': 0,
+            'last_write_at': None,
+            'last_success_at': _iso(last_success),
+            'last_run': previous.get('last_run'),
+            'next_run': None,
+            'failures': 0,
+            'config': {
+                'interval_seconds': self.interval,
+                'write_threshold': self.write_threshold,
+                'idle_seconds': self.idle,
+                'jitter_seconds': self.jitter,
+                'poll_seconds': self.poll,
+            },
+        }
+        self.timer_due = self._next_timer(last_success) if last_success else None
+        self.retry_at = None
+
+    def _next_timer(self, since):
+        return since + timedelta(seconds=self.interval + random.uniform(0, self.jitter))
+
+    def _save(self):
+        """状态有变化时原子重写状态文件"""
+        data = json.dumps(self.state, ensure_ascii=False, sort_keys=True, default=str)
+        if data == self._saved:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.state_path)
+        self._saved = data
+
+    def _trigger(self, now, pending, last_write_at):
+        """本轮是否备份：返回触发原因或 None"""
+        if self.retry_at:
+            return TRIGGER_RETRY if now >= self.retry_at else None
+        if self.timer_due is None:
+            return TRIGGER_STARTUP
+        if pending >= self.write_threshold:
+            return TRIGGER_WRITES
+        if pending and last_write_at and now - last_write_at >= timedelta(seconds=self.idle):
+            return TRIGGER_IDLE
+        if now >= self.timer_due:
+            return TRIGGER_INTERVAL
+        return None
+
+    def _next_run(self, pending, last_write_at):
+        """下次备份的预计时间与原因（写入量触发无法预知时间，只给出定时与空闲触发）"""
+        if self.retry_at:
+            return {'due_at': _iso(self.retry_at), 'reason': TRIGGER_RETRY}
+        if self.timer_due is None:
+            return {'due_at': None, 'reason': TRIGGER_STARTUP}
+        due, reason = self.timer_due, TRIGGER_INTERVAL
+        if pending and last_write_at:
+            idle_due = last_write_at + timedelta(seconds=self.idle)
+            if idle_due < due:
+                due, reason = idle_due, TRIGGER_IDLE
+        return {
+            'due_at': _iso(due),
+            'reason': reason,
+            'writes_until_threshold': max(self.write_threshold - pending, 0),
+        }
+
+    def _run_backup(self, trigger, writes):
+        started = datetime.utcnow()
+        self.state['status'] = 'running'
+        self.state['last_run'] = {'trigger': trigger, 'started_at': _iso(started)}
+        self._save()
+        logger.info(f"调度备份开始（触发: {trigger}，待备份写入 {self.state['pending_writes']}）")
+        try:
+            result = self.database.backup_all_data(force=False)
+        except Exception as e:
+            result = {'success': False, 'message': str(e)}
+        finished = datetime.utcnow()
+        self.state['last_run'].update({
+            'finished_at': _iso(finished),
+            'duration_seconds': round((finished - started).total_seconds(), 3),
+            'success': bool(result.get('success')),
+            'skipped': bool(result.get('skipped')),
+            'message': result.get('message'),
+            'backup_path': result.get('backup_path'),
+            'backup_kind': result.get('backup_kind'),
+        })
+        if result.get('busy'):
+            # 其他进程正在备份或恢复：不计为失败，稍后重试（届时数据无变化会直接跳过）
+            self.state['status'] = 'waiting'
+            self.retry_at = finished + timedelta(seconds=BACKUP_RETRY_SECONDS * random.uniform(1, 1.2))
+            logger.info(f"调度备份推迟: {result.get('message')}")
+        elif result.get('success'):
+            # 备份开始前读到的写入均已包含在内；备份期间的写入留给下一轮
+            self.state['writes_at_last_backup'] = writes
+            self.state['last_success_at'] = _iso(finished)
+            self.state['failures'] = 0
+            self.state['status'] = 'waiting'
+            self.timer_due = self._next_timer(finished)
+            self.retry_at = None
+            logger.info(f"调度备份完成: {result.get('message')}")
+        else:
+            self.state['failures'] += 1
+            self.state['status'] = 'backoff'
+            delay = min(BACKUP_RETRY_SECONDS * 2 ** (self.state['failures'] - 1), self.max_backoff)
+            self.retry_at = finished + timedelta(seconds=delay * random.uniform(1, 1.2))
+            logger.error(f"调度备份失败（第 {self.state['failures']} 次）: {result.get('message')}，{delay:.0f}s 后重试")
+
+    def tick(self, now=None):
+        """
+        轮询一次：读取写入计数，满足条件时执行备份
+
+        :return: 本轮的触发原因，未备份时为 None
+        """
+        now = now or datetime.utcnow()
+        try:
+            counter = self.database.write_counter.read()
+        except Exception as e:
+            logger.warning(f"读取写入计数失败: {e}")
+            counter = None
+        if counter is not None:
+            writes = counter['count']
+            baseline = self.state['writes_at_last_backup']
+            if baseline is None or writes < baseline:
+                # 首次运行或计数被重置：以当前计数为基线，由启动/定时备份兜底
+                baseline = self.state['writes_at_last_backup'] = writes
+            pending = writes - baseline
+            last_write_at = counter['last_write_at']
+        else:
+            writes, pending, last_write_at = None, 0, None
+        self.state['pending_writes'] = pending
+        self.state['last_write_at'] = _iso(last_write_at)
+
+        trigger = self._trigger(now, pending, last_write_at)
+        if trigger:
+            self._run_backup(trigger, self.state['writes_at_last_backup'] if writes is None else writes)
+            if self.state['status'] == 'waiting':
+                self.state['pending_writes'] = 0
+        self.state['next_run'] = self._next_run(self.state['pending_writes'], last_write_at)
+        self._save()
+        return trigger
+
+    def run(self):
+        """循环轮询直到 stop()"""
+        logger.info(
+            f"备份调度器启动: 定时 {self.interval:.0f}s、写入 {self.write_threshold} 次、"
+            f"空闲 {self.idle:.0f}s、轮询 {self.poll:.0f}s"
+        )
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(self.poll)
+        self.state['status'] = 'stopped'
+        self.state['next_run'] = None
+        self._save()
+        logger.info("备份调度器已停止")
+
+    def stop(self):
+        self._stop.set()
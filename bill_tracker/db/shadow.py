@@ -0,0 +1,184 @@
+"""
+恢复前的服务端安全副本（影子集合）
+
+恢复前把将被改写的集合在服务端用 $out 复制为 pre_restore__<编号>__<集合名>，
+数据不经过 Python，耗时只是一次服务端集合复制。副本登记在 pre_restore_shadows 中，
+超过保留时长（PRE_RESTORE_SHADOW_TTL_HOURS）后由 expire_shadows 删除；
+可一键回滚（复制到暂存集合后原子替换现网集合），需要离线保存时再按需导出为快照文件。
+"""
+import os
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+from bill_tracker.db.backup_io import BACKUP_KIND_FULL, backup_writer
+from bill_tracker.db.staging import staging_name, swap_in
+
+SHADOW_PREFIX = 'pre_restore__'
+SHADOW_REGISTRY = 'pre_restore_shadows'
+# 影子副本保留时长（小时），过期后在下次创建副本或查看列表时删除
+PRE_RESTORE_SHADOW_TTL_HOURS = float(os.getenv('PRE_RESTORE_SHADOW_TTL_HOURS', '72'))
+
+
+def shadow_collection_name(shadow_id, collection_name):
+    return f'{SHADOW_PREFIX}{shadow_id}__{collection_name}'
+
+
+def is_shadow(collection_name):
+    """影子副本集合及其登记集合（不参与哈希与备份）"""
+    return collection_name.startswith(SHADOW_PREFIX) or collection_name == SHADOW_REGISTRY
+
+
+def _new_shadow_id(db):
+    base = datetime.now().strftime('%Y%m%d_%H%M%S')
+    shadow_id, n = base, 1
+    while db[SHADOW_REGISTRY].count_documents({'_id': shadow_id}, limit=1):
+        n += 1
+        shadow_id = f'{base}_{n}'
+    return shadow_id
+
+
+def create_shadow(db, collection_names, ttl_hours=None, reason=None):
+    """
+    服务端复制一组集合为影子副本
+
+    先登记（complete=False）再复制，复制中断留下的集合可被 expire_shadows 识别并清理。
+
+    :param collection_names: 需要保护的集合；现网不存在的集合记为 None，回滚时删除
+    :param ttl_hours: 保留时长，默认 PRE_RESTORE_SHADOW_TTL_HOURS
+    :param reason: 登记说明（如恢复的快照文件名）
+    :return: 登记记录 {'_id', 'created_at', 'expires_at', 'collections': {集合名: 条数或 None}, ...}
+    """
+    registry = db[SHADOW_REGISTRY]
+    shadow_id = _new_shadow_id(db)
+    now = datetime.utcnow()
+    record = {
+        '_id': shadow_id,
+        'created_at': now,
+        'expires_at': now + timedelta(hours=PRE_RESTORE_SHADOW_TTL_HOURS if ttl_hours is None else ttl_hours),
+        'reason': reason,
+        'collections': {},
+        'complete': False,
+    }
+    registry.insert_one(record)
+
+    existing = set(db.list_collection_names())
+    for name in collection_names:
+        if name not in existing:
+            record['collections'][name] = None
+            continue
+        target = shadow_collection_name(shadow_id, name)
+        db[name].aggregate([{'$out': target}])
+        record['collections'][name] = db[target].count_documents({})
+    record['complete'] = True
+    registry.update_one(
+        {'_id': shadow_id},
+        {'$set': {'collections': record['collections'], 'complete': True}},
+    )
+    logger.info(f"恢复前影子副本 {shadow_id}: {record['collections']}")
+    return record
+
+
+def list_shadows(db):
+    """已完成的影子副本登记记录（新的在前）"""
+    return list(db[SHADOW_REGISTRY].find({'complete': True}).sort('_id', -1))
+
+
+def get_shadow(db, shadow_id):
+    record = db[SHADOW_REGISTRY].find_one({'_id': shadow_id})
+    if not record or not record.get('complete'):
+        raise ValueError(f'影子副本不存在或未完成: {shadow_id}')
+    return record
+
+
+def drop_shadow(db, shadow_id):
+    """删除一份影子副本（含未完成的）"""
+    prefix = shadow_collection_name(shadow_id, '')
+    for name in db.list_collection_names():
+        if name.startswith(prefix):
+            db.drop_collection(name)
+    db[SHADOW_REGISTRY].delete_one({'_id': shadow_id})
+
+
+def expire_shadows(db, now=None):
+    """
+    删除过期的影子副本，以及没有登记记录的遗留影子集合
+
+    :return: 删除的副本编号列表
+    """
+    now = now or datetime.utcnow()
+    registry = db[SHADOW_REGISTRY]
+    expired = [record['_id'] for record in registry.find({'expires_at': {'$lte': now}}, {'_id': 1})]
+    for shadow_id in expired:
+        drop_shadow(db, shadow_id)
+
+    known = {record['_id'] for record in registry.find({}, {'_id': 1})}
+    for name in db.list_collection_names():
+        if not name.startswith(SHADOW_PREFIX):
+            continue
+        shadow_id = name[len(SHADOW_PREFIX):].split('__', 1)[0]
+        if shadow_id not in known:
+            db.drop_collection(name)
+            if shadow_id not in expired:
+                expired.append(shadow_id)
+    if expired:
+        logger.info(f"已删除过期的影子副本: {expired}")
+    return expired
+
+
+def rollback_to_shadow(db, shadow_id):
+    """
+    用影子副本替换现网集合
+
+    每个集合先在服务端复制到暂存集合，校验条数后原子替换；副本本身保留，可重复回滚。
+    创建副本时不存在的集合直接删除。
+
+    :return: {集合名: 回滚后的条数}
+    """
+    record = get_shadow(db, shadow_id)
+    restored = {}
+    for name, count in record['collections'].items():
+        if count is None:
+            db.drop_collection(name)
+            restored[name] = 0
+            continue
+        staging = staging_name(name)
+        db.drop_collection(staging)
+        db[shadow_collection_name(shadow_id, name)].aggregate([{'$out': staging}])
+        if staging not in db.list_collection_names():
+            db.create_collection(staging)
+        actual = db[staging].count_documents({})
+        if actual != count:
+            db.drop_collection(staging)
+            raise ValueError(f'影子副本 {shadow_id} 的集合 {name} 条数校验失败: 期望 {count}，实际 {actual}')
+        restored[name] = swap_in(db, name)
+    logger.info(f"已回滚到影子副本 {shadow_id}: {restored}")
+    return restored
+
+
+def export_shadow(db, shadow_id, backup_path, backup_info):
+    """
+    把影子副本导出为全量快照文件（与 pre_restore 快照格式相同，按原集合名写出）
+
+    :param backup_info: 调用方提供的元数据（database_name、version 等），其余字段在此补充
+    :return: 导出文件的 backup_info
+    """
+    record = get_shadow(db, shadow_id)
+    with backup_writer(backup_path, backup_info['database_name']) as writer:
+        for name, count in record['collections'].items():
+            if count is None:
+                continue
+            writer.write_collection(
+                name, db[shadow_collection_name(shadow_id, name)], track_dates=name == 'bills'
+            )
+        return writer.finish(dict(
+            backup_info,
+            timestamp=shadow_id,
+            # 编号即创建时的本地时间
+            backup_time=datetime.strptime(shadow_id[:15], '%Y%m%d_%H%M%S').isoformat(),
+            type='pre_restore',
+            backup_kind=BACKUP_KIND_FULL,
+            base=os.path.basename(backup_path),
+            chain_length=0,
+            shadow_id=shadow_id,
+        ))
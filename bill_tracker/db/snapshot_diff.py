@@ -0,0 +1,159 @@
+"""
+快照对比
+
+两份快照（任意格式；增量快照按整条链还原）按 _id 归并，逐条产出新增、删除与修改的文档，
+同时按 年份 × 分类 汇总条数与金额（分）的变化。两侧都是顺序流式读取，
+内存只与块大小和汇总维度有关，可对比远大于内存的快照，不需要连接数据库。
+账单集合包含快照中的归档集合与其引用的年度归档导出（与只读降级载入快照时一致），
+归档前后的两份快照之间不会把归档年份误报为删除。
+"""
+import heapq
+import os
+from contextlib import ExitStack
+
+from bill_tracker.db.archive import ARCHIVE_COLLECTION_PREFIX, archive_collection_name, export_path_for
+from bill_tracker.db.backup_io import backup_chain, open_backup, restored_document
+from bill_tracker.db.merkle import document_digest, is_partitioned
+from bill_tracker.db.restore_diff import chain_documents, changed_fields, id_sort_key
+from bill_tracker.money import bill_amount_cents
+
+CHANGE_ADDED = 'added'
+CHANGE_REMOVED = 'removed'
+CHANGE_MODIFIED = 'modified'
+
+
+def _bill_year(doc):
+    bill_date = doc.get('bill_date')
+    return str(bill_date)[:4] if bill_date else '-'
+
+
+class SnapshotDiff:
+    """
+    两份快照之间某集合的差异
+
+    用法：for change in diff.changes(): ...，遍历结束后 summary / aggregates 即为汇总结果。
+    """
+
+    def __init__(self, old_path, new_path, collection='bills', years=None):
+        """
+        :param old_path: 较早的快照
+        :param new_path: 较新的快照
+        :param collection: 对比的集合
+        :param years: 只对比这些年份（bill_date 前 4 位，仅账单集合）
+        """
+        self.old_path = old_path
+        self.new_path = new_path
+        self.collection = collection
+        self.years = sorted({str(y) for y in years}) if years and is_partitioned(collection) else None
+        self.summary = {CHANGE_ADDED: 0, CHANGE_REMOVED: 0, CHANGE_MODIFIED: 0, 'unchanged': 0}
+        # {(年份, 分类): {'count': 条数变化, 'amount_cents': 金额变化}}
+        self.aggregates = {}
+
+    def _aggregate(self, doc, sign):
+        key = (_bill_year(doc), doc.get('category') or '-')
+        delta = self.aggregates.setdefault(key, {'count': 0, 'amount_cents': 0})
+        delta['count'] += sign
+        try:
+            delta['amount_cents'] += sign * bill_amount_cents(doc)
+        except (TypeError, ValueError):
+            pass
+
+    def _year_wanted(self, year):
+        return self.years is None or str(year) in self.years
+
+    def _streams(self, stack, path):
+        """某快照中构成该集合的各个 _id 有序文档流"""
+        readers = [stack.enter_context(open_backup(p)) for p in backup_chain(path)]
+        streams = [chain_documents(readers, self.collection, self.years, normalize=restored_document)]
+        if self.collection != 'bills':
+            return streams
+        # 未冻结的归档集合在快照内；冻结年份只在 backup_info.archived_years 中引用年度导出
+        archive_names = sorted({
+            name for reader in readers for name in reader.collection_names()
+            if name.startswith(ARCHIVE_COLLECTION_PREFIX)
+        })
+        for name in archive_names:
+            if self._year_wanted(name[len(ARCHIVE_COLLECTION_PREFIX):]):
+                streams.append(chain_documents(readers, name, self.years, normalize=restored_document))
+        for year, info in sorted((readers[-1].info.get('archived_years') or {}).items()):
+            if not self._year_wanted(year):
+                continue
+            export_path = export_path_for(info)
+            if not export_path or not os.path.exists(export_path):
+                raise ValueError(f"缺少 {year} 年的归档导出 {info.get('export_file')}，无法对比")
+            export = stack.enter_context(open_backup(export_path))
+            name = info.get('collection') or archive_collection_name(year)
+            streams.append(chain_documents([export], name, self.years, normalize=restored_document))
+        return streams
+
+    def _documents(self, stack, path):
+        keyed = [((id_sort_key(doc['_id']), doc) for doc in stream) for stream in self._streams(stack, path)]
+        yield from heapq.merge(*keyed, key=lambda item: item[0])
+
+    def changes(self):
+        """
+        逐条产出变化（按 _id 升序）
+
+        :return: 生成器，元素为 {'change', '_id', 'old', 'new', 'fields'}（fields 仅修改时有）
+        """
+        with ExitStack() as stack:
+            old_docs = self._documents(stack, self.old_path)
+            new_docs = self._documents(stack, self.new_path)
+            old = next(old_docs, None)
+            new = next(new_docs, None)
+            while old is not None or new is not None:
+                if new is None or (old is not None and old[0] < new[0]):
+                    self.summary[CHANGE_REMOVED] += 1
+                    self._aggregate(old[1], -1)
+                    yield {'change': CHANGE_REMOVED, '_id': str(old[1]['_id']), 'old': old[1], 'new': None}
+                    old = next(old_docs, None)
+                elif old is None or new[0] < old[0]:
+                    self.summary[CHANGE_ADDED] += 1
+                    self._aggregate(new[1], 1)
+                    yield {'change': CHANGE_ADDED, '_id': str(new[1]['_id']), 'old': None, 'new': new[1]}
+                    new = next(new_docs, None)
+                else:
+                    if document_digest(old[1]) == document_digest(new[1]):
+                        self.summary['unchanged'] += 1
+                    else:
+                        self.summary[CHANGE_MODIFIED] += 1
+                        self._aggregate(old[1], -1)
+                        self._aggregate(new[1], 1)
+                        yield {
+                            'change': CHANGE_MODIFIED,
+                            '_id': str(new[1]['_id']),
+                            'old': old[1],
+                            'new': new[1],
+                            'fields': changed_fields(old[1], new[1]),
+                        }
+                    old = next(old_docs, None)
+                    new = next(new_docs, None)
+
+    def aggregate_rows(self):
+        """非零的汇总变化，按年份、分类排序：[{'year', 'category', 'count', 'amount_cents'}]"""
+        return [
+            {'year': year, 'category': category, **delta}
+            for (year, category), delta in sorted(self.aggregates.items())
+            if delta['count'] or delta['amount_cents']
+        ]
+
+
+def diff_snapshots(old_path, new_path, collection='bills', years=None, sample_size=20):
+    """
+    对比两份快照，返回汇总与每类变化的前若干条样例
+
+    :return: {'success', 'summary', 'aggregates', 'samples': {变化类型: [...]}}
+    """
+    diff = SnapshotDiff(old_path, new_path, collection, years)
+    samples = {CHANGE_ADDED: [], CHANGE_REMOVED: [], CHANGE_MODIFIED: []}
+    for change in diff.changes():
+        bucket = samples[change['change']]
+        if len(bucket) < sample_size:
+            bucket.append(change)
+    return {
+        'success': True,
+        'collection': collection,
+        'summary': diff.summary,
+        'aggregates': diff.aggregate_rows(),
+        'samples': samples,
+    }
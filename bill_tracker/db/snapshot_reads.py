@@ -0,0 +1,184 @@
+"""
+备份的时间点一致性读取（快照读会话）
+
+备份在一个 snapshot=True 的会话内完成全部读取：分区摘要、水位、归档元数据与各集合文档
+都读取会话第一次读取时的同一集群时间点，数据哈希与快照内容一致，导入途中备份也不会得到
+「一半新一半旧」的状态。快照读依赖 WiredTiger 的多版本读取，不加锁，并发写入不受影响。
+
+限制：
+- 需要副本集或分片集群（单节点副本集即可）、MongoDB 5.0+；独立部署（standalone）不支持，
+  BACKUP_SNAPSHOT_READS=auto 时退回普通读取并在 backup_info 中记录 snapshot_read=False。
+- 服务端只保留 minSnapshotHistoryWindowInSeconds（默认 300 秒）内的历史版本，
+  单次备份读取超过该时长会报 SnapshotTooOld，需要调大该参数；保留历史会增加写入繁忙时的缓存占用。
+- 快照会话本身即单一时间点，不再另开因果一致性（pymongo 中二者互斥）。
+- 会话不能被多个线程同时使用：并行读取的每个线程各开一个快照会话，固定在主会话的
+  atClusterTime，读取互不串行。
+- 不支持快照读而退回普通读取时，consistent_reads 产出的句柄带 snapshot_fallback 原因，
+  备份结果与 backup_info 中都会记录，不只是日志提示。
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from loguru import logger
+
+# auto：支持时使用快照读，否则退回普通读取；on：不支持时备份失败；off：不使用
+BACKUP_SNAPSHOT_READS = os.getenv('BACKUP_SNAPSHOT_READS', 'auto').lower()
+# 快照读要求的最低 wire 版本（MongoDB 5.0）
+SNAPSHOT_MIN_WIRE_VERSION = 13
+# 主会话尚未读取时用于确定快照时间点的空读取（集合不存在也会返回 atClusterTime）
+SNAPSHOT_PIN_COLLECTION = 'backup_digests'
+_warned = set()
+
+
+def snapshot_reads_supported(client):
+    """
+    部署是否支持快照读
+
+    :return: (是否支持, 不支持的原因)
+    """
+    try:
+        hello = client.admin.command('hello')
+    except Exception as e:
+        return False, f'无法获取部署信息: {e}'
+    if not (hello.get('setName') or hello.get('msg') == 'isdbgrid'):
+        return False, '独立部署（standalone）不支持快照读，需要副本集（单节点即可）'
+    if hello.get('maxWireVersion', 0) < SNAPSHOT_MIN_WIRE_VERSION:
+        return False, '快照读需要 MongoDB 5.0+'
+    return True, None
+
+
+class SnapshotCollection:
+    """读取走快照会话的集合句柄；写入等其余操作直接交给原集合（不在快照内）"""
+
+    def __init__(self, collection, snapshot_db):
+        self._collection = collection
+        self._snapshot_db = snapshot_db
+
+    @property
+    def _session(self):
+        return self._snapshot_db.thread_session()
+
+    def find(self, *args, **kwargs):
+        return self._collection.find(*args, session=self._session, **kwargs)
+
+    def find_one(self, *args, **kwargs):
+        return self._collection.find_one(*args, session=self._session, **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return self._collection.aggregate(pipeline, session=self._session, **kwargs)
+
+    def count_documents(self, query, **kwargs):
+        return self._collection.count_documents(query, session=self._session, **kwargs)
+
+    def distinct(self, key, *args, **kwargs):
+        return self._collection.distinct(key, *args, session=self._session, **kwargs)
+
+    def estimated_document_count(self, **kwargs):
+        # count 命令不支持快照读；估算条数只用于选择读取方式等启发式判断，
+        # 直接读集合元数据（不在快照内），避免退化为整集合扫描
+        return self._collection.estimated_document_count(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class SnapshotDatabase:
+    """
+    读取走快照会话的库句柄，用法与 pymongo Database 相同（db[集合名]）
+
+    创建它的线程使用 session；其他线程（并行备份的读取线程）各自开一个快照会话，
+    固定在 session 第一次读取确定的 atClusterTime，读到同一时间点且互不加锁。
+    """
+
+    def __init__(self, db, session):
+        self._db = db
+        self.session = session
+        self._owner = threading.get_ident()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread_sessions = []
+
+    def __getitem__(self, name):
+        return SnapshotCollection(self._db[name], self)
+
+    def _pin_time(self):
+        """主会话的快照时间点；尚未读取过时先做一次空读取确定"""
+        with self._lock:
+            if self.session._snapshot_time is None:
+                self._db[SNAPSHOT_PIN_COLLECTION].find_one({}, session=self.session)
+            return self.session._snapshot_time
+
+    def thread_session(self):
+        """当前线程使用的快照会话"""
+        if threading.get_ident() == self._owner:
+            return self.session
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            at_cluster_time = self._pin_time()
+            session = self._db.client.start_session(snapshot=True)
+            # pymongo 没有公开指定快照时间点的接口：写入会话首个读取前的 _snapshot_time，
+            # 之后的读取都带上 readConcern.atClusterTime，与主会话读到同一时间点
+            session._snapshot_time = at_cluster_time
+            self._local.session = session
+            with self._lock:
+                self._thread_sessions.append(session)
+        return session
+
+    def end_thread_sessions(self):
+        with self._lock:
+            sessions, self._thread_sessions = self._thread_sessions, []
+        for session in sessions:
+            session.end_session()
+
+    def cluster_time(self):
+        """快照的集群时间（第一次读取后确定），格式 秒.序号"""
+        ts = self.session.operation_time
+        return f'{ts.time}.{ts.inc}' if ts is not None else None
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+@contextmanager
+def consistent_reads(db, mode=None):
+    """
+    在快照读会话内读取 db（不支持时按 mode 退回普通读取）
+
+    :param mode: auto | on | off，默认 BACKUP_SNAPSHOT_READS
+    :return: 上下文值为库句柄：SnapshotDatabase，或退回时的 Database 副本（原因见 snapshot_fallback_reason）
+    """
+    mode = (mode or BACKUP_SNAPSHOT_READS).lower()
+    if mode == 'off':
+        yield _fallback(db, '已关闭（BACKUP_SNAPSHOT_READS=off）')
+        return
+    supported, reason = snapshot_reads_supported(db.client)
+    if not supported:
+        if mode == 'on':
+            raise RuntimeError(f'无法使用快照读: {reason}')
+        if reason not in _warned:
+            _warned.add(reason)
+            logger.warning(f"备份未使用快照读（{reason}），读取期间的并发写入可能使快照不一致")
+        yield _fallback(db, reason)
+        return
+    with db.client.start_session(snapshot=True) as session:
+        snapshot_db = SnapshotDatabase(db, session)
+        try:
+            yield snapshot_db
+        finally:
+            snapshot_db.end_thread_sessions()
+
+
+def _fallback(db, reason):
+    """退回普通读取的库句柄：复制一份再记下原因，不改动调用方共用的 Database"""
+    fallback = db.with_options()
+    fallback.snapshot_fallback = reason
+    return fallback
+
+
+def snapshot_fallback_reason(db):
+    """consistent_reads 产出的句柄未使用快照读的原因；使用了快照读时为 None"""
+    if isinstance(db, SnapshotDatabase):
+        return None
+    return getattr(db, 'snapshot_fallback', None) or '未使用快照读'
+
@@ -0,0 +1,68 @@
+"""
+恢复暂存集合
+
+替换式恢复（bills_only / full_replace）先把数据写入 <集合名>__restore_staging，
+在暂存集合上建好与现网集合相同的索引、校验条数后，用 renameCollection(dropTarget=True)
+原子替换现网集合：读者只会看到恢复前或恢复后的完整数据，现网集合也不会被长时间的删除锁住。
+"""
+from loguru import logger
+
+STAGING_SUFFIX = '__restore_staging'
+
+
+def staging_name(collection_name):
+    return f'{collection_name}{STAGING_SUFFIX}'
+
+
+def is_staging(collection_name):
+    return collection_name.endswith(STAGING_SUFFIX)
+
+
+def drop_staging_collections(db):
+    """删除遗留的暂存集合（中断后放弃的恢复）"""
+    dropped = [name for name in db.list_collection_names() if is_staging(name)]
+    for name in dropped:
+        db.drop_collection(name)
+    if dropped:
+        logger.info(f"已删除遗留的恢复暂存集合: {dropped}")
+    return dropped
+
+
+def prepare_staging(db, collection_name, keep_filter=None):
+    """
+    新建（清空）暂存集合
+
+    :param keep_filter: 需要保留的现网文档（如按年恢复时其余年份），服务端 $out 复制到暂存集合
+    :return: 复制的条数
+    """
+    name = staging_name(collection_name)
+    db.drop_collection(name)
+    if keep_filter is not None:
+        db[collection_name].aggregate([{'$match': keep_filter}, {'$out': name}])
+    if name not in db.list_collection_names():
+        db.create_collection(name)
+    return db[name].count_documents({}) if keep_filter is not None else 0
+
+
+def copy_indexes(source, target):
+    """按现网集合的索引定义在暂存集合上建索引（数据写入后一次性构建）"""
+    for spec in source.list_indexes():
+        if spec['name'] == '_id_':
+            continue
+        options = {k: v for k, v in spec.items() if k not in ('key', 'v', 'ns')}
+        target.create_index(list(spec['key'].items()), **options)
+
+
+def swap_in(db, collection_name):
+    """
+    建索引后将暂存集合原子替换为现网集合
+
+    :return: 替换后的条数
+    """
+    staging = db[staging_name(collection_name)]
+    if collection_name in db.list_collection_names():
+        copy_indexes(db[collection_name], staging)
+    count = staging.count_documents({})
+    staging.rename(collection_name, dropTarget=True)
+    logger.info(f"暂存集合已替换为 {collection_name}: {count} 条")
+    return count
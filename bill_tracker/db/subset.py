@@ -0,0 +1,74 @@
+"""
+局部恢复的账单筛选条件
+
+同一组条件既生成现网查询（bill_date 为 YYYYMMDD 字符串，区间比较可走 bill_date 索引），
+也在流式读取快照时逐条判断；给定日期区间时只读取区间涉及年份的分区文件。
+"""
+
+
+class BillSubset:
+    """按 bill_date 区间、分类与类型筛选账单"""
+
+    def __init__(self, date_from=None, date_to=None, categories=None, bill_type=None):
+        """
+        :param date_from: 起始日期 YYYYMMDD（含）
+        :param date_to: 结束日期 YYYYMMDD（含）
+        :param categories: 分类列表
+        :param bill_type: 账单类型
+        """
+        self.date_from = str(date_from) if date_from else None
+        self.date_to = str(date_to) if date_to else None
+        self.categories = [c for c in (categories or []) if isinstance(c, str) and c.strip()] or None
+        self.bill_type = bill_type or None
+        if self.date_from and self.date_to and self.date_from > self.date_to:
+            raise ValueError(f'日期区间无效: {self.date_from} ~ {self.date_to}')
+
+    @property
+    def is_empty(self):
+        return not (self.date_from or self.date_to or self.categories or self.bill_type)
+
+    def query(self):
+        """现网查询条件"""
+        query = {}
+        if self.date_from or self.date_to:
+            bounds = {}
+            if self.date_from:
+                bounds['$gte'] = self.date_from
+            if self.date_to:
+                bounds['$lte'] = self.date_to
+            query['bill_date'] = bounds
+        if self.categories:
+            query['category'] = {'$in': self.categories}
+        if self.bill_type:
+            query['type'] = self.bill_type
+        return query
+
+    def matches(self, doc):
+        """快照文档是否满足条件（与 query 语义一致）"""
+        if self.date_from or self.date_to:
+            bill_date = doc.get('bill_date')
+            if not isinstance(bill_date, str):
+                return False
+            if self.date_from and bill_date < self.date_from:
+                return False
+            if self.date_to and bill_date > self.date_to:
+                return False
+        if self.categories and doc.get('category') not in self.categories:
+            return False
+        if self.bill_type and doc.get('type') != self.bill_type:
+            return False
+        return True
+
+    def years(self):
+        """日期区间涉及的年份（只读取这些年份的分区）；区间不完整时返回 None"""
+        if not (self.date_from and self.date_to):
+            return None
+        return [str(y) for y in range(int(self.date_from[:4]), int(self.date_to[:4]) + 1)]
+
+    def as_dict(self):
+        return {
+            'date_from': self.date_from,
+            'date_to': self.date_to,
+            'categories': self.categories,
+            'bill_type': self.bill_type,
+        }
@@ -0,0 +1,27 @@
+"""
+写入计数器：应用每次写入（录入、删除、导入、改密、恢复）累加一个全局计数与最后写入时间，
+备份调度器只需轮询这一条记录即可判断自上次备份以来的写入量，空闲时不必计算数据哈希。
+"""
+from datetime import datetime
+
+WRITE_COUNTER_COLLECTION = 'backup_write_counter'
+_COUNTER_ID = 'writes'
+
+
+class WriteCounter:
+    """backup_write_counter 集合中的单条计数记录"""
+
+    def __init__(self, db):
+        self.collection = db[WRITE_COUNTER_COLLECTION]
+
+    def add(self, n=1):
+        self.collection.update_one(
+            {'_id': _COUNTER_ID},
+            {'$inc': {'count': n}, '$set': {'last_write_at': datetime.utcnow()}},
+            upsert=True,
+        )
+
+    def read(self):
+        """:return: {'count', 'last_write_at'}（尚无写入时为 0 / None）"""
+        doc = self.collection.find_one({'_id': _COUNTER_ID}) or {}
+        return {'count': doc.get('count', 0), 'last_write_at': doc.get('last_write_at')}
@@ -11,6 +11,7 @@ from datetime import datetime
 from bill_tracker.db import BillDatabase
 from loguru import logger
 from bill_tracker.classification import UniversalBillClassifier
+from bill_tracker.money import to_cents
 
 
 class AlipayBillProcessor:
@@ -51,7 +52,7 @@ class AlipayBillProcessor:
                 bill_data = {
                     'bill_date': bill_date,
                     'type': '支出',
-                    'amount': -float(row['订单金额(元)']),  # 支出为负数
+                    'amount_cents': -to_cents(row['订单金额(元)']),  # 支出为负数（单位：分）
                     'remark': str(row['商品名称']),
                     'create_time': datetime.now()
                 }
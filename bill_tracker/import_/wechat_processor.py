@@ -2,6 +2,7 @@ import pandas as pd
 from datetime import datetime
 from loguru import logger
 from bill_tracker.classification import UniversalBillClassifier
+from bill_tracker.money import to_cents
 
 
 class WeChatBillProcessor:
@@ -23,12 +24,11 @@ class WeChatBillProcessor:
             unclassified_count = 0
             
             for _, row in df.iterrows():
-                # 解析金额
-                amount_str = str(row['金额(元)']).replace('¥', '').replace(',', '')
+                # 解析金额（直接解析为整数分）
                 try:
-                    amount = float(amount_str)
+                    amount = to_cents(row['金额(元)'])
                 except ValueError:
-                    logger.warning(f"无法解析金额: {amount_str}")
+                    logger.warning(f"无法解析金额: {row['金额(元)']}")
                     continue
                 
                 # 根据收/支类型确定金额正负
@@ -64,7 +64,7 @@ class WeChatBillProcessor:
                     'bill_date': bill_date,
                     'type': bill_type,
                     'category': category or '未分类',
-                    'amount': amount,
+                    'amount_cents': amount,
                     'transaction_type': 'income' if bill_type == '收入' else 'expense',
                     'remark': f"微信-{row['交易对方']}-{row['商品']}",
                     # 'create_time': transaction_time
@@ -0,0 +1,100 @@
+"""金额工具：账单金额以整数分（int64）存储与汇总，只在展示时换算为元。"""
+import math
+import numbers
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+AMOUNT_FIELD = 'amount_cents'
+LEGACY_AMOUNT_FIELD = 'amount'
+CENTS_PER_YUAN = 100
+
+
+def to_cents(value):
+    """
+    将金额（元）精确转换为整数分
+
+    字符串按十进制直接解析（可带 ¥/￥ 和千分位逗号），浮点数先取最短十进制表示，
+    四舍五入到分，避免 0.1 + 0.2 式的二进制误差。
+
+    :param value: 金额（元），str / int / float / Decimal
+    :return: int 分
+    :raises ValueError: 无法解析或非有限数值
+    """
+    if value is None or isinstance(value, bool):
+        raise ValueError(f"无效金额: {value!r}")
+    if isinstance(value, numbers.Integral):
+        return int(value) * CENTS_PER_YUAN
+    if isinstance(value, Decimal):
+        amount = value
+    elif isinstance(value, numbers.Real):
+        if not math.isfinite(float(value)):
+            raise ValueError(f"无效金额: {value!r}")
+        amount = Decimal(repr(float(value)))
+    else:
+        text = str(value).strip().replace('¥', '').replace('￥', '').replace(',', '')
+        try:
+            amount = Decimal(text)
+        except InvalidOperation:
+            raise ValueError(f"无法解析金额: {value!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"无效金额: {value!r}")
+    return int((amount * CENTS_PER_YUAN).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def cents_to_yuan(cents):
+    """分 -> 元（float，仅用于图表等展示）"""
+    return cents / CENTS_PER_YUAN
+
+
+def format_yuan(cents, prefix='¥ ', thousands=True):
+    """
+    整数分格式化为金额字符串，如 -123456 -> '¥ -1,234.56'
+
+    :param cents: 分（int 或可转为 int 的数值）
+    :param prefix: 货币前缀
+    :param thousands: 是否使用千分位
+    """
+    cents = int(cents)
+    sign = '-' if cents < 0 else ''
+    yuan, fen = divmod(abs(cents), CENTS_PER_YUAN)
+    yuan_text = f'{yuan:,}' if thousands else str(yuan)
+    return f'{prefix}{sign}{yuan_text}.{fen:02d}'
+
+
+def bill_amount_cents(doc):
+    """读取账单文档的金额（分），兼容尚未迁移的旧文档（amount 为元）"""
+    if doc.get(AMOUNT_FIELD) is not None:
+        return int(doc[AMOUNT_FIELD])
+    if doc.get(LEGACY_AMOUNT_FIELD) is not None:
+        return to_cents(doc[LEGACY_AMOUNT_FIELD])
+    return 0
+
+
+def with_yuan_amounts(summary):
+    """
+    在 *_cents 之外补上以元为单位的旧版键或列（income / expense / net / amount，float）
+
+    汇总接口改用整数分之前返回的是元，保留旧键兼容已有调用方；新代码应使用 *_cents。
+
+    :param summary: 汇总字典或 DataFrame
+    :return: 同类型的新对象（原对象不变）
+    """
+    out = summary.copy()
+    for key in [k for k in summary.keys() if str(k).endswith('_cents')]:
+        out[key[:-len('_cents')]] = summary[key] / CENTS_PER_YUAN
+    return out
+
+
+def yuan_columns(df):
+    """
+    展示用：把 DataFrame 中的 *_cents 列换算为元，列名去掉 _cents 后缀
+
+    同名的旧版元列（with_yuan_amounts 补上的）先去掉，以整数分换算的结果为准。
+
+    :param df: 含 amount_cents / income_cents 等列的 DataFrame
+    :return: 新 DataFrame（原对象不变）
+    """
+    cents_columns = [c for c in df.columns if str(c).endswith('_cents')]
+    out = df.drop(columns=[c[:-len('_cents')] for c in cents_columns if c[:-len('_cents')] in df.columns])
+    for column in cents_columns:
+        out[column] = out[column] / CENTS_PER_YUAN
+    return out.rename(columns={c: c[:-len('_cents')] for c in cents_columns})
@@ -25,10 +25,29 @@ def get_yearly_dir() -> str:
     return os.path.join(get_data_root(), 'yearly')
 
 
+def get_partitions_dir() -> str:
+    """按年分区、以内容摘要命名的账单分区文件（快照引用，跨快照复用）"""
+    return os.path.join(get_yearly_dir(), 'partitions')
+
+
 def get_manifest_path() -> str:
     return os.path.join(get_data_root(), 'manifest.json')
 
 
+def get_catalog_path() -> str:
+    return os.path.join(get_data_root(), 'catalog.sqlite3')
+
+
+def get_restore_checkpoint_path() -> str:
+    """进行中的恢复的检查点（中断后可继续）"""
+    return os.path.join(get_data_root(), 'restore_checkpoint.json')
+
+
+def get_scheduler_state_path() -> str:
+    """备份调度器的运行状态（上次与下次备份）"""
+    return os.path.join(get_data_root(), 'backup_scheduler.json')
+
+
 def csv_dir(provider: str) -> str:
     """导入账单默认目录：csv/alipay、csv/wechat。"""
     return os.path.join(PROJECT_ROOT, 'csv', provider)
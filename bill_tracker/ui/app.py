@@ -4,17 +4,24 @@ import plotly.graph_objects as go
 import pandas as pd
 from bill_tracker.db import (
     BillDatabase,
+    PRE_RESTORE_MODE,
+    PRE_RESTORE_SHADOW,
+    PRE_RESTORE_SNAPSHOT,
     RESTORE_MODE_BILLS_ONLY,
     RESTORE_MODE_FULL_REPLACE,
     RESTORE_MODE_MERGE,
+    backup_download,
+    diff_snapshots,
     get_data_root,
+    load_scheduler_state,
 )
 from bill_tracker.types import BillCategory
 from bill_tracker.auth import UserManager, AUTH_SUCCESS, AUTH_NEED_CHANGE
 from bill_tracker.import_ import AlipayBillProcessor, WeChatBillProcessor
+from bill_tracker.money import AMOUNT_FIELD, bill_amount_cents, format_yuan, to_cents, yuan_columns
 from bill_tracker.paths import get_log_dir
 from bill_tracker.utils import get_client_ip as get_host_ip
-from datetime import datetime
+from datetime import datetime, timezone
 from loguru import logger
 import os
 import csv
@@ -52,11 +59,21 @@ logger.add(os.path.join(log_dir, 'bill_app_{time:YYYY-MM-DD}.log'),
            format="{time} | {level} | {message}"  # 自定义日志格式
 )
 
+# 查询页「删除账单」下拉框最多列出的条数
+BILL_DELETE_OPTIONS = 500
+
+
+@st.cache_resource(show_spinner=False)
+def get_database():
+    """跨会话与重跑复用同一个 BillDatabase（连接池、后台重连与只读快照只初始化一次）"""
+    return BillDatabase()
+
+
 class BillTrackerApp:
     def __init__(self):
         """初始化应用"""
         try:
-            self.db = BillDatabase()
+            self.db = get_database()
             self.user_manager = UserManager(self.db)
             self.alipay_processor = AlipayBillProcessor(self.db)
             self.wechat_processor = WeChatBillProcessor(self.db)
@@ -238,8 +255,23 @@ class BillTrackerApp:
         with tab_annual:
             self.annual_overview_page()
 
+    def _render_connection_banner(self):
+        """数据库不可用时提示只读模式及数据来源快照"""
+        status = self.db.get_connection_status()
+        if status['online']:
+            return
+        if status['snapshot']:
+            snapshot_time = (status['snapshot_time'] or '')[:19].replace('T', ' ')
+            st.warning(
+                f"⚠️ 数据库暂不可用，当前为只读模式：数据来自快照 `{status['snapshot']}`（{snapshot_time}），"
+                f"录入、导入与备份恢复暂不可用，连接恢复后自动切回。"
+            )
+        else:
+            st.error('⚠️ 数据库暂不可用，且没有可用快照；连接恢复后自动切回。')
+
     def run(self):
         """运行Streamlit应用"""
+        self._render_connection_banner()
         if not st.session_state.logged_in:
             self.login_page()
             return
@@ -302,7 +334,7 @@ class BillTrackerApp:
                     'bill_date': bill_date.strftime('%Y%m%d'),  # 转换为字符串格式
                     'type': bill_type,
                     'category': bill_category,
-                    'amount': float(amount) * amount_sign,  # 支出为负数，收入为正数
+                    'amount_cents': to_cents(amount) * amount_sign,  # 单位：分；支出为负数，收入为正数
                     'remark': remark or '',  # 如果备注为空，使用空字符串
                     'create_time': datetime.now()  # 添加创建时间
                 }
@@ -359,7 +391,7 @@ class BillTrackerApp:
                 
                 with col1:
                     # 收入类别统计
-                    income_summary = self.db.get_category_summary(selected_year, 'income')
+                    income_summary = yuan_columns(self.db.get_category_summary(selected_year, 'income'))
                     
                     if not income_summary.empty:
                         fig_income = px.pie(
@@ -385,7 +417,7 @@ class BillTrackerApp:
                 
                 with col2:
                     # 支出类别统计
-                    expense_summary = self.db.get_category_summary(selected_year, 'expense')
+                    expense_summary = yuan_columns(self.db.get_category_summary(selected_year, 'expense'))
                     
                     if not expense_summary.empty:
                         fig_expense = px.pie(
@@ -418,7 +450,7 @@ class BillTrackerApp:
                 )
                 
                 # 获取月度收支统计
-                monthly_summary = self.db.get_monthly_summary(selected_year)
+                monthly_summary = yuan_columns(self.db.get_monthly_summary(selected_year))
                 
                 # 绘制月度收支柱状图
                 fig_monthly = go.Figure()
@@ -454,6 +486,7 @@ class BillTrackerApp:
                     category_summary = self.db.get_category_summary(selected_year, 'income')
                 else:
                     category_summary = self.db.get_category_summary(selected_year, 'expense')
+                category_summary = yuan_columns(category_summary)
                 
                 # 绘制类别饼图
                 if not category_summary.empty:
@@ -489,6 +522,9 @@ class BillTrackerApp:
     
     def query_bills_page(self):
         """账单查询页面"""
+        if 'query_bill_message' in st.session_state:
+            st.success(st.session_state.query_bill_message)
+            del st.session_state.query_bill_message
         with st.container(border=True):
             st.markdown('##### 筛选条件')
             col1, col2, col3 = st.columns(3)
@@ -509,40 +545,44 @@ class BillTrackerApp:
             submitted = st.button('查询', type='primary', key='query_bills_btn')
 
         if submitted:
+            # 准备查询参数
+            query_params = {
+                'start_date': int(start_date.strftime('%Y%m%d')),
+                'end_date': int(end_date.strftime('%Y%m%d'))
+            }
+            
+            if bill_type != '全部':
+                query_params['bill_type'] = bill_type
+            
+            # 多分类：若选择了分类列表，则传递给后端
+            if bill_categories:
+                query_params['bill_categories'] = bill_categories
+            
+            # 处理金额范围查询 - 根据账单类型调整
+            if min_amount > 0 or max_amount > 0:
+                if bill_type == '支出':
+                    # 对于支出，用户输入的正数需要转换为负数范围
+                    # 例如：用户输入最小金额100（表示支出≥100），实际查询amount ≤ -100
+                    # 用户输入最大金额200（表示支出≤200），实际查询amount ≥ -200
+                    if min_amount > 0:
+                        query_params['max_amount'] = -min_amount  # 支出≥100 → amount ≤ -100
+                    if max_amount > 0:
+                        query_params['min_amount'] = -max_amount  # 支出≤200 → amount ≥ -200
+                else:
+                    # 对于收入或全部，保持原有逻辑
+                    if min_amount > 0:
+                        query_params['min_amount'] = min_amount
+                    if max_amount > 0:
+                        query_params['max_amount'] = max_amount
+            
+            if remark:
+                query_params['remark'] = remark
+            # 保存查询条件：删除账单等操作重跑页面后结果仍在
+            st.session_state.query_bill_params = query_params
+
+        query_params = st.session_state.get('query_bill_params')
+        if query_params:
             try:
-                # 准备查询参数
-                query_params = {
-                    'start_date': int(start_date.strftime('%Y%m%d')),
-                    'end_date': int(end_date.strftime('%Y%m%d'))
-                }
-                
-                if bill_type != '全部':
-                    query_params['bill_type'] = bill_type
-                
-                # 多分类：若选择了分类列表，则传递给后端
-                if bill_categories:
-                    query_params['bill_categories'] = bill_categories
-                
-                # 处理金额范围查询 - 根据账单类型调整
-                if min_amount > 0 or max_amount > 0:
-                    if bill_type == '支出':
-                        # 对于支出，用户输入的正数需要转换为负数范围
-                        # 例如：用户输入最小金额100（表示支出≥100），实际查询amount ≤ -100
-                        # 用户输入最大金额200（表示支出≤200），实际查询amount ≥ -200
-                        if min_amount > 0:
-                            query_params['max_amount'] = -min_amount  # 支出≥100 → amount ≤ -100
-                        if max_amount > 0:
-                            query_params['min_amount'] = -max_amount  # 支出≤200 → amount ≥ -200
-                    else:
-                        # 对于收入或全部，保持原有逻辑
-                        if min_amount > 0:
-                            query_params['min_amount'] = min_amount
-                        if max_amount > 0:
-                            query_params['max_amount'] = max_amount
-                
-                if remark:
-                    query_params['remark'] = remark
-                
                 # 执行查询
                 bills = self.db.query_bills(**query_params)
                 
@@ -553,12 +593,13 @@ class BillTrackerApp:
                             st.metric('总记录数', f'{len(bills):,}')
                     with col2:
                         with st.container(border=True):
-                            st.metric('总金额', f'¥ {bills["amount"].sum():,.2f}')
+                            st.metric('总金额', format_yuan(bills[AMOUNT_FIELD].sum()))
                     with col3:
                         with st.container(border=True):
-                            st.metric('平均金额', f'¥ {bills["amount"].mean():,.2f}')
+                            st.metric('平均金额', format_yuan(round(bills[AMOUNT_FIELD].mean())))
                     st.markdown('<p class="section-title">查询结果</p>', unsafe_allow_html=True)
-                    st.dataframe(bills, use_container_width=True, hide_index=True)
+                    st.dataframe(yuan_columns(bills), use_container_width=True, hide_index=True)
+                    self._render_bill_delete(bills)
                 else:
                     st.markdown(
                         '<div class="empty-hint">未找到匹配的账单，请调整筛选条件后重试</div>',
@@ -566,6 +607,35 @@ class BillTrackerApp:
                     )
             except Exception as e:
                 st.error(f'查询失败: {e}')
+
+    def _render_bill_delete(self, bills):
+        """查询结果下方：删除一条账单（写入墓碑，增量快照回放删除；已归档年份需先移回热表）"""
+        with st.expander('删除账单'):
+            if '_id' not in bills.columns:
+                st.caption('当前结果来自只读快照，无法删除')
+                return
+            rows = bills.head(BILL_DELETE_OPTIONS).to_dict('records')
+            labels = {
+                str(row['_id']): (
+                    f"{row['bill_date']} · {row['type']} · {row['category']} · "
+                    f"{format_yuan(row[AMOUNT_FIELD])} · {row.get('remark') or ''}"
+                )
+                for row in rows
+            }
+            if len(bills) > BILL_DELETE_OPTIONS:
+                st.caption(f'只列出最近的 {BILL_DELETE_OPTIONS} 条，请缩小筛选条件')
+            bill_id = st.selectbox('选择账单', options=list(labels), format_func=labels.get, key='delete_bill_id')
+            confirmed = st.checkbox('确认删除（可从快照恢复）', key='delete_bill_confirm')
+            if st.button('删除', disabled=not confirmed, key='delete_bill_btn'):
+                try:
+                    result = self.db.delete_bill(bill_id)
+                except Exception as e:
+                    st.error(f'删除失败: {e}')
+                    return
+                if result.get('success'):
+                    st.session_state.query_bill_message = result['message']
+                    st.rerun()
+                st.error(result.get('message'))
     
     def dashboard_page(self):
         """财务看板页面"""
@@ -604,25 +674,25 @@ class BillTrackerApp:
             
             # 计算收入和支出总额
             # 正数为收入，负数为支出
-            income_bills = bills[bills['amount'] > 0]
-            expense_bills = bills[bills['amount'] < 0]
+            income_bills = bills[bills[AMOUNT_FIELD] > 0]
+            expense_bills = bills[bills[AMOUNT_FIELD] < 0]
             
-            # 计算总收入和总支出
-            total_income = income_bills['amount'].sum()
-            total_expense = abs(expense_bills['amount'].sum())  # 取绝对值
-            net_total = total_income + bills[bills['amount'] < 0]['amount'].sum()
+            # 计算总收入和总支出（整数分）
+            total_income = int(income_bills[AMOUNT_FIELD].sum())
+            total_expense = abs(int(expense_bills[AMOUNT_FIELD].sum()))  # 取绝对值
+            net_total = total_income - total_expense
             
             # 显示总览数据
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric('总收入', f'¥ {total_income:.2f}')
+                st.metric('总收入', format_yuan(total_income, thousands=False))
             with col2:
-                st.metric('总支出', f'¥ {total_expense:.2f}')
+                st.metric('总支出', format_yuan(total_expense, thousands=False))
             with col3:
-                st.metric('净收益', f'¥ {net_total:.2f}')
+                st.metric('净收益', format_yuan(net_total, thousands=False))
             
-            # 按类别汇总
-            category_summary = bills.groupby('category')['amount'].sum().reset_index()
+            # 按类别汇总（换算为元用于图表）
+            category_summary = yuan_columns(bills.groupby('category')[AMOUNT_FIELD].sum().reset_index())
             
             # 收入类别饼图
             income_categories = ['兼职收入', '补贴', '其他收入']
@@ -725,15 +795,15 @@ class BillTrackerApp:
         with m1:
             with st.container(border=True):
                 st.markdown('<div class="kpi-income">', unsafe_allow_html=True)
-                st.metric('总收入', f'¥ {summary["income"]:,.2f}')
+                st.metric('总收入', format_yuan(summary['income_cents']))
         with m2:
             with st.container(border=True):
                 st.markdown('<div class="kpi-expense">', unsafe_allow_html=True)
-                st.metric('总支出', f'¥ {abs(summary["expense"]):,.2f}')
+                st.metric('总支出', format_yuan(abs(summary['expense_cents'])))
         with m3:
             with st.container(border=True):
                 st.markdown('<div class="kpi-net">', unsafe_allow_html=True)
-                st.metric('净收益', f'¥ {summary["net"]:,.2f}')
+                st.metric('净收益', format_yuan(summary['net_cents']))
 
     def annual_overview_page(self):
         """年度总览页面"""
@@ -820,7 +890,7 @@ class BillTrackerApp:
             )
         else:
             st.dataframe(
-                bills[['bill_date', 'type', 'category', 'amount', 'remark']],
+                yuan_columns(bills[['bill_date', 'type', 'category', AMOUNT_FIELD, 'remark']]),
                 use_container_width=True,
                 hide_index=True,
             )
@@ -919,8 +989,8 @@ class BillTrackerApp:
                             st.write(f"- {category}: {count} 条")
                     
                     with col2:
-                        total_amount = sum(bill['amount'] for bill in processed_bills)
-                        st.metric("总金额", f"¥{abs(total_amount):.2f}")
+                        total_amount = sum(bill[AMOUNT_FIELD] for bill in processed_bills)
+                        st.metric("总金额", format_yuan(abs(total_amount), prefix='¥', thousands=False))
                 
                 # 显示无法分类的账单 - 直接集成分类功能
                 if unclassified_bills:
@@ -1058,7 +1128,7 @@ class BillTrackerApp:
                                             # 处理金额：去掉¥等特殊字符，只保留数字和小数点
                                             amount_str = str(bill['raw_data']['订单金额(元)']).replace('¥', '').replace('￥', '').strip()
                                             try:
-                                                amount_value = float(amount_str)
+                                                amount_value = to_cents(amount_str)
                                             except ValueError:
                                                 st.error(f"金额格式错误: {bill['raw_data']['订单金额(元)']}")
                                                 logger.error(f"无法解析金额: {bill['raw_data']['订单金额(元)']}")
@@ -1087,7 +1157,7 @@ class BillTrackerApp:
                                                 'bill_date': bill_date,
                                                 'type': '支出',
                                                 'category': classification['category'],
-                                                'amount': -amount_value,
+                                                'amount_cents': -amount_value,
                                                 'remark': f"{bill['raw_data']['商品名称']} - {bill['raw_data']['对方名称']}",
                                                 'create_time': datetime.now()
                                             }
@@ -1191,8 +1261,8 @@ class BillTrackerApp:
                             st.write(f"- {category}: {count} 条")
                     
                     with col2:
-                        total_amount = sum(bill['amount'] for bill in processed_bills)
-                        st.metric("总金额", f"¥{total_amount:.2f}")
+                        total_amount = sum(bill[AMOUNT_FIELD] for bill in processed_bills)
+                        st.metric("总金额", format_yuan(total_amount, prefix='¥', thousands=False))
                     
                     with col3:
                         st.write("**交易类型：**")
@@ -1345,7 +1415,7 @@ class BillTrackerApp:
                                             # 处理金额：去掉¥等特殊字符，只保留数字和小数点
                                             amount_str = str(bill['raw_data']['金额(元)']).replace('¥', '').replace('￥', '').strip()
                                             try:
-                                                amount_value = float(amount_str)
+                                                amount_value = to_cents(amount_str)
                                             except ValueError:
                                                 st.error(f"金额格式错误: {bill['raw_data']['金额(元)']}")
                                                 logger.error(f"无法解析金额: {bill['raw_data']['金额(元)']}")
@@ -1381,7 +1451,7 @@ class BillTrackerApp:
                                                 'bill_date': bill_date,
                                                 'type': bill_type,
                                                 'category': classification['category'],
-                                                'amount': amount,
+                                                'amount_cents': amount,
                                                 'remark': f"{bill['raw_data']['商品']} - {bill['raw_data']['交易对方']}",
                                                 'create_time': datetime.now()
                                             }
@@ -1414,14 +1484,11 @@ class BillTrackerApp:
     
     def _render_backup_db_status(self):
         """备份页：当前库状态"""
-        target_db_name = 'bill_tracker'
         total_documents = 0
-        db = self.db.client[target_db_name]
-        collections = db.list_collection_names()
+        counts = self.db.get_collection_counts()
 
-        cols = st.columns(min(len(collections) + 1, 4))
-        for i, collection_name in enumerate(collections):
-            count = db[collection_name].count_documents({})
+        cols = st.columns(min(len(counts) + 1, 4))
+        for i, (collection_name, count) in enumerate(counts.items()):
             total_documents += count
             with cols[i % len(cols)]:
                 st.metric(collection_name, f"{count:,} 条")
@@ -1446,54 +1513,202 @@ class BillTrackerApp:
 
         path = backup_result.get('backup_path')
         if path:
-            st.caption(f"文件: `{os.path.basename(path)}` · 哈希: `{backup_result.get('data_hash', 'N/A')}`")
+            kind_label = '增量' if backup_result.get('backup_kind') == 'incremental' else '全量'
+            st.caption(
+                f"文件: `{os.path.basename(path)}`（{kind_label}）· 哈希: `{backup_result.get('data_hash', 'N/A')}`"
+            )
             if os.path.exists(path):
-                with open(path, 'rb') as f:
-                    st.download_button(
-                        '📥 下载此备份',
-                        data=f.read(),
-                        file_name=os.path.basename(path),
-                        mime='application/json',
-                        key=f"dl_{os.path.basename(path)}_{backup_result.get('data_hash', '')[:8]}",
-                    )
+                self._render_backup_download(path, key=f"dl_{os.path.basename(path)}")
+        if backup_result.get('snapshot_fallback'):
+            st.warning(
+                f"本次备份未使用快照读（{backup_result['snapshot_fallback']}），"
+                "读取期间的并发写入可能使快照不一致；启用单节点副本集见 docker-compose.yml 中的注释"
+            )
+
+    @staticmethod
+    def _render_backup_download(path, key, prepare_label='📥 下载此备份', download_label='💾 保存文件'):
+        """
+        快照下载：渲染页面时只读取文件的 mtime 与大小，点击后才读取文件（引用年度分区或依赖基线的快照
+        打包为 zip，保证下载内容可独立恢复）。内容按 路径 + mtime + 大小 缓存在 session_state 中，
+        只保留最近准备的一份，之后的重跑不再读盘。
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            st.write('—')
+            return
+        signature = [path, stat.st_mtime_ns, stat.st_size]
+        prepared = st.session_state.get('backup_download')
+        if prepared and prepared['signature'] == signature:
+            st.download_button(
+                download_label,
+                data=prepared['data'],
+                file_name=prepared['file_name'],
+                mime=prepared['mime'],
+                key=f'{key}_save',
+                help=prepared['file_name'],
+            )
+            return
+        if st.button(prepare_label, key=f'{key}_prepare', help='读取快照并准备下载'):
+            try:
+                with st.spinner('正在准备下载...'):
+                    data, file_name, mime = backup_download(path)
+            except Exception as e:
+                st.error(f'准备下载失败: {e}')
+                return
+            st.session_state.backup_download = {
+                'signature': signature,
+                'data': data,
+                'file_name': file_name,
+                'mime': mime,
+            }
+            st.rerun()
+
+    @staticmethod
+    def _render_backup_schedule():
+        """备份页：备份调度器（backup 服务）的上次与下次备份"""
+        state = load_scheduler_state()
+        if not state:
+            return
+
+        def local_time(value):
+            if not value:
+                return '-'
+            return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).astimezone().strftime('%Y-%m-%d %H:%M:%S')
+
+        trigger_labels = {
+            'startup': '启动', 'writes': '写入量', 'idle': '写入后空闲', 'interval': '定时', 'retry': '失败重试',
+        }
+        last_run = state.get('last_run') or {}
+        next_run = state.get('next_run') or {}
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            if last_run:
+                outcome = '失败' if last_run.get('success') is False else ('跳过' if last_run.get('skipped') else '成功')
+                st.metric('上次调度备份', local_time(last_run.get('finished_at') or last_run.get('started_at')))
+                st.caption(f"{trigger_labels.get(last_run.get('trigger'), last_run.get('trigger'))} · {outcome}")
+            else:
+                st.metric('上次调度备份', '-')
+        with c2:
+            st.metric('下次预计', local_time(next_run.get('due_at')))
+            if next_run.get('reason'):
+                st.caption(trigger_labels.get(next_run['reason'], next_run['reason']))
+        with c3:
+            st.metric('待备份写入', f"{state.get('pending_writes', 0):,}")
+            if next_run.get('writes_until_threshold') is not None:
+                st.caption(f"再写入 {next_run['writes_until_threshold']:,} 次即备份")
+        if state.get('status') == 'backoff':
+            st.warning(f"调度备份连续失败 {state.get('failures', 0)} 次：{last_run.get('message', '')}")
+        elif state.get('status') == 'stopped':
+            st.caption('备份调度器已停止')
 
     def _backup_tab_content(self):
         st.caption('仅在数据有变化时创建新快照；文件保存在 `data/snapshots/`，最多保留 5 份。')
+        self._render_backup_schedule()
         left, right = st.columns([1, 1])
         with left:
             st.markdown('##### 智能备份')
             st.write('检测哈希变化，无变化则跳过。')
             if st.button('🚀 开始智能备份', type='primary', use_container_width=True, key='btn_smart_backup'):
+                st.session_state.pop('last_backup', None)
                 try:
                     with st.spinner('检查并备份...'):
                         result = self.db.backup_all_data(force=False)
                     if result.get('success'):
-                        st.success('完成' if not result.get('skipped') else '无需新备份')
-                        self._render_backup_result(result, skipped_ok=True)
+                        st.session_state.last_backup = {'source': 'smart', 'result': result}
                     else:
                         st.error(result.get('message', '备份失败'))
                 except Exception as e:
                     st.error(f'备份失败: {e}')
+            self._render_last_backup('smart')
         with right:
             st.markdown('##### 强制备份')
             st.write('忽略变化检测，立即生成快照。')
             if st.button('🔄 强制备份', use_container_width=True, key='btn_force_backup'):
+                st.session_state.pop('last_backup', None)
                 try:
                     with st.spinner('备份中...'):
                         result = self.db.backup_all_data(force=True)
                     if result.get('success'):
-                        st.success('强制备份完成')
-                        self._render_backup_result(result)
+                        st.session_state.last_backup = {'source': 'force', 'result': result}
                     else:
                         st.error(result.get('message', '备份失败'))
                 except Exception as e:
                     st.error(f'强制备份失败: {e}')
+            self._render_last_backup('force')
+
+    def _render_last_backup(self, source):
+        """备份页：本会话最近一次手动备份的结果（保存在 session_state，点击准备下载重跑后仍显示）"""
+        last = st.session_state.get('last_backup')
+        if not last or last['source'] != source:
+            return
+        result = last['result']
+        if source == 'smart':
+            st.success('完成' if not result.get('skipped') else '无需新备份')
+            self._render_backup_result(result, skipped_ok=True)
+        else:
+            st.success('强制备份完成')
+            self._render_backup_result(result)
+
+    @staticmethod
+    def _restore_progress():
+        """恢复进度条回调"""
+        bar = st.progress(0.0, text='准备恢复...')
+
+        def update(event):
+            total = event.get('total') or 0
+            ratio = min(event['done'] / total, 1.0) if total else 0.0
+            bar.progress(
+                ratio,
+                text=f"第 {event['layer']}/{event['layers']} 层 · {event['collection']}: {event['done']:,}"
+                     + (f" / {total:,}" if total else ''),
+            )
+
+        return update
+
+    def _render_pending_restore(self):
+        """恢复页：上次中断的恢复（继续或放弃）"""
+        pending = self.db.get_restore_checkpoint()
+        if not pending:
+            return
+        params = pending.get('params') or {}
+        current = pending.get('current') or {}
+        st.warning(
+            f"上次恢复未完成：`{os.path.basename(params.get('backup_path', ''))}`（{params.get('mode')}），"
+            f"已完成 {len(pending.get('completed', []))} 项"
+            + (f"，`{current['key']}` 已写入 {current.get('done', 0):,} 条" if current.get('key') else '')
+        )
+        c1, c2 = st.columns(2)
+        with c1:
+            if st.button('继续恢复', type='primary', use_container_width=True, key='restore_resume_btn'):
+                result = self.db.restore_from_backup(
+                    params['backup_path'],
+                    mode=params['mode'],
+                    include_users=params.get('include_users', False),
+                    years=params.get('years'),
+                    progress=self._restore_progress(),
+                    resume=True,
+                )
+                if result.get('success'):
+                    st.success('恢复完成')
+                    st.json(result.get('stats', {}))
+                else:
+                    st.error(result.get('message', '恢复失败'))
+        with c2:
+            if st.button('放弃（保持当前数据）', use_container_width=True, key='restore_discard_btn'):
+                result = self.db.discard_restore_checkpoint()
+                if result.get('success'):
+                    st.rerun()
+                st.warning(result.get('message'))
+        st.divider()
 
     def _restore_tab_content(self):
         self.db._ensure_data_layout()
-        snapshot_files = self.db.list_backup_files(include_pre_restore=False)
+        self._render_pending_restore()
         all_files = self.db.list_backup_files(include_pre_restore=True)
+        snapshot_files = [f for f in all_files if f.get('category') == 'snapshot']
         pre_restore_only = [f for f in all_files if f.get('category') == 'pre_restore']
+        files_by_path = {f['backup_path']: f for f in all_files}
 
         if not snapshot_files:
             st.info('暂无快照，请先在「执行备份」中创建备份。')
@@ -1502,11 +1717,16 @@ class BillTrackerApp:
         left, right = st.columns([1, 1])
         with left:
             source_options = {
-                f"{f['file_name']}（{f['total_documents']:,} 条）": f['backup_path']
+                (
+                    f"{f['file_name']}（增量 {f['total_documents']:,} 条，基于 {f.get('base')}）"
+                    if f.get('backup_kind') == 'incremental'
+                    else f"{f['file_name']}（{f['total_documents']:,} 条）"
+                ): f['backup_path']
                 for f in snapshot_files
             }
             selected_label = st.selectbox('选择快照', options=list(source_options.keys()), key='restore_file_select')
             backup_path = source_options[selected_label]
+            preview = files_by_path.get(backup_path) or {}
 
             restore_mode = st.radio(
                 '恢复模式',
@@ -1522,6 +1742,29 @@ class BillTrackerApp:
             if restore_mode == RESTORE_MODE_FULL_REPLACE:
                 include_users = st.checkbox('同时恢复 users', value=False, key='restore_include_users')
 
+            bills_stat = (preview.get('collection_stats') or {}).get('bills', {})
+            year_options = preview.get('partition_years') or (
+                [str(y) for y in range(int(bills_stat['bill_date_min'][:4]), int(bills_stat['bill_date_max'][:4]) + 1)]
+                if bills_stat.get('bill_date_min') and bills_stat.get('bill_date_max') else []
+            )
+            years = st.multiselect(
+                '只恢复这些年份的账单（留空为全部）',
+                options=year_options,
+                key='restore_years_select',
+            ) if year_options else []
+
+            pre_restore = st.radio(
+                '恢复前安全网',
+                [PRE_RESTORE_SNAPSHOT, PRE_RESTORE_SHADOW],
+                index=1 if PRE_RESTORE_MODE == PRE_RESTORE_SHADOW else 0,
+                format_func=lambda m: {
+                    PRE_RESTORE_SNAPSHOT: '全量快照文件',
+                    PRE_RESTORE_SHADOW: '服务端影子副本（秒级）',
+                }[m],
+                horizontal=True,
+                key='restore_pre_restore_radio',
+            )
+
             confirm_text = st.text_input('输入 RESTORE 确认', placeholder='RESTORE', key='restore_confirm_input')
             if st.button('执行恢复', type='primary', use_container_width=True, key='restore_execute_btn'):
                 if confirm_text != 'RESTORE':
@@ -1529,28 +1772,53 @@ class BillTrackerApp:
                 else:
                     try:
                         with st.spinner('恢复中（会先自动做 pre_restore）...'):
-                            result = self.db.restore_from_backup(backup_path, mode=restore_mode, include_users=include_users)
+                            result = self.db.restore_from_backup(
+                                backup_path, mode=restore_mode, include_users=include_users, years=years or None,
+                                progress=self._restore_progress(), pre_restore=pre_restore,
+                            )
                         if result.get('success'):
                             st.success('恢复完成')
                             st.json(result.get('stats', {}))
                             st.rerun()
                         else:
                             st.error(result.get('message', '恢复失败'))
+                            if result.get('resumable'):
+                                st.info('已写入的进度已保存，刷新页面后可继续恢复。')
                     except Exception as e:
                         st.error(str(e))
 
         with right:
-            preview = self.db.parse_backup_file(backup_path)
             if preview.get('success'):
                 st.markdown('##### 快照预览')
                 st.write(f"时间: {preview.get('backup_time', '')[:19].replace('T', ' ')}")
                 st.write(f"记录: {preview['total_documents']:,} · {preview['file_size_mb']} MB")
+                if preview.get('backup_kind') == 'incremental':
+                    st.caption(f"增量快照：恢复时先恢复基线 `{preview.get('base')}`，再依次回放链上的增量。")
                 for cname, cstat in (preview.get('collection_stats') or {}).items():
                     line = f"- **{cname}**: {cstat.get('count', 0):,}"
                     if cstat.get('bill_date_min'):
                         line += f" ({cstat['bill_date_min']} ~ {cstat['bill_date_max']})"
                     st.write(line)
-            st.info('恢复前会自动写入 `data/pre_restore/` 安全快照。')
+                if st.button('与当前数据对比', key='restore_compare_btn'):
+                    diff = self.db.compare_backup_with_live(backup_path)
+                    if not diff.get('success'):
+                        st.warning(diff.get('message', '对比失败'))
+                    elif diff['identical']:
+                        st.success('当前数据与此快照一致')
+                    else:
+                        for cname, partitions in diff['changed_partitions'].items():
+                            st.write(f"- **{cname}** 变化分区: {', '.join(partitions)}")
+                if st.button('预演恢复（不写入）', key='restore_dry_run_btn'):
+                    with st.spinner('对比快照与当前数据...'):
+                        dry_run = self.db.dry_run_restore(backup_path, include_users=include_users, years=years or None)
+                    if not dry_run.get('success'):
+                        st.warning(dry_run.get('message', '预演失败'))
+                    else:
+                        self._render_dry_run(dry_run, restore_mode)
+            st.info('恢复前会自动写入 `data/pre_restore/` 安全快照，或在库内创建影子副本。')
+
+        self._render_subset_restore(backup_path, pre_restore)
+        self._render_shadow_rollback()
 
         if pre_restore_only:
             st.divider()
@@ -1573,6 +1841,103 @@ class BillTrackerApp:
                 except Exception as e:
                     st.error(str(e))
 
+    def _render_subset_restore(self, backup_path, pre_restore):
+        """恢复页：按日期区间 / 分类 / 类型只恢复部分账单"""
+        with st.expander('局部恢复（只修复部分账单）'):
+            c1, c2 = st.columns(2)
+            with c1:
+                date_from = st.date_input('起始日期', value=None, key='subset_date_from')
+                bill_type = st.selectbox('账单类型', ['全部', '支出', '收入'], key='subset_type')
+            with c2:
+                date_to = st.date_input('结束日期', value=None, key='subset_date_to')
+                categories = st.multiselect(
+                    '分类（留空为全部）',
+                    [c.value for c in BillCategory.Expense] + [c.value for c in BillCategory.Income],
+                    key='subset_categories',
+                )
+            scoped_replace = st.checkbox(
+                '删除范围内快照中没有的账单（范围外不受影响）', value=True, key='subset_scoped_replace'
+            )
+            if st.button('恢复所选范围', key='subset_restore_btn'):
+                with st.spinner('局部恢复中...'):
+                    result = self.db.restore_bills_subset(
+                        backup_path,
+                        date_from=date_from.strftime('%Y%m%d') if date_from else None,
+                        date_to=date_to.strftime('%Y%m%d') if date_to else None,
+                        categories=categories,
+                        bill_type=None if bill_type == '全部' else bill_type,
+                        scoped_replace=scoped_replace,
+                        pre_restore=pre_restore,
+                    )
+                if result.get('success'):
+                    st.success(result['message'])
+                    st.json(result.get('stats', {}))
+                else:
+                    st.error(result.get('message', '局部恢复失败'))
+
+    @staticmethod
+    def _render_dry_run(dry_run, restore_mode):
+        """恢复预演结果：各模式的变化条数，以及当前所选模式的样例"""
+        labels = {
+            'inserted': '新增', 'updated': '更新', 'unchanged': '不变', 'deleted': '删除', 'kept': '保留（合并不动）',
+        }
+        st.dataframe(
+            pd.DataFrame([
+                {'模式': mode, **{labels[k]: summary[k] for k in labels}}
+                for mode, summary in dry_run['modes'].items()
+            ]),
+            hide_index=True,
+            use_container_width=True,
+        )
+        if dry_run.get('compared_partitions') is not None:
+            st.caption('摘要一致的分区未逐条比较，直接计为不变。')
+        with st.expander(f'{restore_mode} 样例'):
+            for cname, cstat in dry_run['modes'][restore_mode]['collections'].items():
+                for key, samples in cstat['samples'].items():
+                    if samples:
+                        st.write(f"**{cname}** · {labels[key]}")
+                        st.json(samples, expanded=False)
+
+    def _render_shadow_rollback(self):
+        """恢复页：恢复前影子副本（一键回滚、导出为文件、删除）"""
+        shadows = self.db.list_pre_restore_shadows()
+        if not shadows:
+            return
+        st.divider()
+        st.markdown('##### 影子副本回滚')
+        shadow_options = {
+            f"{s['shadow_id']}（{s.get('reason') or '-'}，"
+            f"{sum(c or 0 for c in s['collections'].values()):,} 条，"
+            f"{s['expires_at'].strftime('%m-%d %H:%M')} UTC 过期）": s['shadow_id']
+            for s in shadows
+        }
+        label = st.selectbox('影子副本', options=list(shadow_options.keys()), key='shadow_select')
+        shadow_id = shadow_options[label]
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            if st.button('回滚到此副本', type='primary', use_container_width=True, key='shadow_rollback_btn'):
+                with st.spinner('回滚中...'):
+                    result = self.db.rollback_pre_restore_shadow(shadow_id)
+                if result.get('success'):
+                    st.success('回滚完成')
+                    st.json(result.get('collections', {}))
+                else:
+                    st.error(result.get('message'))
+        with c2:
+            if st.button('导出为文件', use_container_width=True, key='shadow_export_btn'):
+                with st.spinner('导出中...'):
+                    result = self.db.export_pre_restore_shadow(shadow_id)
+                if result.get('success'):
+                    st.success(result['message'])
+                else:
+                    st.error(result.get('message'))
+        with c3:
+            if st.button('删除副本', use_container_width=True, key='shadow_drop_btn'):
+                result = self.db.drop_pre_restore_shadow(shadow_id)
+                if result.get('success'):
+                    st.rerun()
+                st.warning(result.get('message'))
+
     def _snapshots_tab_content(self):
         snapshot_files = self.db.list_backup_files(include_pre_restore=False)
         if not snapshot_files:
@@ -1590,11 +1955,70 @@ class BillTrackerApp:
                 with c3:
                     st.write(meta.get('backup_time', '')[:19].replace('T', ' '))
                 with c4:
-                    try:
-                        with open(meta['backup_path'], 'rb') as f:
-                            st.download_button('📥', f.read(), meta['file_name'], 'application/json', key=f"snap_dl_{i}")
-                    except Exception:
-                        st.write('—')
+                    self._render_backup_download(
+                        meta['backup_path'], key=f"snap_dl_{meta['file_name']}", prepare_label='📥', download_label='💾',
+                    )
+
+        if len(snapshot_files) >= 2:
+            st.divider()
+            self._render_snapshot_diff(snapshot_files)
+
+    def _render_snapshot_diff(self, snapshot_files):
+        """快照文件页：两份快照之间新增、删除、修改的账单及按年份/分类的汇总变化"""
+        st.markdown('##### 快照对比')
+        names = {f['file_name']: f['backup_path'] for f in snapshot_files}
+        c1, c2 = st.columns(2)
+        with c1:
+            old_name = st.selectbox('较早的快照', options=list(names), index=1, key='snap_diff_old')
+        with c2:
+            new_name = st.selectbox('较新的快照', options=list(names), index=0, key='snap_diff_new')
+        if not st.button('对比', key='snap_diff_btn'):
+            return
+        try:
+            with st.spinner('流式对比中...'):
+                result = diff_snapshots(names[old_name], names[new_name])
+        except Exception as e:
+            st.error(f'对比失败: {e}')
+            return
+        summary = result['summary']
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric('新增', f"{summary['added']:,}")
+        m2.metric('删除', f"{summary['removed']:,}")
+        m3.metric('修改', f"{summary['modified']:,}")
+        m4.metric('不变', f"{summary['unchanged']:,}")
+        if result['aggregates']:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        '年份': row['year'],
+                        '分类': row['category'],
+                        '条数变化': row['count'],
+                        '金额变化': format_yuan(row['amount_cents']),
+                    }
+                    for row in result['aggregates']
+                ]),
+                hide_index=True,
+                use_container_width=True,
+            )
+        labels = {'added': '新增', 'removed': '删除', 'modified': '修改'}
+        for change_type, samples in result['samples'].items():
+            if not samples:
+                continue
+            with st.expander(f'{labels[change_type]}样例（前 {len(samples)} 条）'):
+                st.dataframe(
+                    pd.DataFrame([
+                        {
+                            '_id': change['_id'],
+                            'bill_date': (change['new'] or change['old']).get('bill_date'),
+                            'category': (change['new'] or change['old']).get('category'),
+                            '金额': format_yuan(bill_amount_cents(change['new'] or change['old'])),
+                            '变化字段': ', '.join(change.get('fields', [])),
+                        }
+                        for change in samples
+                    ]),
+                    hide_index=True,
+                    use_container_width=True,
+                )
 
     def data_backup_page(self):
         """数据备份与恢复（Tab 布局）"""
@@ -1610,8 +2034,8 @@ class BillTrackerApp:
 | 目录 | 用途 |
 |------|------|
 | `data/snapshots/` | 全量快照，定时/手动备份，保留 5 份 |
-| `data/pre_restore/` | 恢复前自动安全快照 |
-| `data/yearly/` | 按年归档（阶段二） |
+| `data/pre_restore/` | 恢复前自动安全快照（选择影子副本时为库内 `pre_restore__*` 集合，可按需导出到此） |
+| `data/yearly/` | 冷数据按年归档导出（冻结年份只写一次） |
                 """
             )
             try:
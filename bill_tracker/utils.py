@@ -1,6 +1,8 @@
 """通用工具函数。"""
 import socket
+from datetime import datetime, timedelta
 
+from dateutil.relativedelta import relativedelta
 from loguru import logger
 
 
@@ -10,3 +12,41 @@ def get_client_ip() -> str:
     except Exception as e:
         logger.warning(f'获取IP地址失败: {e}')
         return 'Unknown'
+
+
+def period_date_range(period_type='week', start_date=None):
+    """
+    计算自然周/月/季/年的起止日期
+
+    :param period_type: 周期类型，可选 'week', 'month', 'quarter', 'year'
+    :param start_date: 参考日期（格式: 20250102），默认为当前日期
+    :return: (开始 datetime, 结束 datetime)
+    """
+    # 如果没有传入开始日期，使用当前日期
+    if start_date is None:
+        start_date = datetime.now().strftime('%Y%m%d')
+
+    # 将开始日期转换为datetime对象
+    start_datetime = datetime.strptime(start_date, '%Y%m%d')
+
+    # 根据周期类型计算开始和结束日期
+    if period_type == 'week':
+        # 获取本周第一天（自然周）
+        week_start = start_datetime - timedelta(days=start_datetime.weekday())
+        return week_start, week_start + timedelta(days=6)
+    if period_type == 'month':
+        # 获取本月第一天（自然月）
+        month_start = start_datetime.replace(day=1)
+        return month_start, month_start + relativedelta(months=1) - timedelta(days=1)
+    if period_type == 'quarter':
+        # 获取本季度第一天（自然季）
+        quarter_start = start_datetime.replace(
+            day=1,
+            month=((start_datetime.month - 1) // 3) * 3 + 1
+        )
+        return quarter_start, quarter_start + relativedelta(months=3) - timedelta(days=1)
+    if period_type == 'year':
+        # 获取本年第一天（自然年）
+        year_start = start_datetime.replace(month=1, day=1)
+        return year_start, year_start.replace(month=12, day=31)
+    raise ValueError(f"不支持的周期类型: {period_type}")
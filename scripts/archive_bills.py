@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+账单冷热分层归档
+
+将早于热数据期限（默认最近 2 个自然年，环境变量 ARCHIVE_HOT_YEARS）的年份
+移入 bills_archive_<年份> 集合，并在 data/yearly/ 写出一次性导出文件。
+查询/统计在日期范围触及归档年份时自动合并冷数据。
+
+使用方法:
+    python scripts/archive_bills.py --dry-run        # 查看将归档的年份
+    python scripts/archive_bills.py                  # 执行归档
+    python scripts/archive_bills.py --hot-years 3
+    python scripts/archive_bills.py --unarchive 2022 # 移回热表
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bill_tracker.db import BillDatabase
+
+
+def main():
+    parser = argparse.ArgumentParser(description='账单冷热分层归档')
+    parser.add_argument('--hot-years', type=int, default=None, help='热数据保留的自然年数')
+    parser.add_argument('--dry-run', action='store_true', help='只列出待归档年份')
+    parser.add_argument('--unarchive', type=int, default=None, help='将指定年份移回热表')
+    args = parser.parse_args()
+
+    db = BillDatabase()
+    try:
+        if args.unarchive:
+            result = db.unarchive_year(args.unarchive)
+            print(result.get('message') or f"{args.unarchive} 年已移回热表: {result['moved']} 条")
+            return
+
+        # 实际归档持有维护租约，备份或恢复进行中时不执行
+        if args.dry_run:
+            result = db.archive.run(hot_years=args.hot_years, dry_run=True)
+        else:
+            result = db.archive_bills(hot_years=args.hot_years)
+        if not result.get('success'):
+            sys.exit(result.get('message'))
+        if not result['years']:
+            print('没有需要归档的年份')
+            return
+        if args.dry_run:
+            print(f"待归档年份: {', '.join(str(y) for y in result['years'])}")
+            return
+        for item in result['results']:
+            print(f"{item['year']}: 移动 {item.get('moved', 0)} 条 -> {item.get('collection', '-')}"
+                  f"（导出: {item.get('export_path', '-')}）")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+常驻备份调度器（docker compose 的 backup 服务）
+
+整个进程复用一个数据库连接，按写入量、写入后的空闲时长或定时触发智能备份，
+空闲时每次轮询只读取一条写入计数记录。触发条件与退避见 bill_tracker/db/scheduler.py。
+
+使用方法:
+    python scripts/backup_scheduler.py            # 前台运行，SIGTERM / Ctrl+C 结束
+    python scripts/backup_scheduler.py --status   # 查看上次与下次备份（读取 data/backup_scheduler.json）
+"""
+import argparse
+import json
+import signal
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bill_tracker.db.scheduler import BackupScheduler, load_scheduler_state
+
+
+def print_status():
+    state = load_scheduler_state()
+    if not state:
+        print('调度器尚未运行（没有 data/backup_scheduler.json）')
+        return
+    print(json.dumps(state, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='常驻备份调度器')
+    parser.add_argument('--status', action='store_true', help='只打印调度器状态后退出')
+    args = parser.parse_args()
+    if args.status:
+        print_status()
+        return
+
+    from bill_tracker.db import BillDatabase
+
+    database = BillDatabase()
+    scheduler = BackupScheduler(database)
+
+    def handle_signal(signum, frame):
+        scheduler.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    try:
+        scheduler.run()
+    finally:
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
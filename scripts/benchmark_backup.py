@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+备份/恢复基准测试
+
+在一个专用的本地 mongod 中按规模生成合成账单（默认 1 万、10 万、100 万条，跨 5 年），
+依次测量全量备份、增量备份（修改 1% 后）、parse_backup_file（命中索引）、describe_backup（读文件头）、
+list_backup_files 以及三种恢复模式（merge / bills_only / full_replace，含恢复前安全网），
+记录耗时、吞吐（条/秒、MB/秒）、主进程峰值 RSS 与输出大小，写入结果 JSON；
+指定 --baseline 时与之前保存的结果逐项对比，吞吐下降超过阈值的列为回退。
+
+备份恢复固定作用于 bill_tracker 库，脚本会清空其中的集合：只能指向专用的 mongod，
+库非空时需 --wipe 确认。快照写到临时工作目录（DATA_DIR），不影响 data/。
+
+使用方法:
+    docker run -d --name bench-mongo -p 27018:27017 mongo:7.0
+    python scripts/benchmark_backup.py --uri mongodb://localhost:27018/ --sizes 10000 100000
+    python scripts/benchmark_backup.py --uri mongodb://localhost:27018/ --baseline bench/baseline.json --fail-on-regression
+    BACKUP_WORKERS=1 python scripts/benchmark_backup.py --uri ... -o bench/workers1.json   # 对比引擎配置
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+INSERT_BATCH = 10_000
+# 增量备份前修改的账单比例
+CHANGE_RATIO = 0.01
+RSS_SAMPLE_SECONDS = 0.05
+
+
+class PeakRss:
+    """测量期间主进程的峰值 RSS（Linux 读 /proc/self/status 采样；其他系统退回进程生命周期峰值）"""
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/status', encoding='ascii') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+        return False
+
+
+def dir_size(path, exclude=('logs',)):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d not in exclude]
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def synthetic_bills(n, seed, years=5):
+    """按批产出合成账单：日期均匀分布在最近 years 年，支出为主，金额为 int64 分"""
+    from bson.int64 import Int64
+
+    from bill_tracker.types import BillCategory
+
+    rng = random.Random(seed)
+    expense = [c.value for c in BillCategory.Expense]
+    income = [c.value for c in BillCategory.Income]
+    end = datetime.now()
+    span_days = 365 * years
+    batch = []
+    for i in range(n):
+        is_income = rng.random() < 0.1
+        day = end - timedelta(days=rng.randrange(span_days))
+        batch.append({
+            'bill_date': day.strftime('%Y%m%d'),
+            'type': '收入' if is_income else '支出',
+            'category': rng.choice(income if is_income else expense),
+            'amount_cents': Int64(rng.randint(100, 5_000_000) if is_income else rng.randint(100, 200_000)),
+            'remark': f'bench-{i}' if rng.random() < 0.3 else '',
+            'updated_at': day,
+        })
+        if len(batch) >= INSERT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Benchmark:
+    def __init__(self, db, workdir, repeat, pre_restore):
+        self.db = db
+        self.workdir = workdir
+        self.repeat = repeat
+        self.pre_restore = pre_restore
+        self.results = []
+
+    def measure(self, size, operation, func, documents=None, input_bytes=None):
+        """执行一次操作并记录指标；documents / input_bytes 为 None 时从返回值与输出目录推算"""
+        before = dir_size(self.workdir)
+        with PeakRss() as rss:
+            start = time.perf_counter()
+            result = func()
+            wall = time.perf_counter() - start
+        output_bytes = max(dir_size(self.workdir) - before, 0)
+        if isinstance(result, dict) and result.get('success') is False:
+            raise RuntimeError(f"{operation} 失败: {result.get('message')}")
+        if documents is None and isinstance(result, dict):
+            documents = result.get('total_documents')
+        moved = input_bytes if input_bytes is not None else output_bytes
+        row = {
+            'size': size,
+            'operation': operation,
+            'wall_seconds': round(wall, 4),
+            'documents': documents,
+            'docs_per_second': round(documents / wall, 1) if documents and wall else None,
+            'bytes': moved,
+            'mb_per_second': round(moved / wall / 1024 / 1024, 2) if moved and wall else None,
+            'output_bytes': output_bytes,
+            'peak_rss_mb': round(rss.peak / 1024 / 1024, 1),
+        }
+        self.results.append(row)
+        print(
+            f"{size:>9,}  {operation:<22} {wall:>9.3f}s  "
+            f"{(row['docs_per_second'] or 0):>12,.0f} 条/s  {(row['mb_per_second'] or 0):>8.2f} MB/s  "
+            f"RSS {row['peak_rss_mb']:>7.1f} MB  输出 {output_bytes / 1024 / 1024:.2f} MB"
+        )
+        return result
+
+    def reset(self):
+        """
+        清空库与工作目录（日志除外）
+
+        除快照与分区目录外，catalog.sqlite3、manifest.json 与恢复断点等文件也一并删除，
+        否则后一个规模会复用前一个规模的目录索引或分区，测得偏乐观的耗时。
+        """
+        db = self.db._maintenance_db()
+        for name in db.list_collection_names():
+            db.drop_collection(name)
+        for entry in os.listdir(self.workdir):
+            if entry == 'logs':
+                continue
+            path = os.path.join(self.workdir, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def generate(self, size, seed):
+        collection = self.db._maintenance_db()['bills']
+        start = time.perf_counter()
+        for batch in synthetic_bills(size, seed):
+            collection.insert_many(batch, ordered=False)
+        self.db._maintenance_db()['users'].insert_one({'username': 'bench', 'password': '-'})
+        print(f"{size:>9,}  生成数据 {time.perf_counter() - start:.1f}s")
+
+    def modify(self, size, seed):
+        """修改约 1% 的账单（更新金额与 updated_at，并标记摘要分区），供增量备份测量"""
+        collection = self.db._maintenance_db()['bills']
+        rng = random.Random(seed + 1)
+        n = max(int(size * CHANGE_RATIO), 1)
+        docs = list(collection.aggregate([{'$sample': {'size': n}}]))
+        now = datetime.utcnow()
+        for doc in docs:
+            collection.update_one(
+                {'_id': doc['_id']},
+                {'$set': {'amount_cents': doc['amount_cents'] + rng.randint(1, 100), 'updated_at': now}},
+            )
+        self.db.digests.mark_dirty('bills', docs=docs)
+
+    def run_size(self, size, seed):
+        from bill_tracker.db import RESTORE_MODE_BILLS_ONLY, RESTORE_MODE_FULL_REPLACE, RESTORE_MODE_MERGE
+        from bill_tracker.db.backup_io import describe_backup
+
+        self.reset()
+        self.generate(size, seed)
+        full = self.measure(size, 'backup_full', lambda: self.db.backup_all_data(force=True, kind='full'))
+        full_path = full['backup_path']
+        snapshot_bytes = dir_size(self.workdir)
+
+        self.modify(size, seed)
+        # 快照文件名精确到秒，避免与全量基线重名
+        time.sleep(1.1)
+        self.measure(size, 'backup_incremental', lambda: self.db.backup_all_data(force=True))
+
+        # parse_backup_file 命中备份索引；describe_backup 是索引未命中时读取文件头部/尾部的路径
+        self.measure(
+            size, f'parse_backup_file×{self.repeat}',
+            lambda: [self.db.parse_backup_file(full_path) for _ in range(self.repeat)],
+            documents=0, input_bytes=0,
+        )
+        self.measure(
+            size, f'describe_backup×{self.repeat}',
+            lambda: [describe_backup(full_path) for _ in range(self.repeat)],
+            documents=0, input_bytes=0,
+        )
+        self.measure(
+            size, f'list_backup_files×{self.repeat}',
+            lambda: [self.db.list_backup_files(include_pre_restore=True) for _ in range(self.repeat)],
+            documents=0, input_bytes=0,
+        )
+
+        for mode in (RESTORE_MODE_MERGE, RESTORE_MODE_BILLS_ONLY, RESTORE_MODE_FULL_REPLACE):
+            self.measure(
+                size, f'restore_{mode}',
+                lambda mode=mode: self.db.restore_from_backup(full_path, mode=mode, pre_restore=self.pre_restore),
+                documents=full['total_documents'], input_bytes=snapshot_bytes,
+            )
+
+
+def environment_info(db):
+    from bill_tracker.db.backup_io import BACKUP_ENCODING, BACKUP_FORMAT
+    from bill_tracker.db.parallel_backup import BACKUP_WORKERS
+    import pymongo
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        server_version = db.maintenance_client.server_info().get('version')
+    except Exception:
+        server_version = None
+    return {
+        'time': datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pymongo': pymongo.version,
+        'mongodb': server_version,
+        'cpu_count': os.cpu_count(),
+        'backup_format': BACKUP_FORMAT,
+        'backup_encoding': BACKUP_ENCODING,
+        'backup_workers': BACKUP_WORKERS,
+    }
+
+
+def compare(results, baseline_path, threshold):
+    """
+    与基线结果对比吞吐（条/秒，没有时用耗时），返回回退项列表
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['size'], r['operation']): r for r in json.load(f)['results']}
+    regressions = []
+    print(f"\n与基线对比: {baseline_path}")
+    for row in results:
+        base = baseline.get((row['size'], row['operation']))
+        if not base:
+            continue
+        if row.get('docs_per_second') and base.get('docs_per_second'):
+            change = row['docs_per_second'] / base['docs_per_second'] - 1
+        else:
+            change = base['wall_seconds'] / row['wall_seconds'] - 1 if row['wall_seconds'] else 0
+        rss_change = row['peak_rss_mb'] - base['peak_rss_mb']
+        flag = ''
+        if change < -threshold:
+            flag = '  ← 回退'
+            regressions.append({**row, 'change': round(change, 4)})
+        print(
+            f"{row['size']:>9,}  {row['operation']:<22} 吞吐 {change:+7.1%}  "
+            f"耗时 {base['wall_seconds']:.3f}s → {row['wall_seconds']:.3f}s  RSS {rss_change:+.1f} MB{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='备份/恢复基准测试（合成数据，需专用 mongod）')
+    parser.add_argument('--uri', required=True, help='专用 mongod 的连接串（库 bill_tracker 会被清空）')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='账单条数规模')
+    parser.add_argument('--repeat', type=int, default=20, help='parse/list 的重复次数')
+    parser.add_argument('--pre-restore', choices=['snapshot', 'shadow'], default='snapshot', help='恢复前安全网')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', default=None, help='快照工作目录（默认临时目录，结束后删除）')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='结果 JSON')
+    parser.add_argument('--baseline', default=None, help='对比的基线结果 JSON')
+    parser.add_argument('--threshold', type=float, default=0.10, help='吞吐下降超过该比例视为回退（默认 0.10）')
+    parser.add_argument('--fail-on-regression', action='store_true', help='有回退时以状态码 1 退出')
+    parser.add_argument('--wipe', action='store_true', help='确认清空目标库中已有的数据')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='jz-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    # 须在导入 bill_tracker.db 之前设置：连接、快照目录与日志目录都指向基准环境
+    os.environ['MONGO_URI'] = args.uri
+    os.environ['DATA_DIR'] = workdir
+    os.environ['LOG_DIR'] = os.path.join(workdir, 'logs')
+
+    from bill_tracker.db import BillDatabase
+
+    db = BillDatabase()
+    try:
+        if not db.is_online:
+            sys.exit(f'无法连接 {args.uri}')
+        existing = db._maintenance_db()['bills'].estimated_document_count()
+        if existing and not args.wipe:
+            sys.exit(f'目标库 bill_tracker 已有 {existing:,} 条账单；确认是专用实例后加 --wipe 重新运行')
+
+        bench = Benchmark(db, workdir, args.repeat, args.pre_restore)
+        print(f"工作目录: {workdir}")
+        for size in args.sizes:
+            bench.run_size(size, args.seed)
+        bench.reset()
+
+        report = {'environment': environment_info(db), 'sizes': args.sizes, 'results': bench.results}
+        regressions = compare(bench.results, args.baseline, args.threshold) if args.baseline else []
+        report['regressions'] = regressions
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {args.output}")
+    finally:
+        db.close()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
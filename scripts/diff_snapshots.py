@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+对比两份快照：逐条列出新增、删除与修改的账单，并按年份/分类汇总条数与金额变化
+
+两份快照按 _id 流式归并（支持 .jzb 与 .json，增量快照按整条链还原），
+内存与快照大小无关，不需要连接数据库。
+
+使用方法:
+    python scripts/diff_snapshots.py data/snapshots/bills_backup_20250101_030000.jzb data/snapshots/bills_backup_20250201_030000.jzb
+    python scripts/diff_snapshots.py OLD NEW --years 2024 --limit 50
+    python scripts/diff_snapshots.py OLD NEW --output changes.ndjson   # 全部变化写为扩展 JSON 行
+"""
+import argparse
+import sys
+from pathlib import Path
+
+from bson import json_util
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bill_tracker.db import SnapshotDiff
+from bill_tracker.money import format_yuan
+
+
+def describe(change):
+    doc = change['new'] or change['old']
+    line = f"{change['change']:<8} {change['_id']}  {doc.get('bill_date', '-')}  {doc.get('category', '-')}"
+    if change.get('fields'):
+        line += f"  字段: {', '.join(change['fields'])}"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比两份快照')
+    parser.add_argument('old', help='较早的快照')
+    parser.add_argument('new', help='较新的快照')
+    parser.add_argument('--collection', default='bills', help='对比的集合（默认 bills）')
+    parser.add_argument('--years', nargs='*', default=None, help='只对比这些年份')
+    parser.add_argument('--limit', type=int, default=20, help='终端最多列出的变化条数')
+    parser.add_argument('-o', '--output', default=None, help='把全部变化写入文件（每行一条扩展 JSON）')
+    args = parser.parse_args()
+
+    diff = SnapshotDiff(args.old, args.new, args.collection, args.years)
+    out = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        shown = 0
+        for change in diff.changes():
+            if out:
+                out.write(json_util.dumps(change, ensure_ascii=False) + '\n')
+            if shown < args.limit:
+                print(describe(change))
+                shown += 1
+    finally:
+        if out:
+            out.close()
+
+    summary = diff.summary
+    print(
+        f"\n新增 {summary['added']:,} · 删除 {summary['removed']:,} · "
+        f"修改 {summary['modified']:,} · 不变 {summary['unchanged']:,}"
+    )
+    rows = diff.aggregate_rows()
+    if rows:
+        print('\n年份  分类  条数变化  金额变化（元）')
+        for row in rows:
+            print(f"{row['year']}  {row['category']}  {row['count']:+,}  {format_yuan(row['amount_cents'], prefix='')}")
+    if args.output:
+        print(f"\n全部变化已写入: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+将备份导出为 MongoDB 扩展 JSON，供人工查看
+
+3.1 容器内为二进制 BSON，无法直接阅读；导出文件保留 ObjectId、日期等类型标记，
+结构与 2.1 JSON 相同，也可以直接在「数据恢复」中预览与恢复。
+
+使用方法:
+    python scripts/export_backup_json.py data/snapshots/bills_backup_20250101_030000.jzb
+    python scripts/export_backup_json.py data/snapshots/bills_backup_20250101_030000.jzb -o /tmp/backup.json
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bill_tracker.db import export_backup_json
+
+
+def main():
+    parser = argparse.ArgumentParser(description='将备份导出为扩展 JSON')
+    parser.add_argument('backup', help='备份文件路径（.jzb 或 .json）')
+    parser.add_argument('-o', '--output', default=None, help='导出路径，默认为当前目录下的 <备份名>.export.json')
+    args = parser.parse_args()
+
+    name = os.path.splitext(os.path.basename(args.backup))[0]
+    output = args.output or f'{name}.export.json'
+    counts = export_backup_json(args.backup, output)
+    for collection_name, count in counts.items():
+        print(f"{collection_name}: {count} 条")
+    print(f"已导出: {output}")
+
+
+if __name__ == '__main__':
+    main()
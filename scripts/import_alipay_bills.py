@@ -21,6 +21,7 @@ from dotenv import load_dotenv
 
 from bill_tracker.db import BillDatabase
 from bill_tracker.import_ import AlipayBillProcessor
+from bill_tracker.money import format_yuan
 from bill_tracker.paths import csv_dir, get_log_dir
 
 load_dotenv()
@@ -84,8 +85,8 @@ class AlipayBillImporter:
                 for category, count in category_stats.items():
                     print(f"  - {category}: {count} 条")
                 
-                total_amount = sum(bill['amount'] for bill in processed_bills)
-                print(f"  - 总金额: ¥{abs(total_amount):.2f}")
+                total_amount = sum(bill['amount_cents'] for bill in processed_bills)
+                print(f"  - 总金额: {format_yuan(abs(total_amount), prefix='¥', thousands=False)}")
             
             # 显示无法分类的账单
             if unclassified_bills:
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+索引建议工具
+
+根据应用运行时记录的查询形状（query_shapes 集合）推荐复合/覆盖索引，
+按预计节省的扫描文档数排序；确认后创建索引并用 explain 校验执行计划变化。
+
+使用方法:
+    python scripts/index_advisor.py            # 仅查看建议
+    python scripts/index_advisor.py --apply    # 逐条确认后创建
+    python scripts/index_advisor.py --apply --yes --limit 3
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bill_tracker.db import BillDatabase
+
+
+def format_keys(keys):
+    return ', '.join(f"{field}:{direction}" for field, direction in keys)
+
+
+def print_proposal(idx, proposal):
+    plan = proposal['current_plan']
+    print(f"[{idx}] {proposal['collection']} {{{format_keys(proposal['keys'])}}}"
+          f"{' (覆盖索引)' if proposal['covering'] else ''}")
+    print(f"    查询次数: {proposal['query_count']:,} · 预计节省扫描文档: {proposal['estimated_docs_saved']:,}")
+    print(f"    当前计划: {' <- '.join(plan['stages'])} · 单次扫描文档: {plan['docs_examined']:,}")
+    if proposal['unindexable_fields']:
+        print(f"    无法走索引边界的谓词: {', '.join(proposal['unindexable_fields'])}（$expr/正则）")
+    for shape in proposal['shapes']:
+        print(f"    - {shape}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='基于查询形状统计的索引建议')
+    parser.add_argument('--apply', action='store_true', help='创建建议的索引（默认逐条确认）')
+    parser.add_argument('--yes', action='store_true', help='配合 --apply，不再逐条确认')
+    parser.add_argument('--limit', type=int, default=10, help='最多展示的建议数')
+    parser.add_argument('--min-count', type=int, default=1, help='形状最少出现次数')
+    args = parser.parse_args()
+
+    db = BillDatabase()
+    try:
+        advisor = db.get_index_advisor()
+        proposals = advisor.propose(limit=args.limit, min_count=args.min_count)
+        if not proposals:
+            print('暂无索引建议（查询形状不足或已有索引覆盖）')
+            return
+
+        for idx, proposal in enumerate(proposals, 1):
+            print_proposal(idx, proposal)
+            if not args.apply:
+                continue
+            if not args.yes:
+                answer = input('    创建该索引? [y/N] ').strip().lower()
+                if answer != 'y':
+                    continue
+            result = advisor.apply(proposal)
+            before, after = result['before'], result['after']
+            status = '✅ 计划已改善' if result['verified'] else '⚠️ 计划未按预期变化，请人工检查'
+            print(f"    {status}: {result['index_name']} · 扫描文档 "
+                  f"{before['docs_examined']:,} -> {after['docs_examined']:,} · "
+                  f"{' <- '.join(after['stages'])}")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,8 @@
 
 这个脚本可以作为定时任务运行，自动执行智能备份：
 - 只有数据发生变化时才会创建新备份
-- 自动清理旧备份，保留最新5份
+- 默认写增量快照（只含变化的文档），链长达到上限时写全量基线
+- 自动清理旧备份，保留最新5条快照链
 - 记录备份日志
 
 使用方法：
@@ -53,16 +54,21 @@ def run_scheduled_backup():
         # 执行智能备份
         backup_result = db.backup_all_data(force=False)
         
-        if backup_result.get('success', False):
+        if backup_result.get('busy', False):
+            # 其他主机/进程正在备份或恢复（维护租约），本次无需重复执行
+            logger.info(f"跳过: {backup_result.get('message')}")
+        elif backup_result.get('success', False):
             if backup_result.get('skipped', False):
                 logger.info("数据未发生变化，跳过备份")
                 logger.info(f"当前数据哈希: {backup_result.get('current_hash', 'N/A')}")
             else:
                 logger.info("备份完成")
-                logger.info(f"备份文件: {backup_result.get('backup_path', 'N/A')}")
+                logger.info(f"备份文件: {backup_result.get('backup_path', 'N/A')}（{backup_result.get('backup_kind', 'full')}）")
                 logger.info(f"备份记录数: {backup_result.get('total_documents', 0):,}")
                 logger.info(f"文件大小: {backup_result.get('file_size_mb', 0):.2f} MB")
                 logger.info(f"数据哈希: {backup_result.get('data_hash', 'N/A')}")
+                if backup_result.get('snapshot_fallback'):
+                    logger.warning(f"未使用快照读: {backup_result['snapshot_fallback']}")
         else:
             logger.error(f"备份失败: {backup_result.get('message', '未知错误')}")
             return False
@@ -0,0 +1,152 @@
+"""2.1 JSON 增量解析（_JsonStream）与恢复检查点的断点续传。"""
+import io
+import json
+
+import pytest
+from bson import json_util
+
+from bill_tracker.db.backup_io import JsonBackupReader, _JsonStream
+from bill_tracker.db.restore_checkpoint import RestoreCheckpoint
+
+DOCUMENT = {
+    'databases': {
+        'bill_tracker': {
+            'collections': {
+                'categories': {'count': 1, 'documents': [{'_id': 1, 'name': '餐饮'}]},
+                'bills': {
+                    'count': 3,
+                    'documents': [
+                        {'_id': 1, 'amount_cents': 123456, 'note': '工资，含 "引号" 与 \\ 反斜杠'},
+                        {'_id': 2, 'amount_cents': -1, 'rate': 1.5e-3, 'tags': [], 'extra': None},
+                        {'_id': 3, 'amount_cents': 0, 'flags': [True, False], 'nested': {'a': [1, {}]}},
+                    ],
+                },
+            },
+        },
+    },
+    'backup_info': {'version': '2.1', 'database_name': 'bill_tracker'},
+}
+
+
+def _stream(text, block_size):
+    return _JsonStream(io.StringIO(text), block_size=block_size)
+
+
+def _walk(stream):
+    """用 keys/items/value 逐层还原整个值（与读取器的遍历方式一致）"""
+    char = stream.peek()
+    if char == '{':
+        return {key: _walk(stream) for key in stream.keys()}
+    if char == '[':
+        return [_walk(stream) for _ in stream.items()]
+    return stream.value()
+
+
+@pytest.mark.parametrize('block_size', [1, 2, 3, 7, 64])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_walk_matches_json_loads_for_any_chunking(block_size, indent):
+    text = json.dumps(DOCUMENT, ensure_ascii=False, indent=indent)
+    assert _walk(_stream(text, block_size)) == DOCUMENT
+
+
+@pytest.mark.parametrize('block_size', range(1, 12))
+@pytest.mark.parametrize('number', ['123456', '-1.25', '1.5e-3', '2E+10', '-0', '0.125'])
+def test_numbers_split_by_block_boundary(block_size, number):
+    text = f'[{number}, {number}]'
+    stream = _stream(text, block_size)
+    assert [stream.value() for _ in stream.items()] == json.loads(text)
+
+
+@pytest.mark.parametrize('block_size', [1, 4])
+def test_top_level_scalar_at_end_of_file(block_size):
+    assert _stream('  31415  ', block_size).value() == 31415
+    assert _stream('31415', block_size).value() == 31415
+
+
+@pytest.mark.parametrize('block_size', [1, 5])
+def test_skip_leaves_stream_at_next_member(block_size):
+    text = json.dumps(DOCUMENT)
+    stream = _stream(text, block_size)
+    seen = []
+    for key in stream.keys():
+        if key == 'backup_info':
+            seen.append(stream.value())
+        else:
+            stream.skip()
+    assert seen == [DOCUMENT['backup_info']]
+
+
+def test_empty_containers():
+    stream = _stream('{"a": {}, "b": []}', 1)
+    assert _walk(stream) == {'a': {}, 'b': []}
+
+
+@pytest.mark.parametrize('text', ['{"a": 1', '[1, 2', '{"a" 1}', '[1 2]', '{"a": "unterminated'])
+def test_truncated_or_malformed_json_raises(text):
+    with pytest.raises(ValueError):
+        _walk(_stream(text, 2))
+
+
+class _SmallBlockReader(JsonBackupReader):
+    """每次只读 16 个字符，让文档跨越多个读缓冲"""
+
+    def _open_stream(self):
+        f = open(self.path, 'r', encoding='utf-8')
+        return f, _JsonStream(f, object_hook=json_util.object_hook, block_size=16)
+
+
+def test_json_backup_reader_streams_documents_in_order(tmp_path, monkeypatch):
+    path = tmp_path / 'backup.json'
+    path.write_text(json.dumps(DOCUMENT, ensure_ascii=False, indent=2), encoding='utf-8')
+    monkeypatch.setattr('bill_tracker.db.backup_io.BACKUP_BATCH_SIZE', 2)
+    with _SmallBlockReader(str(path)) as reader:
+        assert reader.database_name == 'bill_tracker'
+        assert sorted(reader.collection_names()) == ['bills', 'categories']
+        batches = list(reader.iter_document_batches('bills'))
+    assert [len(batch) for batch in batches] == [2, 1]
+    bills = DOCUMENT['databases']['bill_tracker']['collections']['bills']['documents']
+    assert [doc for batch in batches for doc in batch] == bills
+
+
+def test_checkpoint_resumes_from_last_batch(tmp_path):
+    path = str(tmp_path / 'restore_checkpoint.json')
+    params = {'backup_path': 'snap.jzb', 'mode': 'full_replace'}
+
+    checkpoint = RestoreCheckpoint(path)
+    checkpoint.start(params, pre_restore_path='pre.jzb')
+    checkpoint.stage('bills', 10)
+    checkpoint.complete(0, 'categories', {'categories': 1})
+    checkpoint.update(0, 'bills', 2000, {'categories': 1, 'bills': 2000})
+
+    # 进程中断后重新读取
+    resumed = RestoreCheckpoint(path)
+    state = resumed.load()
+    assert state['params'] == params
+    assert state['pre_restore_path'] == 'pre.jzb'
+    assert resumed.is_completed(0, 'categories')
+    assert not resumed.is_completed(0, 'bills')
+    assert resumed.resume_offset(0, 'bills') == 2000
+    # 其他层或其他集合从头开始
+    assert resumed.resume_offset(1, 'bills') == 0
+    assert resumed.resume_offset(0, 'accounts') == 0
+    assert resumed.staged == {'bills': 10}
+    assert resumed.state['stats'] == {'categories': 1, 'bills': 2000}
+
+    resumed.complete(0, 'bills', {'categories': 1, 'bills': 2500})
+    again = RestoreCheckpoint(path)
+    again.load()
+    assert again.is_completed(0, 'bills')
+    assert again.resume_offset(0, 'bills') == 0
+
+    again.clear()
+    assert RestoreCheckpoint(path).load() is None
+    assert not (tmp_path / 'restore_checkpoint.json.tmp').exists()
+
+
+def test_checkpoint_missing_or_corrupt_is_ignored(tmp_path):
+    path = tmp_path / 'restore_checkpoint.json'
+    assert RestoreCheckpoint(str(path)).load() is None
+    path.write_text('{"params": ', encoding='utf-8')
+    assert RestoreCheckpoint(str(path)).load() is None
+    # 清除不存在的检查点不报错
+    RestoreCheckpoint(str(tmp_path / 'missing.json')).clear()
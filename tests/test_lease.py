@@ -0,0 +1,118 @@
+"""维护租约的获取、过期接管与防护令牌（mongomock）。"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from bill_tracker.db.lease import (
+    LEASE_COLLECTION,
+    MAINTENANCE_LEASE,
+    LeaseBusyError,
+    LeaseLostError,
+    MaintenanceLease,
+)
+
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()['bill_tracker_test']
+
+
+@pytest.fixture
+def leases(db):
+    """创建租约（心跳间隔足够长，测试期间不会自动续期），结束时全部释放"""
+    created = []
+
+    def make(purpose='backup', ttl_seconds=60):
+        lease = MaintenanceLease(db, purpose, ttl_seconds=ttl_seconds)
+        created.append(lease)
+        return lease
+
+    yield make
+    for lease in created:
+        lease.release()
+
+
+def _record(db):
+    return db[LEASE_COLLECTION].find_one({'_id': MAINTENANCE_LEASE})
+
+
+def _expire(db):
+    """模拟持有者停顿超过 TTL"""
+    db[LEASE_COLLECTION].update_one(
+        {'_id': MAINTENANCE_LEASE},
+        {'$set': {'expires_at': datetime.utcnow() - timedelta(seconds=1)}},
+    )
+
+
+def test_acquire_records_holder_and_first_token(db, leases):
+    lease = leases('backup')
+    assert lease.acquire() == 1
+    record = _record(db)
+    assert record['owner'] == lease.owner
+    assert record['holder']['purpose'] == 'backup'
+    assert record['expires_at'] > datetime.utcnow()
+    lease.check()
+
+
+def test_second_holder_is_refused_while_lease_is_live(db, leases):
+    first = leases('backup')
+    first.acquire()
+    second = leases('restore')
+    with pytest.raises(LeaseBusyError, match='backup'):
+        second.acquire()
+    assert second.token is None
+    assert _record(db)['owner'] == first.owner
+    first.check()
+
+
+def test_release_lets_the_next_holder_in_with_a_higher_token(db, leases):
+    first = leases('backup')
+    first.acquire()
+    first.release()
+    assert first.token is None
+    assert _record(db)['owner'] is None
+    # 令牌保留并递增，不会与旧持有者重复
+    assert leases('restore').acquire() == 2
+
+
+def test_expired_lease_is_taken_over_and_old_holder_is_fenced(db, leases):
+    stale = leases('backup')
+    stale.acquire()
+    _expire(db)
+
+    fresh = leases('restore')
+    assert fresh.acquire() == 2
+    # 旧持有者恢复运行：续期与 check() 都因令牌不符而失败
+    assert stale.renew() is False
+    assert stale.lost
+    with pytest.raises(LeaseLostError):
+        stale.check()
+    # 旧持有者释放不影响新持有者
+    stale.release()
+    assert _record(db)['owner'] == fresh.owner
+    fresh.check()
+
+
+def test_renew_extends_expiry_for_current_holder(db, leases):
+    lease = leases('backup', ttl_seconds=30)
+    lease.acquire()
+    _expire(db)
+    assert lease.renew() is True
+    assert _record(db)['expires_at'] > datetime.utcnow() + timedelta(seconds=20)
+    # 续期后不再能被接管
+    with pytest.raises(LeaseBusyError):
+        leases('restore').acquire()
+
+
+def test_check_fails_once_record_no_longer_matches(db, leases):
+    lease = leases('backup')
+    lease.acquire()
+    db[LEASE_COLLECTION].update_one({'_id': MAINTENANCE_LEASE}, {'$inc': {'token': 1}})
+    with pytest.raises(LeaseLostError):
+        lease.check()
+    # 已标记丢失后不再查库
+    db[LEASE_COLLECTION].update_one({'_id': MAINTENANCE_LEASE}, {'$inc': {'token': -1}})
+    with pytest.raises(LeaseLostError):
+        lease.check()
@@ -0,0 +1,87 @@
+"""金额换算：元 -> 整数分的十进制四舍五入、展示格式与旧版元键兼容。"""
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+from bill_tracker.money import (
+    bill_amount_cents,
+    format_yuan,
+    to_cents,
+    with_yuan_amounts,
+    yuan_columns,
+)
+
+
+@pytest.mark.parametrize('value, cents', [
+    ('1,234.565', 123457),
+    ('-1,234.565', -123457),
+    ('-0.005', -1),
+    ('0.005', 1),
+    ('-0.004', 0),
+    ('0.125', 13),
+    ('0.285', 29),
+    (' ¥1,000 ', 100000),
+    ('￥-12.3', -1230),
+    ('1e2', 10000),
+    (Decimal('2.675'), 268),
+    (0.285, 29),
+    (1.005, 101),
+    (-1234.565, -123457),
+    (0.1 + 0.2, 30),
+    (12, 1200),
+    (-3, -300),
+])
+def test_to_cents_rounds_half_up_in_decimal(value, cents):
+    assert to_cents(value) == cents
+    assert isinstance(to_cents(value), int)
+
+
+@pytest.mark.parametrize('value', [None, True, False, '', 'abc', '1.2.3', 'nan', 'inf',
+                                   float('nan'), float('-inf'), Decimal('NaN')])
+def test_to_cents_rejects_invalid_amounts(value):
+    with pytest.raises(ValueError):
+        to_cents(value)
+
+
+@pytest.mark.parametrize('cents, text', [
+    (123456, '¥ 1,234.56'),
+    (-123456, '¥ -1,234.56'),
+    (-1, '¥ -0.01'),
+    (0, '¥ 0.00'),
+    (100000000, '¥ 1,000,000.00'),
+])
+def test_format_yuan(cents, text):
+    assert format_yuan(cents) == text
+
+
+def test_format_yuan_options():
+    assert format_yuan(123456, prefix='', thousands=False) == '1234.56'
+
+
+def test_bill_amount_cents_reads_new_and_legacy_documents():
+    assert bill_amount_cents({'amount_cents': 150, 'amount': 9.99}) == 150
+    assert bill_amount_cents({'amount': -1234.565}) == -123457
+    assert bill_amount_cents({'amount': None}) == 0
+    assert bill_amount_cents({}) == 0
+
+
+def test_with_yuan_amounts_keeps_cent_keys_and_adds_yuan_keys():
+    summary = {'income_cents': 123456, 'expense_cents': -1, 'count': 3}
+    out = with_yuan_amounts(summary)
+    assert out == {'income_cents': 123456, 'expense_cents': -1, 'count': 3,
+                   'income': 1234.56, 'expense': -0.01}
+    assert summary == {'income_cents': 123456, 'expense_cents': -1, 'count': 3}
+
+
+def test_with_yuan_amounts_and_yuan_columns_on_dataframes():
+    df = pd.DataFrame({'category': ['餐饮', '工资'], 'amount_cents': [-1250, 800000]})
+    legacy = with_yuan_amounts(df)
+    assert list(legacy.columns) == ['category', 'amount_cents', 'amount']
+    assert legacy['amount'].tolist() == [-12.5, 8000.0]
+    assert 'amount' not in df.columns
+
+    # 展示时以整数分换算的列为准，不出现重复的 amount 列
+    shown = yuan_columns(legacy)
+    assert list(shown.columns) == ['category', 'amount']
+    assert shown['amount'].tolist() == [-12.5, 8000.0]
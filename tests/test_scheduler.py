@@ -0,0 +1,190 @@
+"""备份调度器的触发条件、失败退避与定时抖动（替身数据库，不需要 MongoDB）。"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from bill_tracker.db import scheduler as scheduler_module
+from bill_tracker.db.scheduler import (
+    BACKUP_RETRY_SECONDS,
+    TRIGGER_IDLE,
+    TRIGGER_INTERVAL,
+    TRIGGER_RETRY,
+    TRIGGER_STARTUP,
+    TRIGGER_WRITES,
+    BackupScheduler,
+    load_scheduler_state,
+)
+
+
+class FakeWriteCounter:
+    def __init__(self):
+        self.count = 0
+        self.last_write_at = None
+        self.error = None
+
+    def read(self):
+        if self.error:
+            raise self.error
+        return {'count': self.count, 'last_write_at': self.last_write_at}
+
+
+class FakeDatabase:
+    """只实现调度器用到的 write_counter 与 backup_all_data；results 为依次返回的备份结果"""
+
+    def __init__(self):
+        self.write_counter = FakeWriteCounter()
+        self.results = []
+        self.calls = 0
+
+    def write(self, n, at):
+        self.write_counter.count += n
+        self.write_counter.last_write_at = at
+
+    def backup_all_data(self, force=False):
+        self.calls += 1
+        result = self.results.pop(0) if self.results else {'success': True, 'message': 'ok'}
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def upper_jitter(monkeypatch):
+    """random.uniform 固定取上界，抖动与退避可精确断言"""
+    monkeypatch.setattr(scheduler_module.random, 'uniform', lambda a, b: b)
+
+
+@pytest.fixture
+def db():
+    return FakeDatabase()
+
+
+def _scheduler(db, tmp_path, **kwargs):
+    options = dict(interval_seconds=3600, write_threshold=10, idle_seconds=300, jitter_seconds=60,
+                   poll_seconds=1, max_backoff_seconds=600)
+    options.update(kwargs)
+    return BackupScheduler(db, state_path=str(tmp_path / 'backup_scheduler.json'), **options)
+
+
+def _finished_at(scheduler):
+    return datetime.fromisoformat(scheduler.state['last_run']['finished_at'])
+
+
+def test_first_run_backs_up_at_startup_and_schedules_with_jitter(db, tmp_path, upper_jitter):
+    scheduler = _scheduler(db, tmp_path)
+    assert scheduler.tick() == TRIGGER_STARTUP
+    assert db.calls == 1
+    assert scheduler.timer_due == _finished_at(scheduler) + timedelta(seconds=3600 + 60)
+    assert scheduler.state['next_run']['reason'] == TRIGGER_INTERVAL
+    # 没有写入、未到定时：不备份
+    assert scheduler.tick() is None
+    assert db.calls == 1
+
+
+def test_jitter_stays_within_configured_range(db, tmp_path):
+    scheduler = _scheduler(db, tmp_path, jitter_seconds=60)
+    since = datetime(2024, 1, 1)
+    offsets = {(scheduler._next_timer(since) - since).total_seconds() for _ in range(200)}
+    assert all(3600 <= offset <= 3660 for offset in offsets)
+    assert len(offsets) > 1
+    assert _scheduler(db, tmp_path, jitter_seconds=0)._next_timer(since) == since + timedelta(seconds=3600)
+
+
+def test_write_threshold_triggers_backup(db, tmp_path):
+    scheduler = _scheduler(db, tmp_path)
+    scheduler.tick()
+    now = datetime.utcnow()
+    db.write(9, now)
+    assert scheduler.tick(now) is None
+    assert scheduler.state['pending_writes'] == 9
+    assert scheduler.state['next_run']['writes_until_threshold'] == 1
+    db.write(1, now)
+    assert scheduler.tick(now) == TRIGGER_WRITES
+    assert scheduler.state['writes_at_last_backup'] == 10
+    assert scheduler.state['pending_writes'] == 0
+
+
+def test_idle_triggers_after_burst_of_writes_ends(db, tmp_path):
+    scheduler = _scheduler(db, tmp_path)
+    scheduler.tick()
+    last_write = datetime.utcnow()
+    db.write(3, last_write)
+    assert scheduler.tick(last_write + timedelta(seconds=299)) is None
+    # 空闲触发早于定时，预计下次为空闲
+    assert scheduler.state['next_run']['reason'] == TRIGGER_IDLE
+    assert scheduler.tick(last_write + timedelta(seconds=300)) == TRIGGER_IDLE
+    assert db.calls == 2
+
+
+def test_interval_triggers_without_writes(db, tmp_path):
+    scheduler = _scheduler(db, tmp_path)
+    scheduler.tick()
+    assert scheduler.tick(scheduler.timer_due - timedelta(seconds=1)) is None
+    assert scheduler.tick(scheduler.timer_due) == TRIGGER_INTERVAL
+    assert db.calls == 2
+
+
+def test_failures_back_off_exponentially_up_to_the_cap(db, tmp_path, upper_jitter):
+    scheduler = _scheduler(db, tmp_path, max_backoff_seconds=300)
+    db.results = [{'success': False, 'message': 'boom'}] * 4 + [RuntimeError('down')]
+    expected = [BACKUP_RETRY_SECONDS * 2 ** i for i in range(5)]
+    for failures, delay in enumerate(expected, start=1):
+        trigger = scheduler.tick(scheduler.retry_at)
+        assert trigger == (TRIGGER_STARTUP if failures == 1 else TRIGGER_RETRY)
+        assert scheduler.state['failures'] == failures
+        assert scheduler.state['status'] == 'backoff'
+        # 退避时间在 [delay, delay * 1.2] 内抖动，这里取上界
+        capped = min(delay, 300)
+        assert scheduler.retry_at == _finished_at(scheduler) + timedelta(seconds=capped * 1.2)
+        # 未到重试时间：即使写入已达阈值也不备份
+        db.write(100, datetime.utcnow())
+        assert scheduler.tick(scheduler.retry_at - timedelta(seconds=1)) is None
+        assert scheduler.state['next_run'] == {'due_at': scheduler.retry_at.isoformat(), 'reason': TRIGGER_RETRY}
+    assert scheduler.state['last_run']['message'] == 'down'
+
+    assert scheduler.tick(scheduler.retry_at) == TRIGGER_RETRY
+    assert scheduler.state['failures'] == 0
+    assert scheduler.state['status'] == 'waiting'
+    assert scheduler.retry_at is None
+
+
+def test_busy_lease_postpones_without_counting_a_failure(db, tmp_path, upper_jitter):
+    scheduler = _scheduler(db, tmp_path)
+    db.results = [{'success': False, 'busy': True, 'message': '另一个备份/恢复任务正在进行'}]
+    assert scheduler.tick() == TRIGGER_STARTUP
+    assert scheduler.state['failures'] == 0
+    assert scheduler.state['status'] == 'waiting'
+    assert scheduler.retry_at == _finished_at(scheduler) + timedelta(seconds=BACKUP_RETRY_SECONDS * 1.2)
+    assert scheduler.timer_due is None
+    assert scheduler.tick(scheduler.retry_at) == TRIGGER_RETRY
+    assert scheduler.retry_at is None
+    assert scheduler.timer_due is not None
+
+
+def test_restart_keeps_write_baseline_and_timer(db, tmp_path, upper_jitter):
+    first = _scheduler(db, tmp_path)
+    db.write(5, datetime.utcnow())
+    first.tick()
+    state = load_scheduler_state(first.state_path)
+    assert state['writes_at_last_backup'] == 5
+
+    # 重启：不再做启动备份，定时从上次成功时间起算
+    db.write(4, datetime.utcnow())
+    second = _scheduler(db, tmp_path)
+    assert second.timer_due == datetime.fromisoformat(state['last_success_at']) + timedelta(seconds=3660)
+    assert second.tick() is None
+    assert second.state['pending_writes'] == 4
+    assert db.calls == 1
+
+
+def test_counter_reset_or_read_error_does_not_trigger(db, tmp_path):
+    scheduler = _scheduler(db, tmp_path)
+    db.write(50, datetime.utcnow())
+    scheduler.tick()
+    # 计数被重置（如恢复后）：以当前计数为新基线
+    db.write_counter.count = 3
+    assert scheduler.tick() is None
+    assert scheduler.state['writes_at_last_backup'] == 3
+    db.write_counter.error = RuntimeError('connection refused')
+    assert scheduler.tick() is None
+    assert scheduler.state['pending_writes'] == 0